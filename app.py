@@ -26,26 +26,137 @@ if not check_compatibility():
     sys.exit(1)
 
 # Import Flask only after compatibility check
-from flask import Flask, render_template, redirect, url_for, send_from_directory
+from flask import Flask, render_template, redirect, url_for, send_from_directory, jsonify, request, abort, g
+from werkzeug.utils import safe_join
 import os
 import json
-from run import main as run_preprocessing
+import threading
+from precompress import find_precompressed, guess_type
+from vendor_assets import IMMUTABLE_CACHE_CONTROL, VENDOR_DIR, VENDOR_MANIFEST, load_vendor_manifest
+from publish import get_site_root, build_snapshot, cache_for_root
 
-app = Flask(__name__)
+# serve_static() below handles /static, with precompressed files and cache headers
+app = Flask(__name__, static_folder=None)
+
+# Per-zipcode rankings of breeds and names, built once per snapshot on first use
+_zip_rankings = {}
+
+# Precomputed spatial statistics, loaded once per snapshot on first use
+_spatial_stats = {}
+
+# Precomputed borough and citywide roll-ups, loaded once per snapshot on first use
+_rollups = {}
+
+# {CDN url: file in static/vendor/} of each snapshot, loaded once on first use
+_vendor_manifests = {}
+
+@app.before_request
+def resolve_site_root():
+    """Serve the whole request from the snapshot published when it arrived; every cache is keyed on it"""
+    g.site_root = get_site_root()
+
+@app.context_processor
+def vendored_assets():
+    """vendored(url) in the templates: the published snapshot's vendored copy of a CDN asset, or the CDN url"""
+    manifest = cache_for_root(_vendor_manifests, g.site_root,
+                              lambda: load_vendor_manifest(site_path(VENDOR_MANIFEST)) or None) or {}
+    return {'vendored': lambda url: f'/{VENDOR_DIR}/{manifest[url]}' if url in manifest else url}
+
+def site_path(*parts):
+    """Path of a build output in the published snapshot"""
+    return os.path.join(g.site_root, *parts)
+
+def rebuild_site(*commands):
+    """Run build scripts in a new snapshot and publish it; returns False if another build is running"""
+    try:
+        build_snapshot(list(commands))
+        g.site_root = get_site_root()
+        return True
+    except RuntimeError:
+        return False
+
+# Build started by start_rebuild(), while it runs
+_background_build = None
+
+def start_rebuild(*commands):
+    """
+    Run build scripts in a new snapshot in a background thread, unless one is
+    already running, so the request can answer with processing.html right away.
+    The snapshot is published when the build succeeds.
+    """
+    global _background_build
+    def build():
+        try:
+            build_snapshot(list(commands))
+        except RuntimeError as e:
+            print(f"Build not started: {e}")
+        except Exception as e:
+            print(f"Build failed: {e}", file=sys.stderr)
+    if _background_build is None or not _background_build.is_alive():
+        _background_build = threading.Thread(target=build, daemon=True)
+        _background_build.start()
+
+def get_rollups():
+    """Return the cached borough roll-ups, or None if they haven't been built"""
+    from rollups import ROLLUPS_FILE, load_rollups
+    return cache_for_root(_rollups, g.site_root, lambda: load_rollups(site_path(ROLLUPS_FILE)))
+
+def send_precompressed(directory, filename):
+    """Send a file, or its build-time .br/.gz sibling when the client accepts that encoding"""
+    directory = site_path(directory)
+    path = safe_join(directory, filename)
+    if path is None:
+        abort(404)
+    compressed, encoding = find_precompressed(path, request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return send_from_directory(directory, filename)
+    
+    response = send_from_directory(directory, filename + compressed[len(path):], mimetype=guess_type(filename))
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def rank_entities_by_zipcode(entity_data, top_n=5):
+    """Invert {entity: {zipcode_counts}} data into {zipcode: top entities by count}"""
+    from zip_layer import normalize_zipcode
+    
+    by_zipcode = {}
+    for entity, info in entity_data.items():
+        for zipcode, count in info['zipcode_counts'].items():
+            by_zipcode.setdefault(normalize_zipcode(zipcode), []).append((entity, count))
+    
+    return {
+        zipcode: [{'name': entity, 'count': count}
+                  for entity, count in sorted(entries, key=lambda x: x[1], reverse=True)[:top_n]]
+        for zipcode, entries in by_zipcode.items()
+    }
+
+def get_zip_rankings():
+    """Return the cached per-zipcode breed and name rankings"""
+    def load():
+        with open(site_path('data/popular_breeds.json'), 'r') as f:
+            breed_data = json.load(f)
+        with open(site_path('data/popular_names.json'), 'r') as f:
+            name_data = json.load(f)
+        return {
+            'breeds': rank_entities_by_zipcode(breed_data),
+            'names': rank_entities_by_zipcode(name_data)
+        }
+    return cache_for_root(_zip_rankings, g.site_root, load)
 
 @app.route('/')
 def index():
     # Check if data has been processed
-    if not os.path.exists('data/popular_breeds.json') or not os.path.exists('data/popular_names.json'):
+    if not os.path.exists(site_path('data/popular_breeds.json')) or not os.path.exists(site_path('data/popular_names.json')):
         # Run preprocessing and create maps if data doesn't exist
         return render_template('processing.html')
     
     # Load breed data
-    with open('data/popular_breeds.json', 'r') as f:
+    with open(site_path('data/popular_breeds.json'), 'r') as f:
         breed_data = json.load(f)
     
     # Load name data
-    with open('data/popular_names.json', 'r') as f:
+    with open(site_path('data/popular_names.json'), 'r') as f:
         name_data = json.load(f)
     
     # Filter for breeds and names with at least 500 dogs
@@ -61,29 +172,249 @@ def index():
                           names=sorted_names,
                           min_count=500)
 
+@app.route('/viewer')
+def viewer():
+    """Searchable single-page viewer covering every breed and name (data/viewer/ from viewer.py)"""
+    if not os.path.exists(site_path('data/viewer/breeds/index.json')):
+        if not os.path.exists(site_path('data/nycdogs_unique.csv')):
+            return render_template('processing.html')
+        start_rebuild(['viewer.py'])
+        return render_template('processing.html', building=True)
+    return send_precompressed('.', 'viewer.html')
+
+@app.route('/timeline')
+def timeline():
+    """Animated licence-year maps of the popular breeds and names (data/timeline/ from timeline.py)"""
+    if not os.path.exists(site_path('data/timeline/breeds/index.json')):
+        if not os.path.exists(site_path('data/nycdogs_unique.csv')):
+            return render_template('processing.html')
+        start_rebuild(['timeline.py'])
+        return render_template('processing.html', building=True)
+    return send_precompressed('.', 'timeline.html')
+
 @app.route('/process')
 def process():
-    """Run the data processing and map creation pipeline"""
+    """Run the data processing and map creation pipeline in a new snapshot, and publish it"""
     try:
-        run_preprocessing()
+        if not rebuild_site(['run.py']):
+            return render_template('processing.html')
         return redirect(url_for('index'))
     except Exception as e:
         return render_template('error.html', error=str(e))
 
+@app.route('/api/locate', methods=['GET', 'POST'])
+def locate():
+    """
+    Find the zip code containing one or more points along with its top breeds and names.
+    GET takes ?lat=...&lng=...; POST takes {"points": [[lat, lng], ...]} for bulk lookups.
+    """
+    from zip_layer import get_zip_locator
+    
+    try:
+        if request.method == 'POST':
+            points = (request.get_json(silent=True) or {}).get('points', [])
+            lats = [float(point[0]) for point in points]
+            lngs = [float(point[1]) for point in points]
+        else:
+            lats = [float(request.args['lat'])]
+            lngs = [float(request.args['lng'])]
+    except (KeyError, TypeError, ValueError, IndexError):
+        return jsonify({"error": "Expected numeric lat and lng values"}), 400
+    
+    zipcodes = get_zip_locator(g.site_root).locate(lats, lngs)
+    rankings = get_zip_rankings()
+    
+    results = []
+    for lat, lng, zipcode in zip(lats, lngs, zipcodes):
+        results.append({
+            'lat': lat,
+            'lng': lng,
+            'zipcode': zipcode,
+            'top_breeds': rankings['breeds'].get(zipcode, []) if zipcode else [],
+            'top_names': rankings['names'].get(zipcode, []) if zipcode else []
+        })
+    
+    if request.method == 'POST':
+        return jsonify(results)
+    if results[0]['zipcode'] is None:
+        return jsonify({"error": "Point is not inside an NYC zip code"}), 404
+    return jsonify(results[0])
+
+@app.route('/maps/thumbnails/<entity_type>/<filename>')
+def show_thumbnail(entity_type, filename):
+    """Serve a map thumbnail; the names are content-hashed, so they are cached forever"""
+    from entity_counts import ENTITY_TYPES
+    # Only the thumbnail directories, so '..' can't reach other files and cache them forever
+    if entity_type not in ENTITY_TYPES:
+        abort(404)
+    response = send_from_directory(site_path('maps/thumbnails', entity_type), filename)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
 @app.route('/maps/<map_type>/<map_name>')
 def show_map(map_type, map_name):
     """Display a specific map"""
-    return send_from_directory(f'maps/{map_type}', map_name)
+    return send_precompressed(f'maps/{map_type}', map_name)
+
+@app.route('/api/spatial/<entity_type>/<path:entity>')
+def spatial_stats(entity_type, entity):
+    """Return the precomputed Moran's I and Gi* hot spots for a breed or name"""
+    from spatial_stats import STATS_FILE, load_spatial_stats
+    
+    all_stats = cache_for_root(_spatial_stats, g.site_root, lambda: load_spatial_stats(site_path(STATS_FILE)))
+    if all_stats is None:
+        return jsonify({"error": "Spatial statistics have not been built"}), 503
+    
+    if entity_type not in ('breeds', 'names') or entity not in all_stats[entity_type]:
+        return jsonify({"error": f"No spatial statistics for {entity_type}/{entity}"}), 404
+    
+    stats = all_stats[entity_type][entity]
+    return jsonify({
+        **stats,
+        'entity': entity,
+        'g_star': dict(zip(all_stats['zipcodes'], stats['g_star']))
+    })
+
+@app.route('/api/metrics/<entity_type>/<path:entity>')
+def zip_metrics(entity_type, entity):
+    """Return per-zipcode count, percentage and density (dogs per km^2) for a breed or name"""
+    from entity_counts import compute_zip_metrics
+    from zip_layer import get_zip_areas
+    
+    if entity_type not in ('breeds', 'names'):
+        return jsonify({"error": f"Unknown entity type: {entity_type}"}), 404
+    
+    try:
+        with open(site_path(f'data/popular_{entity_type}.json'), 'r') as f:
+            entity_data = json.load(f)
+    except FileNotFoundError:
+        return jsonify({"error": f"The {entity_type} data has not been built"}), 503
+    if entity not in entity_data:
+        return jsonify({"error": f"{entity} not found"}), 404
+    
+    return jsonify({
+        'entity': entity,
+        'total_count': entity_data[entity]['total_count'],
+        'zipcodes': compute_zip_metrics(entity_data[entity], get_zip_areas(g.site_root))
+    })
+
+def get_compare_args():
+    """Return (entity_type, a, b, mode) from ?a=...&b=...&type=breeds&mode=difference, or None if a or b is missing"""
+    a, b = request.args.get('a'), request.args.get('b')
+    if not a or not b:
+        return None
+    return request.args.get('type', 'breeds'), a, b, request.args.get('mode', 'difference')
+
+@app.route('/api/compare')
+def compare_api():
+    """Return the per-zip difference or ratio of two breeds' or names' shares of their dogs"""
+    from compare import compare_entities
+
+    args = get_compare_args()
+    if args is None:
+        return jsonify({"error": "Expected two entities to compare as ?a=...&b=..."}), 400
+    try:
+        return jsonify(compare_entities(*args, root=g.site_root))
+    except FileNotFoundError:
+        return jsonify({"error": f"The {args[0]} data has not been built"}), 503
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except KeyError as e:
+        return jsonify({"error": f"{e.args[0]} not found"}), 404
+
+@app.route('/compare')
+def compare_map():
+    """Display the comparison map of two breeds or names"""
+    from compare import render_comparison_map
+
+    args = get_compare_args()
+    if args is None:
+        abort(400)
+    try:
+        return render_comparison_map(*args, root=g.site_root, vendor_url=f'/{VENDOR_DIR}')
+    except FileNotFoundError:
+        abort(503)
+    except ValueError:
+        abort(400)
+    except KeyError:
+        abort(404)
+
+@app.route('/api/boroughs/<entity_type>')
+def borough_rankings(entity_type):
+    """
+    Compare boroughs using the precomputed roll-ups.
+    ?borough=Brooklyn&top=10 ranks the borough's most common breeds or names.
+    """
+    rollups = get_rollups()
+    if rollups is None:
+        return jsonify({"error": "Borough roll-ups have not been built"}), 503
+    if entity_type not in ('breeds', 'names'):
+        return jsonify({"error": f"Unknown entity type: {entity_type}"}), 404
+    
+    borough = request.args.get('borough')
+    if borough is None:
+        return jsonify({'totals': rollups['totals'], 'hierarchy': rollups['hierarchy']})
+    if borough not in rollups['totals']['boroughs']:
+        return jsonify({"error": f"Unknown borough: {borough}"}), 404
+    
+    top = request.args.get('top', default=10, type=int)
+    if top < 1:
+        return jsonify({"error": "top must be at least 1"}), 400
+    ranked = sorted(rollups[entity_type].items(), key=lambda x: x[1]['boroughs'][borough]['count'], reverse=True)
+    return jsonify({
+        'borough': borough,
+        'total_count': rollups['totals']['boroughs'][borough],
+        'top': [{'name': entity, **rollup['boroughs'][borough]} for entity, rollup in ranked[:top]]
+    })
+
+@app.route('/api/boroughs/<entity_type>/<path:entity>')
+def borough_rollup(entity_type, entity):
+    """Return a breed or name's borough and citywide roll-up"""
+    rollups = get_rollups()
+    if rollups is None:
+        return jsonify({"error": "Borough roll-ups have not been built"}), 503
+    if entity_type not in ('breeds', 'names') or entity not in rollups[entity_type]:
+        return jsonify({"error": f"No roll-up for {entity_type}/{entity}"}), 404
+    return jsonify({'entity': entity, **rollups[entity_type][entity]})
+
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>.pbf')
+def serve_tile(layer, z, x, y):
+    """Serve a vector tile, answering tiles with no features with 204 No Content"""
+    from build_vector_tiles import LAYER_NAME
+    # Only the layer the build writes, so the path segment can't reach outside tiles/
+    if layer != LAYER_NAME:
+        abort(404)
+    tile_dir = site_path(f'tiles/{layer}/{z}/{x}')
+    if not os.path.exists(f'{tile_dir}/{y}.pbf'):
+        return '', 204
+    return send_from_directory(tile_dir, f'{y}.pbf', mimetype='application/x-protobuf')
+
+@app.route('/basemap/<int:z>/<int:x>/<int:y>.png')
+def serve_basemap_tile(z, x, y):
+    """Serve a basemap tile from the local tile cache, fetching it from CARTO on a miss"""
+    from basemap_tiles import TILE_CACHE_CONTROL, get_tile_cache
+    try:
+        tile = get_tile_cache().get(z, x, y)
+    except ValueError:
+        abort(404)
+    except OSError:
+        return 'Tile not cached and unavailable upstream', 502
+    response = app.response_class(tile, mimetype='image/png')
+    response.headers['Cache-Control'] = TILE_CACHE_CONTROL
+    return response
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
-    """Serve static files"""
-    return send_from_directory('static', filename)
+    """Serve static files; vendored assets are content-hashed and cached forever"""
+    response = send_precompressed('static', filename)
+    if filename.startswith('vendor/'):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
 
 @app.route('/data/<path:filename>')
 def serve_data(filename):
     """Serve data files"""
-    return send_from_directory('data', filename)
+    return send_precompressed('data', filename)
 
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
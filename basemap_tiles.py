@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Local cache of the CartoDB positron basemap tiles.
+
+The generated maps load their basemap from the public CARTO CDN, so every map
+fetches dozens of tiles and none of them work offline. serve.py and app.py can
+instead answer /basemap/<z>/<x>/<y>.png from an on-disk cache, fetching a tile
+from CARTO only the first time it is asked for. The cache is kept under a size
+limit by removing the least recently used tiles, and `python basemap_tiles.py
+seed` fills it for the NYC bounding box beforehand, e.g. for kiosks without a
+network connection.
+
+Maps are generated against the local route when NYCDOGS_LOCAL_BASEMAP=1 is set
+(generate_netlify_maps.py --local-basemap sets it). The hand-written Leaflet
+pages (viewer.html, timeline.html, static/tile_map.html) read the same choice
+from data/basemap.json, written when their data is built.
+
+Cache layout:
+    cache/basemap/<z>/<x>/<y>.png - a tile's mtime records when it was last used
+"""
+
+import os
+import json
+import math
+import threading
+import urllib.request
+from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor
+from publish import atomic_open
+
+BASEMAP_CACHE_DIR = 'cache/basemap'
+BASEMAP_CACHE_MAX_BYTES = int(os.environ.get('BASEMAP_CACHE_MB', 512)) * 1024 * 1024
+
+UPSTREAM_URL = 'https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png'
+UPSTREAM_SUBDOMAINS = 'abcd'
+ATTRIBUTION = ('&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors '
+               '&copy; <a href="https://carto.com/attributions">CARTO</a>')
+
+# Route of the proxy on both servers
+LOCAL_TILE_URL = '/basemap/{z}/{x}/{y}.png'
+LOCAL_BASEMAP_ENV = 'NYCDOGS_LOCAL_BASEMAP'
+
+# L.tileLayer arguments for the pages that build their own Leaflet map
+BASEMAP_CONFIG_FILE = 'data/basemap.json'
+
+# Cached tiles are refetched at most daily by browsers; CARTO updates them rarely
+TILE_CACHE_CONTROL = 'public, max-age=86400'
+
+MAX_ZOOM = 20
+
+# West, south, east, north of the five boroughs
+NYC_BBOX = (-74.26, 40.49, -73.69, 40.92)
+SEED_ZOOMS = range(10, 15)
+
+def use_local_basemap():
+    return os.environ.get(LOCAL_BASEMAP_ENV) == '1'
+
+def map_tiles():
+    """folium.Map tile arguments: the local proxy when enabled, otherwise CARTO's CDN"""
+    if use_local_basemap():
+        return {'tiles': LOCAL_TILE_URL, 'attr': ATTRIBUTION, 'max_zoom': MAX_ZOOM}
+    return {'tiles': 'CartoDB positron'}
+
+def leaflet_tiles():
+    """L.tileLayer url and options matching map_tiles()"""
+    if use_local_basemap():
+        return {'url': LOCAL_TILE_URL, 'options': {'attribution': ATTRIBUTION, 'maxZoom': MAX_ZOOM}}
+    return {'url': UPSTREAM_URL,
+            'options': {'attribution': ATTRIBUTION, 'subdomains': UPSTREAM_SUBDOMAINS, 'maxZoom': MAX_ZOOM}}
+
+def write_basemap_config(path=BASEMAP_CONFIG_FILE):
+    """Write the Leaflet basemap settings read by viewer.html, timeline.html and static/tile_map.html"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_open(path) as f:
+        json.dump(leaflet_tiles(), f, separators=(',', ':'))
+
+def tile_path(z, x, y, cache_dir=BASEMAP_CACHE_DIR):
+    return f'{cache_dir}/{z}/{x}/{y}.png'
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def fetch_tile(z, x, y):
+    """Download a tile from CARTO, spreading requests over its subdomains"""
+    subdomain = UPSTREAM_SUBDOMAINS[(x + y) % len(UPSTREAM_SUBDOMAINS)]
+    request = urllib.request.Request(UPSTREAM_URL.format(s=subdomain, z=z, x=x, y=y),
+                                     headers={'User-Agent': 'nycdogs-basemap-cache'})
+    with urllib.request.urlopen(request, timeout=15) as response:
+        return response.read()
+
+class TileCache:
+    """Tiles on disk, evicted least recently used first once the cache exceeds max_bytes"""
+
+    def __init__(self, cache_dir=BASEMAP_CACHE_DIR, max_bytes=BASEMAP_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = None
+
+    def list_tiles(self):
+        """Return [(last used, size, path)] of every cached tile"""
+        tiles = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.png'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                tiles.append((stat.st_mtime, stat.st_size, path))
+        return tiles
+
+    def get(self, z, x, y):
+        """
+        Return a tile's PNG bytes, fetching and caching it on a miss. Raises
+        ValueError for a tile outside the pyramid and URLError when it isn't
+        cached and CARTO can't be reached.
+        """
+        if not is_valid_tile(z, x, y):
+            raise ValueError(f"No such tile: {z}/{x}/{y}")
+        path = tile_path(z, x, y, self.cache_dir)
+        try:
+            with open(path, 'rb') as f:
+                tile = f.read()
+            os.utime(path)
+            return tile
+        except FileNotFoundError:
+            pass
+
+        tile = fetch_tile(z, x, y)
+        self.put(path, tile)
+        return tile
+
+    def put(self, path, tile):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent reader never sees half a tile
+        partial = f'{path}.{threading.get_ident()}.part'
+        with open(partial, 'wb') as f:
+            f.write(tile)
+        os.replace(partial, path)
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.list_tiles())
+            else:
+                self.size += len(tile)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Remove the least recently used tiles until the cache is down to 90% of its limit"""
+        tiles = sorted(self.list_tiles())
+        self.size = sum(size for _, size, _ in tiles)
+        for _, size, path in tiles:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except FileNotFoundError:
+                pass
+
+# Shared by the request handlers of a server process
+_tile_cache = None
+
+def get_tile_cache():
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = TileCache()
+    return _tile_cache
+
+def tiles_in_bbox(bbox, zoom):
+    """Yield (z, x, y) of the tiles covering a (west, south, east, north) box at one zoom"""
+    west, south, east, north = bbox
+
+    def tile_xy(lon, lat):
+        n = 2 ** zoom
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        return min(x, n - 1), min(y, n - 1)
+
+    x_min, y_min = tile_xy(west, north)
+    x_max, y_max = tile_xy(east, south)
+    for x in range(x_min, x_max + 1):
+        for y in range(y_min, y_max + 1):
+            yield zoom, x, y
+
+def seed_tiles(bbox=NYC_BBOX, zooms=SEED_ZOOMS, jobs=8, cache=None):
+    """Fetch every tile of bbox at the given zooms into the cache; return (tiles, failures)"""
+    cache = cache or get_tile_cache()
+    tiles = [tile for zoom in zooms for tile in tiles_in_bbox(bbox, zoom)]
+    print(f"Seeding {len(tiles)} basemap tiles at zooms {min(zooms)}-{max(zooms)} into {cache.cache_dir}/...")
+
+    def seed(tile):
+        try:
+            cache.get(*tile)
+            return None
+        except (URLError, OSError) as e:
+            return tile, e
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        failures = [failure for failure in pool.map(seed, tiles) if failure is not None]
+    for (z, x, y), error in failures[:10]:
+        print(f"Failed to fetch tile {z}/{x}/{y}: {error}")
+    print(f"Cached {len(tiles) - len(failures)} of {len(tiles)} tiles")
+    return len(tiles), failures
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the local basemap tile cache")
+    parser.add_argument("command", choices=["seed", "stats"],
+                        help="seed: fetch the NYC tiles into the cache; stats: show the cache size")
+    parser.add_argument("--min-zoom", type=int, default=min(SEED_ZOOMS))
+    parser.add_argument("--max-zoom", type=int, default=max(SEED_ZOOMS))
+    parser.add_argument("--jobs", type=int, default=8, help="concurrent downloads (default: 8)")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        _, failures = seed_tiles(zooms=range(args.min_zoom, args.max_zoom + 1), jobs=args.jobs)
+        sys.exit(1 if failures else 0)
+    else:
+        tiles = get_tile_cache().list_tiles()
+        size = sum(size for _, size, _ in tiles)
+        print(f"{len(tiles)} tiles, {size / 1024 / 1024:.1f} MB of {BASEMAP_CACHE_MAX_BYTES / 1024 / 1024:.0f} MB")
@@ -102,7 +102,7 @@ def build_static_site():
         
         <div class="intro">
             <p>Welcome to the NYC Dogs Geographic Distribution viewer! This application visualizes the distribution of dog breeds and names across New York City's zip codes. Select a breed or name from the dropdown menus below to see where these dogs are most commonly found.</p>
-            <p class="text-center"><strong>Showing all breeds and names with at least 500 dogs in NYC</strong></p>
+            <p class="text-center"><strong>Showing all breeds and names with at least 500 dogs in NYC.</strong> <a href="viewer.html">Search every breed and name</a> to find the rest, or <a href="timeline.html">watch them spread by licence year</a>.</p>
         </div>
         
         <div class="row">
@@ -187,6 +187,24 @@ def build_static_site():
     # Copy maps to Netlify directory
     print("\nStep 3: Copying maps to Netlify build directory...")
     try:
+        # Sparse vectors of every breed and name for the searchable viewer
+        from viewer import build_viewer_data
+        build_viewer_data()
+        shutil.copyfile('viewer.html', f'{netlify_dir}/viewer.html')
+        print(f"  - Copied viewer.html to {netlify_dir}/viewer.html")
+        
+        # Licence-year matrices of the popular breeds and names for the animated maps
+        from timeline import build_timeline_data
+        build_timeline_data()
+        shutil.copyfile('timeline.html', f'{netlify_dir}/timeline.html')
+        print(f"  - Copied timeline.html to {netlify_dir}/timeline.html")
+        
+        # Script and styles shared by the viewer and timeline pages
+        os.makedirs(f'{netlify_dir}/static', exist_ok=True)
+        for name in ['zip_viewer.js', 'zip_viewer.css']:
+            shutil.copyfile(f'static/{name}', f'{netlify_dir}/static/{name}')
+        print(f"  - Copied the shared viewer script to {netlify_dir}/static")
+        
         # Copy maps directory
         shutil.copytree('maps', f'{netlify_dir}/maps')
         print(f"  - Copied maps to {netlify_dir}/maps")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Cut the NYC zipcode layer into a Mapbox Vector Tile (MVT) pyramid.
+
+Tiles are written to tiles/zips/{z}/{x}/{y}.pbf for zooms 8-14. Each feature's
+id is its position in the canonical zip index (see zip_layer.py), so pages can
+colour zips client-side from a per-entity vector instead of embedding the
+geometry in every map.
+"""
+
+import os
+import json
+import math
+import mapbox_vector_tile
+import shapely
+from shapely import STRtree
+from shapely.geometry import box
+
+from zip_layer import ZIPCODE_FIELD, load_zip_layer
+from basemap_tiles import write_basemap_config
+from publish import atomic_open
+
+TILES_DIR = 'tiles/zips'
+LAYER_NAME = 'zips'
+MIN_ZOOM = 8
+MAX_ZOOM = 14
+TILE_EXTENT = 4096
+
+# Web Mercator constants
+ORIGIN_SHIFT = 20037508.342789244
+TILE_SIZE = 256
+
+def tile_bounds(z, x, y):
+    """Return the EPSG:3857 bounds of an XYZ tile"""
+    tile_span = 2 * ORIGIN_SHIFT / 2 ** z
+    minx = -ORIGIN_SHIFT + x * tile_span
+    maxy = ORIGIN_SHIFT - y * tile_span
+    return minx, maxy - tile_span, minx + tile_span, maxy
+
+def tile_range(bounds, z):
+    """Return the XYZ tile x and y ranges covering EPSG:3857 bounds at zoom z"""
+    minx, miny, maxx, maxy = bounds
+    tile_span = 2 * ORIGIN_SHIFT / 2 ** z
+    x_min = int(math.floor((minx + ORIGIN_SHIFT) / tile_span))
+    x_max = int(math.floor((maxx + ORIGIN_SHIFT) / tile_span))
+    y_min = int(math.floor((ORIGIN_SHIFT - maxy) / tile_span))
+    y_max = int(math.floor((ORIGIN_SHIFT - miny) / tile_span))
+    return range(x_min, x_max + 1), range(y_min, y_max + 1)
+
+def build_vector_tiles(min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, output_dir=TILES_DIR):
+    """Write the zipcode MVT pyramid and its zip index to output_dir"""
+    print(f"Building zipcode vector tiles for zooms {min_zoom}-{max_zoom}...")
+
+    # Reproject once; every tile is cut from the same Web Mercator geometry
+    zipcode_gdf = load_zip_layer()
+    mercator = zipcode_gdf.to_crs(epsg=3857)
+    zipcodes = zipcode_gdf[ZIPCODE_FIELD].tolist()
+
+    tile_count = 0
+    for z in range(min_zoom, max_zoom + 1):
+        # Simplify to half a screen pixel at this zoom before cutting tiles
+        resolution = 2 * ORIGIN_SHIFT / (TILE_SIZE * 2 ** z)
+        geometries = shapely.make_valid(shapely.simplify(mercator.geometry.values, resolution / 2, preserve_topology=True))
+        tree = STRtree(geometries)
+
+        x_range, y_range = tile_range(mercator.total_bounds, z)
+        for x in x_range:
+            for y in y_range:
+                bounds = tile_bounds(z, x, y)
+
+                # Clip to the tile plus a small buffer so polygon edges don't show seams
+                buffer = (bounds[2] - bounds[0]) * 16 / TILE_EXTENT
+                clip_box = box(bounds[0] - buffer, bounds[1] - buffer, bounds[2] + buffer, bounds[3] + buffer)
+
+                features = []
+                for zip_index in tree.query(clip_box, predicate='intersects'):
+                    clipped = shapely.clip_by_rect(geometries[zip_index], *clip_box.bounds)
+                    if clipped.is_empty:
+                        continue
+                    features.append({
+                        'id': int(zip_index),
+                        'geometry': clipped,
+                        'properties': {'zip_index': int(zip_index), 'zipcode': zipcodes[zip_index]}
+                    })
+
+                # Empty tiles are not written; the tile routes answer them with 204
+                if not features:
+                    continue
+
+                tile = mapbox_vector_tile.encode(
+                    [{'name': LAYER_NAME, 'features': features}],
+                    default_options={'quantize_bounds': bounds, 'extents': TILE_EXTENT}
+                )
+
+                os.makedirs(f'{output_dir}/{z}/{x}', exist_ok=True)
+                with atomic_open(f'{output_dir}/{z}/{x}/{y}.pbf', 'wb') as f:
+                    f.write(tile)
+                tile_count += 1
+
+        print(f"Zoom {z}: {len(x_range) * len(y_range)} tiles in range")
+
+    # Feature ids index into this list, which matches the canonical zip index
+    west, south, east, north = zipcode_gdf.total_bounds
+    with atomic_open(f'{output_dir}/metadata.json') as f:
+        json.dump({
+            'layer': LAYER_NAME,
+            'minzoom': min_zoom,
+            'maxzoom': max_zoom,
+            'bounds': [west, south, east, north],
+            'zipcodes': zipcodes
+        }, f, sort_keys=True)
+
+    # Basemap of static/tile_map.html
+    write_basemap_config()
+    print(f"Wrote {tile_count} vector tiles to {output_dir}/")
+
+if __name__ == "__main__":
+    build_vector_tiles()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Shared colour classes for the breed and name maps.
+
+Each map used to work out its own bins from its own data. Here the class
+bounds of every breed and name, for every metric and classification scheme,
+are computed in one pass over the (zips x entities) matrices and stored with
+each zip's class number as a uint8 matrix. Both map renderers, the
+thumbnails, the single-page viewer and the vector tile map colour a zip by
+looking its class up in the palette instead of binning per map.
+
+Schemes:
+    equal_interval - six equal-width classes between each entity's min and max
+                     (folium.Choropleth's default, used by the maps so far)
+    quantile       - six classes holding equal numbers of each entity's zips
+    jenks          - Fisher-Jenks natural breaks of each entity's values
+    fixed          - the same bounds for every entity: sextiles of all
+                     entities' values pooled, so colours compare across maps
+
+Output:
+    data/classes/<type>.npz - entity names, and per metric and scheme a
+                              (7 x entities) bounds array and a
+                              (zips x entities) uint8 class matrix
+"""
+
+import os
+import warnings
+import numpy as np
+import branca.colormap as cm
+
+from zip_layer import load_zip_index
+from entity_counts import ENTITY_TYPES, METRICS, load_entity_data, build_count_matrix, build_metric_matrices
+from publish import atomic_open
+
+CLASSES_DIR = 'data/classes'
+
+SCHEMES = ['equal_interval', 'quantile', 'jenks', 'fixed']
+DEFAULT_SCHEME = 'equal_interval'
+
+NUM_CLASSES = 6
+# Class of zips where the entity has no value
+NO_CLASS = 255
+
+# The six YlOrRd classes of branca's YlOrRd_06 step colormap, lowest first
+CLASS_COLORS = [cm.linear.YlOrRd_06.scale(0, NUM_CLASSES).to_step(NUM_CLASSES).rgb_hex_str(i)
+                for i in range(NUM_CLASSES)]
+
+def class_palette(colors=CLASS_COLORS, no_data=None):
+    """Return a 256-entry colour lookup table for uint8 class numbers"""
+    palette = np.full(256, no_data, dtype=object)
+    palette[:len(colors)] = colors
+    return palette
+
+def classify_by_bounds(values, present, bounds):
+    """Class of each value: the number of a column's interior bounds below it"""
+    with np.errstate(invalid='ignore'):
+        classes = (values[None, :, :] > bounds[1:NUM_CLASSES, None, :]).sum(axis=0)
+    return np.where(present, classes, NO_CLASS).astype(np.uint8)
+
+def jenks_bounds(values, num_classes=NUM_CLASSES):
+    """
+    Fisher-Jenks natural breaks of a 1-D array: the class bounds that minimize
+    the summed squared deviations within classes. Returns num_classes + 1
+    bounds, or None with fewer values than classes.
+    """
+    x = np.sort(values)
+    n = len(x)
+    if n < num_classes:
+        return None
+
+    # cost[a, b] = squared deviations of x[a..b] from their mean
+    s1 = np.concatenate([[0], np.cumsum(x)])
+    s2 = np.concatenate([[0], np.cumsum(x * x)])
+    a, b = np.arange(n)[:, None], np.arange(n)[None, :]
+    size = np.maximum(b - a + 1, 1)
+    cost = np.where(a <= b, (s2[b + 1] - s2[a]) - (s1[b + 1] - s1[a]) ** 2 / size, np.inf)
+
+    # best[b]: least cost of splitting x[0..b] into j classes; starts[j][b]: where the last class begins
+    best = cost[0]
+    starts = []
+    for _ in range(1, num_classes):
+        total = np.full((n, n), np.inf)
+        total[1:] = best[:-1, None] + cost[1:]
+        starts.append(total.argmin(axis=0))
+        best = total.min(axis=0)
+
+    bounds = [x[-1]]
+    end = n - 1
+    for start in reversed(starts):
+        end = start[end] - 1
+        bounds.append(x[end])
+    bounds.append(x[0])
+    return np.array(bounds[::-1])
+
+def classify_matrix(values, present, scheme=DEFAULT_SCHEME):
+    """
+    Classify every column of a (zips x entities) matrix at once, using only
+    the values where present is true. Returns (bounds, classes): a (7 x
+    entities) array of class bounds and a (zips x entities) uint8 array of
+    class numbers, NO_CLASS where a zip has no value.
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown classification scheme: {scheme}")
+    has_values = present.any(axis=0)
+    masked = np.where(present, values, np.nan)
+    steps = np.linspace(0, 1, NUM_CLASSES + 1)
+
+    with warnings.catch_warnings():
+        # Columns without values give all-NaN slices; they get zero bounds below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low = np.nanmin(masked, axis=0)
+        high = np.nanmax(masked, axis=0)
+        if scheme == 'quantile':
+            bounds = np.nanquantile(masked, steps, axis=0)
+        elif scheme == 'fixed':
+            pooled = values[present]
+            edges = np.quantile(pooled, steps) if len(pooled) else np.zeros(len(steps))
+            bounds = np.repeat(edges[:, None], values.shape[1], axis=1)
+        else:
+            bounds = low + (high - low) * steps[:, None]
+    bounds = np.where(has_values, bounds, 0)
+
+    if scheme == 'equal_interval':
+        # floor() rather than classify_by_bounds, exactly as the folium step colormap bins
+        width = np.where(high > low, high - low, 1)
+        with np.errstate(invalid='ignore'):
+            classes = np.clip(np.floor((values - low) / width * NUM_CLASSES), 0, NUM_CLASSES - 1)
+        return bounds, np.where(present, classes, NO_CLASS).astype(np.uint8)
+
+    if scheme == 'jenks':
+        for column in np.flatnonzero(has_values):
+            breaks = jenks_bounds(values[present[:, column], column])
+            if breaks is not None:
+                bounds[:, column] = breaks
+    return bounds, classify_by_bounds(values, present, bounds)
+
+def classify_metrics(counts, areas, metrics=METRICS, schemes=SCHEMES):
+    """Return {(metric, scheme): (bounds, classes)} for a count matrix and each zip's area"""
+    matrices = build_metric_matrices(counts, areas)
+    results = {}
+    for metric in metrics:
+        present = (counts > 0) & np.isfinite(matrices[metric])
+        for scheme in schemes:
+            results[(metric, scheme)] = classify_matrix(matrices[metric], present, scheme)
+    return results
+
+def build_class_tables(output_dir=CLASSES_DIR):
+    """Classify every breed and name for every metric and scheme and save the class tables"""
+    print("Building shared map classes...")
+    os.makedirs(output_dir, exist_ok=True)
+    zip_index = load_zip_index()
+    areas = np.array(zip_index['area_km2'], dtype=float)
+
+    for entity_type in ENTITY_TYPES:
+        entities, counts = build_count_matrix(load_entity_data(entity_type), zip_index['zipcodes'])
+        arrays = {'entities': np.array(entities, dtype=str)}
+        for (metric, scheme), (bounds, classes) in classify_metrics(counts, areas).items():
+            arrays[f'{metric}_{scheme}_bounds'] = bounds
+            arrays[f'{metric}_{scheme}_classes'] = classes
+        with atomic_open(f'{output_dir}/{entity_type}.npz', 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        _class_tables.pop(entity_type, None)
+        print(f"Classified {len(entities)} {entity_type} for {len(METRICS)} metrics and {len(SCHEMES)} schemes")
+
+class ClassTable:
+    """The stored classes of one entity type"""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.arrays = dict(data)
+        self.column = {entity: column for column, entity in enumerate(self.arrays['entities'].tolist())}
+
+    def select(self, metric, scheme, entities):
+        """Return (bounds, classes) of the given entities' columns; raises KeyError for unknown entities"""
+        columns = [self.column[entity] for entity in entities]
+        return (self.arrays[f'{metric}_{scheme}_bounds'][:, columns],
+                self.arrays[f'{metric}_{scheme}_classes'][:, columns])
+
+# Loaded once per entity type on first use
+_class_tables = {}
+
+def load_class_table(entity_type, output_dir=CLASSES_DIR):
+    """Return the class table of an entity type, building the tables first if needed"""
+    if entity_type not in _class_tables:
+        path = f'{output_dir}/{entity_type}.npz'
+        if not os.path.exists(path):
+            build_class_tables(output_dir)
+        _class_tables[entity_type] = ClassTable(path)
+    return _class_tables[entity_type]
+
+if __name__ == "__main__":
+    build_class_tables()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+On-demand comparison maps between two breeds or names.
+
+Every pair can't be pre-generated, so comparisons are computed per request.
+The share vectors of all entities of a type are built once, as a (zips x
+entities) matrix of each entity's percentage of its dogs per zip. A comparison
+is then two column lookups and one subtraction or division. Comparison maps
+are written from the compiled map template shared with the entity maps, and
+recent results are kept in bounded LRU caches. Everything is read under a root
+directory (the servers pass the snapshot a request is served from) and cached
+per root, so requests on different snapshots never share results.
+"""
+
+import os
+import json
+import html
+import numpy as np
+import branca.colormap as cm
+from functools import lru_cache
+
+from publish import cache_for_root
+from vendor_assets import VENDOR_MANIFEST, load_vendor_manifest
+from zip_layer import load_zip_index
+from entity_counts import ENTITY_TYPES, load_entity_data, build_count_matrix
+
+COMPARE_MODES = ['difference', 'ratio']
+
+# Comparisons and rendered comparison maps kept in memory
+COMPARE_CACHE_SIZE = 256
+
+# Diverging classes from "b is more common" (blue) to "a is more common" (red)
+COMPARE_COLORS = [cm.linear.RdBu_06.scale(0, 6).to_step(6).rgb_hex_str(i) for i in reversed(range(6))]
+
+class ShareVectors:
+    """Every entity's share of its dogs per zip, for one entity type"""
+
+    def __init__(self, entity_type, root='.'):
+        entity_data = load_entity_data(entity_type, os.path.join(root, 'data'))
+        self.zipcodes = load_zip_index(root)['zipcodes']
+        entities, counts = build_count_matrix(entity_data, self.zipcodes)
+        self.totals = counts.sum(axis=0)
+        self.shares = np.divide(counts * 100, self.totals, out=np.zeros_like(counts), where=self.totals > 0)
+        self.column = {entity: column for column, entity in enumerate(entities)}
+
+    def share(self, entity):
+        """Return (share vector, total dogs) of an entity; raises KeyError if it is unknown"""
+        column = self.column[entity]
+        return self.shares[:, column], int(self.totals[column])
+
+# {root: {entity type: (data version, ShareVectors)}}, rebuilt when the data changes
+_share_vectors = {}
+
+# {root: {vendor url: compiled map template}}, built on the first comparison map
+_templates = {}
+
+def get_data_version(entity_type, root='.'):
+    """
+    Version of an entity type's data: its file (under the root) and that
+    file's mtime, which changes whenever a build rewrites it. Every cached
+    result is keyed on it.
+    """
+    if entity_type not in ENTITY_TYPES:
+        raise ValueError(f"Unknown entity type: {entity_type}")
+    path = os.path.join(root, f'data/popular_{entity_type}.json')
+    return path, os.path.getmtime(path)
+
+def get_share_vectors(entity_type, root='.'):
+    version = get_data_version(entity_type, root)
+    share_vectors = cache_for_root(_share_vectors, root, dict)
+    if entity_type not in share_vectors or share_vectors[entity_type][0] != version:
+        share_vectors[entity_type] = (version, ShareVectors(entity_type, root))
+    return share_vectors[entity_type][1]
+
+def compare_entities(entity_type, a, b, mode='difference', root='.'):
+    """
+    Compare the per-zip shares of entities a and b. mode is 'difference'
+    (percentage points, a - b) or 'ratio' (a / b, None where b has no dogs).
+    Zips where neither has dogs are left out. Raises KeyError for an unknown
+    entity and ValueError for an unknown type or mode. The result is cached
+    and shared between callers, so treat it as read-only.
+    """
+    if mode not in COMPARE_MODES:
+        raise ValueError(f"Unknown comparison mode: {mode}")
+    return cached_comparison(entity_type, a, b, mode, root, get_data_version(entity_type, root))
+
+@lru_cache(maxsize=COMPARE_CACHE_SIZE)
+def cached_comparison(entity_type, a, b, mode, root, version):
+    """compare_entities() for one version of a root's data"""
+    vectors = get_share_vectors(entity_type, root)
+    share_a, total_a = vectors.share(a)
+    share_b, total_b = vectors.share(b)
+
+    if mode == 'difference':
+        values = share_a - share_b
+    else:
+        values = np.divide(share_a, share_b, out=np.full_like(share_a, np.nan), where=share_b > 0)
+
+    rows = np.flatnonzero((share_a > 0) | (share_b > 0))
+    return {
+        'type': entity_type,
+        'a': a,
+        'b': b,
+        'mode': mode,
+        'total_a': total_a,
+        'total_b': total_b,
+        'zipcodes': {
+            vectors.zipcodes[row]: {
+                'share_a': round(float(share_a[row]), 2),
+                'share_b': round(float(share_b[row]), 2),
+                'value': round(float(values[row]), 3) if np.isfinite(values[row]) else None
+            }
+            for row in rows.tolist()
+        }
+    }
+
+def classify_comparison(comparison):
+    """
+    Return (bounds, {zipcode: class}) with six classes symmetric around "no
+    difference": 0 for differences, a ratio of 1 (on a log scale) for ratios.
+    """
+    zipcodes = list(comparison['zipcodes'])
+    entries = [comparison['zipcodes'][zipcode] for zipcode in zipcodes]
+    if comparison['mode'] == 'difference':
+        scores = np.array([entry['value'] for entry in entries], dtype=float)
+    else:
+        # Only a has dogs (no ratio) -> +inf, only b (ratio 0) -> -inf; both end up in the outer classes
+        ratios = np.array([np.inf if entry['value'] is None else entry['value'] for entry in entries])
+        with np.errstate(divide='ignore'):
+            scores = np.log2(ratios)
+
+    finite = scores[np.isfinite(scores)]
+    reach = np.abs(finite).max() if len(finite) and np.abs(finite).max() > 0 else 1.0
+    edges = np.linspace(-reach, reach, 7)
+    bounds = edges if comparison['mode'] == 'difference' else 2 ** edges
+    classes = np.clip(np.floor((scores + reach) / (2 * reach) * 6), 0, 5).astype(int)
+    return bounds, dict(zip(zipcodes, classes.tolist()))
+
+def format_comparison_title(comparison):
+    """Return the title box HTML of a comparison map"""
+    a, b = html.escape(comparison['a']), html.escape(comparison['b'])
+    measure = 'Difference in share of dogs' if comparison['mode'] == 'difference' else 'Ratio of shares of dogs'
+    return f'''
+        <div style="position: fixed; top: 10px; left: 50%; transform: translateX(-50%); z-index:9999; background-color: white;
+             padding: 10px; border: 2px solid grey; border-radius: 5px;">
+            <h3 style="text-align: center; margin: 0;">{a} vs {b} in NYC</h3>
+            <p style="text-align: center; margin: 0;">{measure}; {comparison['total_a']} vs {comparison['total_b']} dogs</p>
+        </div>
+    '''
+
+def build_comparison_payload(comparison):
+    """Return the map template's JSON data block for a comparison"""
+    bounds, classes = classify_comparison(comparison)
+    a, b = html.escape(comparison['a']), html.escape(comparison['b'])
+    if comparison['mode'] == 'difference':
+        caption = f'{a} minus {b} (percentage points)'
+        value_label = 'Difference (points):'
+    else:
+        caption = f'{a} / {b} (ratio of shares)'
+        value_label = 'Ratio:'
+
+    payload = {
+        'layer': f'{a} vs {b}',
+        'caption': caption,
+        'fields': [f'{a} (%):', f'{b} (%):', value_label],
+        'index': [round(float(bound), 2) for bound in bounds],
+        'colors': COMPARE_COLORS,
+        'values': {
+            zipcode: [entry['share_a'], entry['share_b'], entry['value'], COMPARE_COLORS[classes[zipcode]]]
+            for zipcode, entry in comparison['zipcodes'].items()
+        }
+    }
+    return json.dumps(payload, separators=(',', ':')).replace('</', '<\\/')
+
+def get_map_template(root='.', vendor_url=None):
+    """
+    The compiled map template of a root's zip geometry. With vendor_url, its CDN
+    scripts and stylesheets point at the root's vendored copies under that URL.
+    """
+    templates = cache_for_root(_templates, root, dict)
+    if vendor_url not in templates:
+        from create_heatmaps import load_map_geometry
+        from fast_renderer import MapTemplate
+        template = MapTemplate(*load_map_geometry(root))
+        if vendor_url is not None:
+            template.use_vendored_assets(load_vendor_manifest(os.path.join(root, VENDOR_MANIFEST)), vendor_url)
+        templates[vendor_url] = template
+    return templates[vendor_url]
+
+def render_comparison_map(entity_type, a, b, mode='difference', root='.', vendor_url=None):
+    """
+    Return the HTML page of a comparison map; raises like compare_entities.
+    Servers pass the URL they send static/vendor/ under as vendor_url, so the
+    page loads the vendored assets rather than the CDNs.
+    """
+    if mode not in COMPARE_MODES:
+        raise ValueError(f"Unknown comparison mode: {mode}")
+    return cached_comparison_map(entity_type, a, b, mode, root, vendor_url, get_data_version(entity_type, root))
+
+@lru_cache(maxsize=COMPARE_CACHE_SIZE)
+def cached_comparison_map(entity_type, a, b, mode, root, vendor_url, version):
+    """render_comparison_map() for one version of a root's data"""
+    comparison = cached_comparison(entity_type, a, b, mode, root, version)
+    return get_map_template(root, vendor_url).render_page(format_comparison_title(comparison),
+                                          build_comparison_payload(comparison))
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a map comparing two breeds or names")
+    parser.add_argument("a")
+    parser.add_argument("b")
+    parser.add_argument("--type", choices=ENTITY_TYPES, default="breeds")
+    parser.add_argument("--mode", choices=COMPARE_MODES, default="difference")
+    parser.add_argument("--output", default="comparison.html")
+    args = parser.parse_args()
+    try:
+        page = render_comparison_map(args.type, args.a, args.b, args.mode)
+    except KeyError as e:
+        sys.exit(f"Unknown {args.type[:-1]}: {e.args[0]}")
+    with open(args.output, 'w') as f:
+        f.write(page)
+    print(f"Saved comparison map to {args.output}")
@@ -7,17 +7,28 @@ import requests
 import geopandas as gpd
 import numpy as np
 from folium.features import GeoJsonTooltip
+import branca.colormap as cm
 import io
+import sys
+import time
+import traceback
+import contextlib
+import multiprocessing
+from zip_layer import ZIP_LAYER_FILE, load_zip_index, get_zip_areas, get_zip_boroughs, normalize_zipcode, get_zipcode_field, zip_path
+from entity_counts import load_entity_data, compute_zip_metrics
+from classification import CLASS_COLORS, DEFAULT_SCHEME, NO_CLASS, load_class_table
+from basemap_tiles import map_tiles
+from publish import atomic_open
 
-def get_nyc_zipcode_geojson():
+def get_nyc_zipcode_geojson(path='ZCTA.gpkg'):
     """
     Get NYC zipcode boundary data from the provided ZCTA.gpkg file.
     """
-    print("Loading NYC zipcode boundary data from ZCTA.gpkg...")
+    print(f"Loading NYC zipcode boundary data from {path}...")
     
     try:
         # Load the provided ZCTA.gpkg file
-        zipcode_gdf = gpd.read_file('ZCTA.gpkg')
+        zipcode_gdf = gpd.read_file(path)
         print(f"Successfully loaded {len(zipcode_gdf)} zip code boundaries")
         
         # Print columns to debug
@@ -72,406 +83,262 @@ def get_nyc_zipcode_geojson():
         
         # Save the simplified data locally for reference
         os.makedirs('data', exist_ok=True)
-        with open('data/nyc_zipcodes_simplified.geojson', 'w') as f:
+        with atomic_open('data/nyc_zipcodes_simplified.geojson') as f:
             json.dump(simple_geojson, f)
         
         return gpd.read_file('data/nyc_zipcodes_simplified.geojson')
 
-def create_breed_choropleth_maps():
-    """Create choropleth maps for dog breeds by NYC zip code"""
-    # Load breed data
-    with open('data/popular_breeds.json', 'r') as f:
-        breed_data = json.load(f)
-    
-    # Filter for breeds with at least 500 dogs
-    filtered_breeds = {breed: info for breed, info in breed_data.items() if info['total_count'] >= 500}
-    print(f"Found {len(filtered_breeds)} breeds with at least 500 dogs")
-    
-    # Get NYC zipcode boundaries
-    try:
-        nyc_zipcodes = get_nyc_zipcode_geojson()
-        
-        # Identify the zipcode field in the GeoDataFrame
-        zipcode_field = 'ZCTA'  # Default
-        if 'postalCode' in nyc_zipcodes.columns:
-            zipcode_field = 'postalCode'
-        elif 'ZCTA' in nyc_zipcodes.columns:
-            zipcode_field = 'ZCTA'
-        else:
-            # Try to find a suitable zipcode column
-            zipcode_candidates = [col for col in nyc_zipcodes.columns if any(x in col.lower() for x in ['zip', 'postal', 'zcta'])]
-            zipcode_field = zipcode_candidates[0] if zipcode_candidates else 'ZCTA'
-        
-        print(f"Using {zipcode_field} as the zipcode field")
-        print(f"Available columns in GeoDataFrame: {', '.join(nyc_zipcodes.columns)}")
-        print(f"First few zipcode values: {nyc_zipcodes[zipcode_field].head().tolist()}")
-        
-        # Make sure all zipcodes in the geodata are strings without decimals
-        nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].astype(str)
-        nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].apply(lambda x: x.split('.')[0] if '.' in x else x)
-    except Exception as e:
-        print(f"Error loading NYC zipcode boundaries: {e}")
-        return
+def format_clustering_summary(info):
+    """Return a title line describing the entity's spatial clustering, if it has been computed"""
+    if info.get('morans_i') is None:
+        return ''
+    verdict = 'clustered' if info.get('clustered') else 'not significantly clustered'
+    return f"<p style=\"text-align: center; margin: 0;\">Moran's I: {info['morans_i']:.3f} ({verdict})</p>"
+
+# (title heading, legend subject) for each map dimension
+MAP_LABELS = {
+    'breeds': ('{} Distribution in NYC', '{} Dogs'),
+    'names': ('Dogs Named {} in NYC', 'Dogs Named {}'),
+    'genders': ('Dogs of Gender {} in NYC', 'Dogs of Gender {}'),
+    'birth_years': ('Dogs Born in {} in NYC', 'Dogs Born in {}')
+}
+
+def format_map_title(entity_type, entity, info):
+    """
+    Return the fixed title box HTML shown at the top of an entity map. A
+    borough map's info has the borough, its total_count and the citywide
+    city_total instead of the clustering statistics.
+    """
+    heading = MAP_LABELS[entity_type][0].format(entity)
+    total = f"Total: {info['total_count']} dogs"
+    if info.get('borough'):
+        heading = heading.replace(' in NYC', f" in {info['borough']}")
+        total = f"{info['total_count']} of the {info['city_total']} dogs in NYC are in {info['borough']}"
+    return f'''
+        <div style="position: fixed; top: 10px; left: 50%; transform: translateX(-50%); z-index:9999; background-color: white; 
+             padding: 10px; border: 2px solid grey; border-radius: 5px;">
+            <h3 style="text-align: center; margin: 0;">{heading}</h3>
+            <p style="text-align: center; margin: 0;">{total}</p>
+            {format_clustering_summary(info)}
+        </div>
+    '''
+
+def get_legend_name(entity_type, entity, metric, borough=None):
+    """Return the legend caption for an entity map of the given metric, in one borough if given"""
+    subject = MAP_LABELS[entity_type][1].format(entity)
+    if borough:
+        subject = f'{subject} in {borough}'
+    if metric == 'count':
+        return f'Number of {subject}'
+    if metric == 'density':
+        return f'{subject} per km\u00b2'
+    if borough:
+        # Percentages of a borough map are shares of the borough's dogs, not of the citywide total
+        return f'Share of the {subject} (%)'
+    return f'Percentage of {subject} (%)'
+
+def add_borough_column(nyc_zipcodes, zipcode_field, root='.'):
+    """Add each zip's borough from the precomputed zip hierarchy (under root) so tooltips can show it"""
+    if 'borough' not in nyc_zipcodes.columns:
+        nyc_zipcodes['borough'] = nyc_zipcodes[zipcode_field].apply(normalize_zipcode).map(get_zip_boroughs(root))
+    return nyc_zipcodes
+
+def create_zip_layer(nyc_map, nyc_zipcodes, zipcode_field, zipcode_counts, classes, layer_name, legend_name):
+    """
+    Add a single data-driven GeoJSON layer of NYC zip codes to nyc_map.
+    Each zip's fill colour, dog count, percentage and density are baked into its
+    feature properties and drive both the fill and the tooltip, so the map
+    carries the zip geometry only once. classes is the entity's (bounds, zip
+    classes) column of the mapped metric from the shared class table, in zip
+    index order.
+    """
+    # One row per zipcode; zips without data stay unfilled
+    values = zipcode_counts.groupby('zipcode')[['count', 'percentage']].sum()
+    zip_areas = get_zip_areas()
+    values['density'] = values['count'] / values.index.map(zip_areas).astype(float)
+    
+    # Colour by the stored classes, so every renderer and scheme bins the same way
+    bounds, zip_classes = classes
+    zip_colors = {zipcode: CLASS_COLORS[cls] for zipcode, cls in zip(load_zip_index()['zipcodes'], zip_classes.tolist())
+                  if cls != NO_CLASS}
+    colormap = cm.StepColormap(CLASS_COLORS, index=[float(bound) for bound in bounds],
+                               vmin=float(bounds[0]), vmax=float(bounds[-1]), caption=legend_name)
+    
+    # Keep only the properties the layer uses instead of every ZCTA attribute
+    tooltip_fields = [zipcode_field]
+    tooltip_aliases = ['Zip Code:']
+    for column, alias in (('borough', 'Borough:'), ('neighborhood', 'Neighborhood:')):
+        if column in nyc_zipcodes.columns:
+            tooltip_fields.append(column)
+            tooltip_aliases.append(alias)
+    layer_gdf = nyc_zipcodes[tooltip_fields + ['geometry']].copy()
+    
+    zip_values = layer_gdf[zipcode_field].map(normalize_zipcode)
+    layer_gdf['dogs'] = zip_values.map(values['count']).fillna(0).astype(int)
+    layer_gdf['percentage'] = zip_values.map(values['percentage']).fillna(0).round(2)
+    layer_gdf['density'] = zip_values.map(values['density']).round(1)
+    layer_gdf['fill_color'] = zip_values.map(zip_colors.get)
     
-    # Create output directory
-    os.makedirs('maps/breeds', exist_ok=True)
+    tooltip = GeoJsonTooltip(
+        fields=tooltip_fields + ['dogs', 'percentage', 'density'],
+        aliases=tooltip_aliases + ['Dogs:', 'Percentage (%):', 'Dogs per km\u00b2:'],
+        localize=True,
+        sticky=False,
+        labels=True,
+        style="""
+            background-color: #F0EFEF;
+            border: 2px solid black;
+            border-radius: 3px;
+            box-shadow: 3px;
+        """,
+    )
     
-    # Create a choropleth map for each breed
-    for breed, breed_info in filtered_breeds.items():
-        safe_name = breed.replace('/', '_').replace(' ', '_')
-        print(f"Creating choropleth map for breed: {breed}")
-        
-        # Create the map centered on NYC
-        nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=10, 
-                             tiles='CartoDB positron')
-        
-        # Create a DataFrame with zipcode and dog count
-        zipcode_counts = pd.DataFrame(list(breed_info['zipcode_counts'].items()), 
-                                      columns=['zipcode', 'count'])
-        
-        # Make sure zipcode is a string for proper join
-        zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str)
-        
-        # Calculate the percentage of this breed in each zipcode
-        zipcode_counts['percentage'] = zipcode_counts['count'] / zipcode_counts['count'].sum() * 100
-        
-        # Print a sample of the zipcode counts for debugging
-        print(f"Sample zipcode counts for {breed}:")
-        print(zipcode_counts.head())
-        
-        # Print the first few zipcodes to verify format
-        print(f"First few zipcodes in data: {zipcode_counts['zipcode'].head().tolist()}")
-        
-        # Create dictionaries for easy lookup - convert to string and ensure no decimal points
-        zipcode_to_count = {}
-        zipcode_to_percent = {}
-        for _, row in zipcode_counts.iterrows():
-            # Remove decimal point if it exists
-            zip_str = str(row['zipcode']).split('.')[0]
-            zipcode_to_count[zip_str] = row['count']
-            zipcode_to_percent[zip_str] = row['percentage']
-        
-        # Update the dataframe with cleaned zipcodes (no decimal points)
-        zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str).apply(lambda x: x.split('.')[0])
-        
-        # Ensure zip codes in GeoDataFrame are strings for proper matching
-        if nyc_zipcodes[zipcode_field].dtype != 'object':
-            nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].astype(str)
-        
-        # Check for any matching zipcodes between the data and the GeoDataFrame
-        matching_zipcodes = set(zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-        print(f"Number of matching zipcodes: {len(matching_zipcodes)} out of {len(zipcode_counts)} in data")
-        
-        # If there are too few matching zipcodes, we need to transform the zipcodes to match
-        if len(matching_zipcodes) < 5:
-            print(f"Warning: Very few matching zipcodes for {breed}. Attempting to fix...")
-            
-            # Try to format zipcodes differently (handles different formats like '00123' vs '123')
-            # This helps if the data has zipcode formats different from the GeoDataFrame
-            geo_zips = set(nyc_zipcodes[zipcode_field])
-            
-            # Try with and without leading zeros
-            fixed_counts = {}
-            for zip_str, count in zipcode_to_count.items():
-                # Try adding leading zeros if needed
-                if zip_str not in geo_zips and zip_str.isdigit():
-                    zip_5digit = zip_str.zfill(5)
-                    if zip_5digit in geo_zips:
-                        fixed_counts[zip_5digit] = count
-                        continue
-                
-                # Try removing leading zeros
-                if zip_str not in geo_zips and zip_str.startswith('0'):
-                    zip_no_zero = zip_str.lstrip('0')
-                    if zip_no_zero in geo_zips:
-                        fixed_counts[zip_no_zero] = count
-                        continue
-                
-                # Keep original if no matches found
-                fixed_counts[zip_str] = count
-            
-            # Recreate the zipcode_counts DataFrame with fixed zipcodes
-            fixed_zipcode_counts = pd.DataFrame(list(fixed_counts.items()), columns=['zipcode', 'count'])
-            fixed_zipcode_counts['percentage'] = fixed_zipcode_counts['count'] / fixed_zipcode_counts['count'].sum() * 100
-            
-            # Check if we have more matches now
-            fixed_matching = set(fixed_zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-            print(f"After fixing, matching zipcodes: {len(fixed_matching)} out of {len(fixed_zipcode_counts)}")
-            
-            # Use the fixed data if we have more matches
-            if len(fixed_matching) > len(matching_zipcodes):
-                zipcode_counts = fixed_zipcode_counts
-                zipcode_to_count = fixed_counts
-                print("Using fixed zipcode format for better map matching")
-                
-        # Add the choropleth layer
-        choropleth = folium.Choropleth(
-            geo_data=nyc_zipcodes,
-            name=f'{breed} Distribution',
-            data=zipcode_counts,
-            columns=['zipcode', 'percentage'],
-            key_on='feature.properties.' + zipcode_field,
-            fill_color='YlOrRd',
-            fill_opacity=0.7,
-            line_opacity=0.2,
-            legend_name=f'Percentage of {breed} Dogs (%)',
-            highlight=True
-        ).add_to(nyc_map)
-        
-        # Create tooltip fields based on available columns
-        tooltip_fields = [zipcode_field]
-        tooltip_aliases = ['Zip Code:']
-        
-        # Add borough and neighborhood if available
-        if 'borough' in nyc_zipcodes.columns:
-            tooltip_fields.append('borough')
-            tooltip_aliases.append('Borough:')
-        if 'neighborhood' in nyc_zipcodes.columns:
-            tooltip_fields.append('neighborhood')
-            tooltip_aliases.append('Neighborhood:')
-        
-        # Add tooltips to show data on hover
-        tooltip = GeoJsonTooltip(
-            fields=tooltip_fields,
-            aliases=tooltip_aliases,
-            localize=True,
-            sticky=False,
-            labels=True,
-            style="""
-                background-color: #F0EFEF;
-                border: 2px solid black;
-                border-radius: 3px;
-                box-shadow: 3px;
-            """,
-        )
-        
-        # Add GeoJSON layer with tooltips
-        folium.GeoJson(
-            nyc_zipcodes,
-            name='NYC Zipcodes',
-            tooltip=tooltip,
-            style_function=lambda feature: {
-                'fillColor': 'transparent',
-                'color': 'black',
-                'weight': 1
-            }
-        ).add_to(nyc_map)
-        
-        # Add a title
-        title_html = f'''
-            <div style="position: fixed; top: 10px; left: 50%; transform: translateX(-50%); z-index:9999; background-color: white; 
-                 padding: 10px; border: 2px solid grey; border-radius: 5px;">
-                <h3 style="text-align: center; margin: 0;">{breed} Distribution in NYC</h3>
-                <p style="text-align: center; margin: 0;">Total: {breed_info['total_count']} dogs</p>
-            </div>
-        '''
-        nyc_map.get_root().html.add_child(folium.Element(title_html))
-        
-        # Add layer control
-        folium.LayerControl().add_to(nyc_map)
-        
-        # Save the map
-        nyc_map.save(f'maps/breeds/{safe_name}_map.html')
+    folium.GeoJson(
+        layer_gdf,
+        name=layer_name,
+        tooltip=tooltip,
+        style_function=lambda feature: {
+            'fillColor': feature['properties']['fill_color'] or 'transparent',
+            'fillOpacity': 0.7 if feature['properties']['fill_color'] else 0,
+            'color': 'black',
+            'weight': 1,
+            'opacity': 0.2
+        },
+        highlight_function=lambda feature: {
+            'weight': 3,
+            'fillOpacity': 0.9
+        }
+    ).add_to(nyc_map)
     
-    print(f"Breed maps created in maps/breeds/ directory")
+    colormap.add_to(nyc_map)
+    return colormap
 
-def create_name_choropleth_maps():
-    """Create choropleth maps for dog names by NYC zip code"""
-    # Load name data
-    with open('data/popular_names.json', 'r') as f:
-        name_data = json.load(f)
+def assign_fixed_ids(element, counter=None):
+    """
+    Replace folium's random element ids with sequential ones, so a rendered
+    page is byte-identical on every build with the same inputs.
+    """
+    counter = counter if counter is not None else [0]
+    element._id = str(counter[0])
+    counter[0] += 1
+    for child in element._children.values():
+        assign_fixed_ids(child, counter)
+
+def get_map_suffix(metric):
+    """Return the map filename suffix for a metric; percentage maps keep the original names"""
+    return '_map' if metric == 'percentage' else f'_{metric}_map'
+
+def get_map_path(entity_type, entity, metric, borough=None):
+    """
+    Return the output path of an entity's map, e.g. maps/breeds/Shih_Tzu_map.html,
+    or of its borough-scoped map, e.g. maps/breeds/boroughs/Staten_Island/Shih_Tzu_map.html
+    """
+    safe_name = str(entity).replace('/', '_').replace(' ', '_')
+    if borough is not None:
+        return f'maps/{entity_type}/boroughs/{borough.replace(" ", "_")}/{safe_name}{get_map_suffix(metric)}.html'
+    return f'maps/{entity_type}/{safe_name}{get_map_suffix(metric)}.html'
+
+# Zip geometry shared with forked map workers; set before the pool starts so
+# each worker inherits it copy-on-write instead of reloading or unpickling it
+_worker_zipcodes = None
+
+def render_map_task(task):
+    """
+    Render one (entity_type, entity, info, metric, scheme) map, capturing its
+    output. Returns (task, error) so one failing map doesn't stop the others.
+    """
+    entity_type, entity, info, metric, scheme = task
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            create_entity_map(entity_type, entity, info, _worker_zipcodes, metric=metric, scheme=scheme)
+        return task, None
+    except Exception:
+        return task, output.getvalue() + traceback.format_exc()
+
+def render_entity_maps(entity_type, entities, nyc_zipcodes, metrics=('percentage',), jobs=1, only=None,
+                       scheme=DEFAULT_SCHEME):
+    """
+    Render folium maps for (entity, info) pairs of one entity_type (see MAP_LABELS).
+    With jobs > 1, forks worker processes after the geometry is loaded and hands
+    them batches of maps; progress is printed in order either way. If only is
+    given, maps whose path isn't in it are skipped. The zips are coloured by
+    the shared classes of the given classification scheme.
+    Returns the list of (entity, metric) maps that failed.
+    """
+    global _worker_zipcodes
+    _worker_zipcodes = nyc_zipcodes
+    tasks = [(entity_type, entity, info, metric, scheme) for entity, info in entities for metric in metrics
+             if only is None or get_map_path(entity_type, entity, metric) in only]
+    os.makedirs(f'maps/{entity_type}', exist_ok=True)
+    # Load the class table before forking, so the workers share it
+    load_class_table(entity_type)
+    
+    # Forking is what shares the geometry; fall back to serial rendering where it isn't available
+    if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        print("Parallel map generation needs the 'fork' start method; rendering serially")
+        jobs = 1
+    
+    failures = []
+    start = time.time()
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.get_context('fork').Pool(jobs)
+        batch_size = max(1, len(tasks) // (jobs * 4))
+        results = pool.imap(render_map_task, tasks, chunksize=batch_size)
+    else:
+        results = map(render_map_task, tasks)
     
-    # Filter for names with at least 500 dogs
-    filtered_names = {name: info for name, info in name_data.items() if info['total_count'] >= 500}
-    print(f"Found {len(filtered_names)} names with at least 500 dogs")
+    try:
+        for i, ((_, entity, _, metric, _), error) in enumerate(results):
+            status = 'ok' if error is None else 'FAILED'
+            print(f"[{i+1}/{len(tasks)}] {entity_type}: {entity} ({metric}) {status} - {time.time() - start:.1f}s elapsed")
+            if error is not None:
+                print(error, file=sys.stderr)
+                failures.append((entity, metric))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _worker_zipcodes = None
+    
+    if failures:
+        print(f"{len(failures)} of {len(tasks)} {entity_type} maps failed")
+    return failures
+
+def load_map_geometry(root='.'):
+    """Load the zipcode boundaries under root with normalized zipcodes and boroughs, once per run"""
+    nyc_zipcodes = get_nyc_zipcode_geojson(zip_path(ZIP_LAYER_FILE, root))
+    zipcode_field = get_zipcode_field(nyc_zipcodes)
+    print(f"Using {zipcode_field} as the zipcode field")
+    nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].apply(normalize_zipcode)
+    return add_borough_column(nyc_zipcodes, zipcode_field, root), zipcode_field
+
+def create_entity_choropleth_maps(entity_type, min_count=500, jobs=1):
+    """
+    Create choropleth maps for every breed or name with at least min_count dogs,
+    using up to `jobs` worker processes
+    """
+    entity_data = load_entity_data(entity_type)
+    filtered = {entity: info for entity, info in entity_data.items() if info['total_count'] >= min_count}
+    print(f"Found {len(filtered)} {entity_type} with at least {min_count} dogs")
     
-    # Get NYC zipcode boundaries
     try:
-        nyc_zipcodes = get_nyc_zipcode_geojson()
-        
-        # Identify the zipcode field in the GeoDataFrame
-        zipcode_field = 'ZCTA'  # Default
-        if 'postalCode' in nyc_zipcodes.columns:
-            zipcode_field = 'postalCode'
-        elif 'ZCTA' in nyc_zipcodes.columns:
-            zipcode_field = 'ZCTA'
-        else:
-            # Try to find a suitable zipcode column
-            zipcode_candidates = [col for col in nyc_zipcodes.columns if any(x in col.lower() for x in ['zip', 'postal', 'zcta'])]
-            zipcode_field = zipcode_candidates[0] if zipcode_candidates else 'ZCTA'
-        
-        print(f"Using {zipcode_field} as the zipcode field")
-        print(f"Available columns in GeoDataFrame: {', '.join(nyc_zipcodes.columns)}")
-        print(f"First few zipcode values: {nyc_zipcodes[zipcode_field].head().tolist()}")
-        
-        # Make sure all zipcodes in the geodata are strings without decimals
-        nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].astype(str)
-        nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].apply(lambda x: x.split('.')[0] if '.' in x else x)
+        nyc_zipcodes, _ = load_map_geometry()
     except Exception as e:
         print(f"Error loading NYC zipcode boundaries: {e}")
         return
     
-    # Create output directory
-    os.makedirs('maps/names', exist_ok=True)
-    
-    # Create a choropleth map for each name
-    for name, name_info in filtered_names.items():
-        safe_name = name.replace('/', '_').replace(' ', '_')
-        print(f"Creating choropleth map for name: {name}")
-        
-        # Create the map centered on NYC
-        nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=10, 
-                             tiles='CartoDB positron')
-        
-        # Create a DataFrame with zipcode and dog count
-        zipcode_counts = pd.DataFrame(list(name_info['zipcode_counts'].items()), 
-                                      columns=['zipcode', 'count'])
-        
-        # Make sure zipcode is a string for proper join
-        zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str)
-        
-        # Calculate the percentage of this name in each zipcode
-        zipcode_counts['percentage'] = zipcode_counts['count'] / zipcode_counts['count'].sum() * 100
-        
-        # Print a sample of the zipcode counts for debugging
-        print(f"Sample zipcode counts for {name}:")
-        print(zipcode_counts.head())
-        
-        # Print the first few zipcodes to verify format
-        print(f"First few zipcodes in data: {zipcode_counts['zipcode'].head().tolist()}")
-        
-        # Create dictionaries for easy lookup - convert to string and ensure no decimal points
-        zipcode_to_count = {}
-        zipcode_to_percent = {}
-        for _, row in zipcode_counts.iterrows():
-            # Remove decimal point if it exists
-            zip_str = str(row['zipcode']).split('.')[0]
-            zipcode_to_count[zip_str] = row['count']
-            zipcode_to_percent[zip_str] = row['percentage']
-        
-        # Update the dataframe with cleaned zipcodes (no decimal points)
-        zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str).apply(lambda x: x.split('.')[0])
-        
-        # Ensure zip codes in GeoDataFrame are strings for proper matching
-        if nyc_zipcodes[zipcode_field].dtype != 'object':
-            nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].astype(str)
-        
-        # Check for any matching zipcodes between the data and the GeoDataFrame
-        matching_zipcodes = set(zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-        print(f"Number of matching zipcodes: {len(matching_zipcodes)} out of {len(zipcode_counts)} in data")
-        
-        # If there are too few matching zipcodes, we need to transform the zipcodes to match
-        if len(matching_zipcodes) < 5:
-            print(f"Warning: Very few matching zipcodes for {name}. Attempting to fix...")
-            
-            # Try to format zipcodes differently (handles different formats like '00123' vs '123')
-            # This helps if the data has zipcode formats different from the GeoDataFrame
-            geo_zips = set(nyc_zipcodes[zipcode_field])
-            
-            # Try with and without leading zeros
-            fixed_counts = {}
-            for zip_str, count in zipcode_to_count.items():
-                # Try adding leading zeros if needed
-                if zip_str not in geo_zips and zip_str.isdigit():
-                    zip_5digit = zip_str.zfill(5)
-                    if zip_5digit in geo_zips:
-                        fixed_counts[zip_5digit] = count
-                        continue
-                
-                # Try removing leading zeros
-                if zip_str not in geo_zips and zip_str.startswith('0'):
-                    zip_no_zero = zip_str.lstrip('0')
-                    if zip_no_zero in geo_zips:
-                        fixed_counts[zip_no_zero] = count
-                        continue
-                
-                # Keep original if no matches found
-                fixed_counts[zip_str] = count
-            
-            # Recreate the zipcode_counts DataFrame with fixed zipcodes
-            fixed_zipcode_counts = pd.DataFrame(list(fixed_counts.items()), columns=['zipcode', 'count'])
-            fixed_zipcode_counts['percentage'] = fixed_zipcode_counts['count'] / fixed_zipcode_counts['count'].sum() * 100
-            
-            # Check if we have more matches now
-            fixed_matching = set(fixed_zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-            print(f"After fixing, matching zipcodes: {len(fixed_matching)} out of {len(fixed_zipcode_counts)}")
-            
-            # Use the fixed data if we have more matches
-            if len(fixed_matching) > len(matching_zipcodes):
-                zipcode_counts = fixed_zipcode_counts
-                zipcode_to_count = fixed_counts
-                print("Using fixed zipcode format for better map matching")
-        
-        # Add the choropleth layer
-        choropleth = folium.Choropleth(
-            geo_data=nyc_zipcodes,
-            name=f'{name} Distribution',
-            data=zipcode_counts,
-            columns=['zipcode', 'percentage'],
-            key_on='feature.properties.' + zipcode_field,
-            fill_color='YlOrRd',
-            fill_opacity=0.7,
-            line_opacity=0.2,
-            legend_name=f'Percentage of Dogs Named {name} (%)',
-            highlight=True
-        ).add_to(nyc_map)
-        
-        # Create tooltip fields based on available columns
-        tooltip_fields = [zipcode_field]
-        tooltip_aliases = ['Zip Code:']
-        
-        # Add borough and neighborhood if available
-        if 'borough' in nyc_zipcodes.columns:
-            tooltip_fields.append('borough')
-            tooltip_aliases.append('Borough:')
-        if 'neighborhood' in nyc_zipcodes.columns:
-            tooltip_fields.append('neighborhood')
-            tooltip_aliases.append('Neighborhood:')
-        
-        # Add tooltips to show data on hover
-        tooltip = GeoJsonTooltip(
-            fields=tooltip_fields,
-            aliases=tooltip_aliases,
-            localize=True,
-            sticky=False,
-            labels=True,
-            style="""
-                background-color: #F0EFEF;
-                border: 2px solid black;
-                border-radius: 3px;
-                box-shadow: 3px;
-            """,
-        )
-        
-        # Add GeoJSON layer with tooltips
-        folium.GeoJson(
-            nyc_zipcodes,
-            name='NYC Zipcodes',
-            tooltip=tooltip,
-            style_function=lambda feature: {
-                'fillColor': 'transparent',
-                'color': 'black',
-                'weight': 1
-            }
-        ).add_to(nyc_map)
-        
-        # Add a title
-        title_html = f'''
-            <div style="position: fixed; top: 10px; left: 50%; transform: translateX(-50%); z-index:9999; background-color: white; 
-                 padding: 10px; border: 2px solid grey; border-radius: 5px;">
-                <h3 style="text-align: center; margin: 0;">Dogs Named {name} in NYC</h3>
-                <p style="text-align: center; margin: 0;">Total: {name_info['total_count']} dogs</p>
-            </div>
-        '''
-        nyc_map.get_root().html.add_child(folium.Element(title_html))
-        
-        # Add layer control
-        folium.LayerControl().add_to(nyc_map)
-        
-        # Save the map
-        nyc_map.save(f'maps/names/{safe_name}_map.html')
-    
-    print(f"Name maps created in maps/names/ directory")
+    render_entity_maps(entity_type, filtered.items(), nyc_zipcodes, jobs=jobs)
+    print(f"{entity_type.capitalize()} maps created in maps/{entity_type}/ directory")
+
+def create_breed_choropleth_maps(jobs=1):
+    """Create choropleth maps for dog breeds by NYC zip code"""
+    create_entity_choropleth_maps('breeds', jobs=jobs)
+
+def create_name_choropleth_maps(jobs=1):
+    """Create choropleth maps for dog names by NYC zip code"""
+    create_entity_choropleth_maps('names', jobs=jobs)
 
 def create_web_interface():
     """Create a simple web interface to view the maps"""
@@ -601,359 +468,43 @@ def create_web_interface():
     
     print("Created web interface in website/index.html")
 
-def create_breed_map(breed, breed_info, nyc_zipcodes):
-    """Create a choropleth map for a single dog breed by NYC zip code"""
-    safe_name = breed.replace('/', '_').replace(' ', '_')
-    print(f"Creating choropleth map for breed: {breed}")
-    
-    # Create the map centered on NYC
-    nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=10, 
-                         tiles='CartoDB positron')
-    
-    # Create a DataFrame with zipcode and dog count
-    zipcode_counts = pd.DataFrame(list(breed_info['zipcode_counts'].items()), 
-                                  columns=['zipcode', 'count'])
-    
-    # Make sure zipcode is a string for proper join
-    zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str)
-    
-    # Calculate the percentage of this breed in each zipcode
-    zipcode_counts['percentage'] = zipcode_counts['count'] / zipcode_counts['count'].sum() * 100
-    
-    # Print a sample of the zipcode counts for debugging
-    print(f"Sample zipcode counts for {breed}:")
-    print(zipcode_counts.head())
-    
-    # Print the first few zipcodes to verify format
-    print(f"First few zipcodes in data: {zipcode_counts['zipcode'].head().tolist()}")
-    
-    # Create dictionaries for easy lookup - convert to string and ensure no decimal points
-    zipcode_to_count = {}
-    zipcode_to_percent = {}
-    for _, row in zipcode_counts.iterrows():
-        # Remove decimal point if it exists
-        zip_str = str(row['zipcode']).split('.')[0]
-        zipcode_to_count[zip_str] = row['count']
-        zipcode_to_percent[zip_str] = row['percentage']
-    
-    # Update the dataframe with cleaned zipcodes (no decimal points)
-    zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str).apply(lambda x: x.split('.')[0])
-    
-    # Ensure zip codes in GeoDataFrame are strings for proper matching
-    if nyc_zipcodes.columns.dtype != 'object':
-        nyc_zipcodes = nyc_zipcodes.astype(str)
-    
-    # Identify the zipcode field in the GeoDataFrame
-    zipcode_field = 'ZCTA'  # Default
-    if 'postalCode' in nyc_zipcodes.columns:
-        zipcode_field = 'postalCode'
-    elif 'ZCTA' in nyc_zipcodes.columns:
-        zipcode_field = 'ZCTA'
-    else:
-        # Try to find a suitable zipcode column
-        zipcode_candidates = [col for col in nyc_zipcodes.columns if any(x in col.lower() for x in ['zip', 'postal', 'zcta'])]
-        zipcode_field = zipcode_candidates[0] if zipcode_candidates else 'ZCTA'
-    
-    # Make sure all zipcodes in the geodata are strings without decimals
-    nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].astype(str)
-    nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].apply(lambda x: x.split('.')[0] if '.' in x else x)
-    
-    # Check for any matching zipcodes between the data and the GeoDataFrame
-    matching_zipcodes = set(zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-    print(f"Number of matching zipcodes: {len(matching_zipcodes)} out of {len(zipcode_counts)} in data")
-    
-    # If there are too few matching zipcodes, we need to transform the zipcodes to match
-    if len(matching_zipcodes) < 5:
-        print(f"Warning: Very few matching zipcodes for {breed}. Attempting to fix...")
-        
-        # Try to format zipcodes differently (handles different formats like '00123' vs '123')
-        # This helps if the data has zipcode formats different from the GeoDataFrame
-        geo_zips = set(nyc_zipcodes[zipcode_field])
-        
-        # Try with and without leading zeros
-        fixed_counts = {}
-        for zip_str, count in zipcode_to_count.items():
-            # Try adding leading zeros if needed
-            if zip_str not in geo_zips and zip_str.isdigit():
-                zip_5digit = zip_str.zfill(5)
-                if zip_5digit in geo_zips:
-                    fixed_counts[zip_5digit] = count
-                    continue
-            
-            # Try removing leading zeros
-            if zip_str not in geo_zips and zip_str.startswith('0'):
-                zip_no_zero = zip_str.lstrip('0')
-                if zip_no_zero in geo_zips:
-                    fixed_counts[zip_no_zero] = count
-                    continue
-            
-            # Keep original if no matches found
-            fixed_counts[zip_str] = count
-        
-        # Recreate the zipcode_counts DataFrame with fixed zipcodes
-        fixed_zipcode_counts = pd.DataFrame(list(fixed_counts.items()), columns=['zipcode', 'count'])
-        fixed_zipcode_counts['percentage'] = fixed_zipcode_counts['count'] / fixed_zipcode_counts['count'].sum() * 100
-        
-        # Check if we have more matches now
-        fixed_matching = set(fixed_zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-        print(f"After fixing, matching zipcodes: {len(fixed_matching)} out of {len(fixed_zipcode_counts)}")
-        
-        # Use the fixed data if we have more matches
-        if len(fixed_matching) > len(matching_zipcodes):
-            zipcode_counts = fixed_zipcode_counts
-            zipcode_to_count = fixed_counts
-            print("Using fixed zipcode format for better map matching")
-            
-    # Add the choropleth layer
-    choropleth = folium.Choropleth(
-        geo_data=nyc_zipcodes,
-        name=f'{breed} Distribution',
-        data=zipcode_counts,
-        columns=['zipcode', 'percentage'],
-        key_on='feature.properties.' + zipcode_field,
-        fill_color='YlOrRd',
-        fill_opacity=0.7,
-        line_opacity=0.2,
-        legend_name=f'Percentage of {breed} Dogs (%)',
-        highlight=True
-    ).add_to(nyc_map)
-    
-    # Create tooltip fields based on available columns
-    tooltip_fields = [zipcode_field]
-    tooltip_aliases = ['Zip Code:']
-    
-    # Add borough and neighborhood if available
-    if 'borough' in nyc_zipcodes.columns:
-        tooltip_fields.append('borough')
-        tooltip_aliases.append('Borough:')
-    if 'neighborhood' in nyc_zipcodes.columns:
-        tooltip_fields.append('neighborhood')
-        tooltip_aliases.append('Neighborhood:')
-    
-    # Add tooltips to show data on hover
-    tooltip = GeoJsonTooltip(
-        fields=tooltip_fields,
-        aliases=tooltip_aliases,
-        localize=True,
-        sticky=False,
-        labels=True,
-        style="""
-            background-color: #F0EFEF;
-            border: 2px solid black;
-            border-radius: 3px;
-            box-shadow: 3px;
-        """,
-    )
-    
-    # Add GeoJSON layer with tooltips
-    folium.GeoJson(
-        nyc_zipcodes,
-        name='NYC Zipcodes',
-        tooltip=tooltip,
-        style_function=lambda feature: {
-            'fillColor': 'transparent',
-            'color': 'black',
-            'weight': 1
-        }
-    ).add_to(nyc_map)
-    
-    # Add a title
-    title_html = f'''
-        <div style="position: fixed; top: 10px; left: 50%; transform: translateX(-50%); z-index:9999; background-color: white; 
-             padding: 10px; border: 2px solid grey; border-radius: 5px;">
-            <h3 style="text-align: center; margin: 0;">{breed} Distribution in NYC</h3>
-            <p style="text-align: center; margin: 0;">Total: {breed_info['total_count']} dogs</p>
-        </div>
-    '''
-    nyc_map.get_root().html.add_child(folium.Element(title_html))
-    
-    # Add layer control
-    folium.LayerControl().add_to(nyc_map)
-    
-    # Create maps directory if it doesn't exist
-    os.makedirs('maps/breeds', exist_ok=True)
-    
-    # Save the map
-    nyc_map.save(f'maps/breeds/{safe_name}_map.html')
-    
-    print(f"Created map for {breed}")
-
-def create_name_map(name, name_info, nyc_zipcodes):
-    """Create a choropleth map for a single dog name by NYC zip code"""
-    safe_name = name.replace('/', '_').replace(' ', '_')
-    print(f"Creating choropleth map for name: {name}")
+def create_entity_map(entity_type, entity, info, nyc_zipcodes, metric='percentage', scheme=DEFAULT_SCHEME):
+    """
+    Create a folium choropleth map for one entity (a breed, name, ...) by NYC zip code.
+    nyc_zipcodes comes from load_map_geometry(). metric is 'percentage' (share of
+    the entity's dogs), 'count' or 'density' (dogs per km^2); the zips are coloured
+    by the entity's stored classes of that metric and classification scheme.
+    """
+    print(f"Creating choropleth map for {entity_type}: {entity}")
+    zipcode_field = get_zipcode_field(nyc_zipcodes)
     
     # Create the map centered on NYC
-    nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=10, 
-                         tiles='CartoDB positron')
-    
-    # Create a DataFrame with zipcode and dog count
-    zipcode_counts = pd.DataFrame(list(name_info['zipcode_counts'].items()), 
-                                  columns=['zipcode', 'count'])
-    
-    # Make sure zipcode is a string for proper join
-    zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str)
-    
-    # Calculate the percentage of this name in each zipcode
-    zipcode_counts['percentage'] = zipcode_counts['count'] / zipcode_counts['count'].sum() * 100
-    
-    # Print a sample of the zipcode counts for debugging
-    print(f"Sample zipcode counts for {name}:")
-    print(zipcode_counts.head())
+    nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=10, **map_tiles())
     
-    # Print the first few zipcodes to verify format
-    print(f"First few zipcodes in data: {zipcode_counts['zipcode'].head().tolist()}")
+    # One row per zipcode with the entity's count and share of its dogs
+    zip_metrics = compute_zip_metrics(info, get_zip_areas())
+    zipcode_counts = pd.DataFrame([{'zipcode': zipcode, 'count': values['count'], 'percentage': values['percentage']}
+                                   for zipcode, values in zip_metrics.items()])
     
-    # Create dictionaries for easy lookup - convert to string and ensure no decimal points
-    zipcode_to_count = {}
-    zipcode_to_percent = {}
-    for _, row in zipcode_counts.iterrows():
-        # Remove decimal point if it exists
-        zip_str = str(row['zipcode']).split('.')[0]
-        zipcode_to_count[zip_str] = row['count']
-        zipcode_to_percent[zip_str] = row['percentage']
-    
-    # Update the dataframe with cleaned zipcodes (no decimal points)
-    zipcode_counts['zipcode'] = zipcode_counts['zipcode'].astype(str).apply(lambda x: x.split('.')[0])
-    
-    # Ensure zip codes in GeoDataFrame are strings for proper matching
-    if nyc_zipcodes.columns.dtype != 'object':
-        nyc_zipcodes = nyc_zipcodes.astype(str)
-    
-    # Identify the zipcode field in the GeoDataFrame
-    zipcode_field = 'ZCTA'  # Default
-    if 'postalCode' in nyc_zipcodes.columns:
-        zipcode_field = 'postalCode'
-    elif 'ZCTA' in nyc_zipcodes.columns:
-        zipcode_field = 'ZCTA'
-    else:
-        # Try to find a suitable zipcode column
-        zipcode_candidates = [col for col in nyc_zipcodes.columns if any(x in col.lower() for x in ['zip', 'postal', 'zcta'])]
-        zipcode_field = zipcode_candidates[0] if zipcode_candidates else 'ZCTA'
-    
-    # Make sure all zipcodes in the geodata are strings without decimals
-    nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].astype(str)
-    nyc_zipcodes[zipcode_field] = nyc_zipcodes[zipcode_field].apply(lambda x: x.split('.')[0] if '.' in x else x)
-    
-    # Check for any matching zipcodes between the data and the GeoDataFrame
-    matching_zipcodes = set(zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-    print(f"Number of matching zipcodes: {len(matching_zipcodes)} out of {len(zipcode_counts)} in data")
-    
-    # If there are too few matching zipcodes, we need to transform the zipcodes to match
-    if len(matching_zipcodes) < 5:
-        print(f"Warning: Very few matching zipcodes for {name}. Attempting to fix...")
-        
-        # Try to format zipcodes differently (handles different formats like '00123' vs '123')
-        # This helps if the data has zipcode formats different from the GeoDataFrame
-        geo_zips = set(nyc_zipcodes[zipcode_field])
-        
-        # Try with and without leading zeros
-        fixed_counts = {}
-        for zip_str, count in zipcode_to_count.items():
-            # Try adding leading zeros if needed
-            if zip_str not in geo_zips and zip_str.isdigit():
-                zip_5digit = zip_str.zfill(5)
-                if zip_5digit in geo_zips:
-                    fixed_counts[zip_5digit] = count
-                    continue
-            
-            # Try removing leading zeros
-            if zip_str not in geo_zips and zip_str.startswith('0'):
-                zip_no_zero = zip_str.lstrip('0')
-                if zip_no_zero in geo_zips:
-                    fixed_counts[zip_no_zero] = count
-                    continue
-            
-            # Keep original if no matches found
-            fixed_counts[zip_str] = count
-        
-        # Recreate the zipcode_counts DataFrame with fixed zipcodes
-        fixed_zipcode_counts = pd.DataFrame(list(fixed_counts.items()), columns=['zipcode', 'count'])
-        fixed_zipcode_counts['percentage'] = fixed_zipcode_counts['count'] / fixed_zipcode_counts['count'].sum() * 100
-        
-        # Check if we have more matches now
-        fixed_matching = set(fixed_zipcode_counts['zipcode']) & set(nyc_zipcodes[zipcode_field])
-        print(f"After fixing, matching zipcodes: {len(fixed_matching)} out of {len(fixed_zipcode_counts)}")
-        
-        # Use the fixed data if we have more matches
-        if len(fixed_matching) > len(matching_zipcodes):
-            zipcode_counts = fixed_zipcode_counts
-            zipcode_to_count = fixed_counts
-            print("Using fixed zipcode format for better map matching")
-        
-    # Add the choropleth layer
-    choropleth = folium.Choropleth(
-        geo_data=nyc_zipcodes,
-        name=f'{name} Distribution',
-        data=zipcode_counts,
-        columns=['zipcode', 'percentage'],
-        key_on='feature.properties.' + zipcode_field,
-        fill_color='YlOrRd',
-        fill_opacity=0.7,
-        line_opacity=0.2,
-        legend_name=f'Percentage of Dogs Named {name} (%)',
-        highlight=True
-    ).add_to(nyc_map)
-    
-    # Create tooltip fields based on available columns
-    tooltip_fields = [zipcode_field]
-    tooltip_aliases = ['Zip Code:']
-    
-    # Add borough and neighborhood if available
-    if 'borough' in nyc_zipcodes.columns:
-        tooltip_fields.append('borough')
-        tooltip_aliases.append('Borough:')
-    if 'neighborhood' in nyc_zipcodes.columns:
-        tooltip_fields.append('neighborhood')
-        tooltip_aliases.append('Neighborhood:')
-    
-    # Add tooltips to show data on hover
-    tooltip = GeoJsonTooltip(
-        fields=tooltip_fields,
-        aliases=tooltip_aliases,
-        localize=True,
-        sticky=False,
-        labels=True,
-        style="""
-            background-color: #F0EFEF;
-            border: 2px solid black;
-            border-radius: 3px;
-            box-shadow: 3px;
-        """,
-    )
-    
-    # Add GeoJSON layer with tooltips
-    folium.GeoJson(
-        nyc_zipcodes,
-        name='NYC Zipcodes',
-        tooltip=tooltip,
-        style_function=lambda feature: {
-            'fillColor': 'transparent',
-            'color': 'black',
-            'weight': 1
-        }
-    ).add_to(nyc_map)
+    # Add a single zip layer that carries the colours, counts and tooltip data
+    bounds, classes = load_class_table(entity_type).select(metric, scheme, [entity])
+    create_zip_layer(nyc_map, nyc_zipcodes, zipcode_field, zipcode_counts, (bounds[:, 0], classes[:, 0]),
+                     layer_name=f'{entity} Distribution', legend_name=get_legend_name(entity_type, entity, metric))
     
     # Add a title
-    title_html = f'''
-        <div style="position: fixed; top: 10px; left: 50%; transform: translateX(-50%); z-index:9999; background-color: white; 
-             padding: 10px; border: 2px solid grey; border-radius: 5px;">
-            <h3 style="text-align: center; margin: 0;">Dogs Named {name} in NYC</h3>
-            <p style="text-align: center; margin: 0;">Total: {name_info['total_count']} dogs</p>
-        </div>
-    '''
+    title_html = format_map_title(entity_type, entity, info)
     nyc_map.get_root().html.add_child(folium.Element(title_html))
     
     # Add layer control
     folium.LayerControl().add_to(nyc_map)
     
-    # Create maps directory if it doesn't exist
-    os.makedirs('maps/names', exist_ok=True)
-    
-    # Save the map
-    nyc_map.save(f'maps/names/{safe_name}_map.html')
+    # Save the map, with stable element ids so unchanged maps stay byte-identical
+    os.makedirs(f'maps/{entity_type}', exist_ok=True)
+    assign_fixed_ids(nyc_map.get_root())
+    with atomic_open(get_map_path(entity_type, entity, metric), 'wb') as f:
+        nyc_map.save(f, close_file=False)
     
-    print(f"Created map for {name}")
+    print(f"Created map for {entity}")
 
 if __name__ == "__main__":
     # Create maps
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Precomputed kernel density overlays for the heatmaps/ pages.
+
+Instead of a Leaflet heat layer that recomputes the surface on every pan and
+zoom, each page shows one georeferenced image. The surfaces are weighted
+Gaussian kernel density estimates over the zip centroids, on a fixed Web
+Mercator grid covering the city, so the image lines up with the basemap when
+Leaflet stretches it over its bounds.
+
+The Gaussian kernel is separable, so the surfaces of all entities come from
+two small kernel matrices (grid columns x zips, grid rows x zips) and one
+tensor product with the (zips x entities) count matrix.
+
+Output:
+    heatmaps/<type>/rasters/<entity>_kde.png (and .webp) - RGBA overlays
+    heatmaps/<type>/<entity>_heatmap.html               - map page per entity
+    heatmaps/overlays.json                              - bounds and grid of the overlays
+"""
+
+import os
+import json
+import numpy as np
+import folium
+from branca.element import MacroElement, Template
+from matplotlib import colormaps
+from PIL import Image, features
+from pyproj import Transformer
+
+from zip_layer import load_zip_layer, load_zip_index
+from entity_counts import ENTITY_TYPES, load_entity_data, build_count_matrix
+from create_heatmaps import MAP_LABELS, assign_fixed_ids
+from basemap_tiles import map_tiles
+from publish import atomic_open
+
+OVERLAY_DIR = 'heatmaps'
+OVERLAY_CRS = 'EPSG:3857'
+
+# Kernel bandwidth and grid cell size in metres on the ground
+BANDWIDTH_M = 800
+CELL_SIZE_M = 150
+
+# Surfaces below this fraction of an entity's peak are left transparent
+MIN_VISIBLE = 0.03
+
+# Entities per tensor product, to bound memory with many names
+BATCH_SIZE = 64
+
+class OverlayGrid:
+    """A regular Web Mercator grid over the zip layer, padded by the kernel reach"""
+
+    def __init__(self, zipcode_gdf, bandwidth_m=BANDWIDTH_M, cell_size_m=CELL_SIZE_M):
+        projected = zipcode_gdf.geometry.to_crs(OVERLAY_CRS)
+        west, south, east, north = projected.total_bounds
+
+        # Web Mercator stretches distances by 1/cos(latitude)
+        _, south_lat, _, north_lat = zipcode_gdf.geometry.to_crs('EPSG:4326').total_bounds
+        center_lat = np.radians((south_lat + north_lat) / 2)
+        scale = 1 / np.cos(center_lat)
+        self.bandwidth = bandwidth_m * scale
+        cell = cell_size_m * scale
+        pad = 2 * self.bandwidth
+        west, south, east, north = west - pad, south - pad, east + pad, north + pad
+
+        self.width = int(np.ceil((east - west) / cell))
+        self.height = int(np.ceil((north - south) / cell))
+        # Cell centres; rows run north to south like image rows
+        self.x = west + (np.arange(self.width) + 0.5) * cell
+        self.y = north - (np.arange(self.height) + 0.5) * cell
+
+        to_latlng = Transformer.from_crs(OVERLAY_CRS, 'EPSG:4326', always_xy=True)
+        west_lng, south_lat = to_latlng.transform(west, north - self.height * cell)
+        east_lng, north_lat = to_latlng.transform(west + self.width * cell, north)
+        self.bounds = [[south_lat, west_lng], [north_lat, east_lng]]
+
+        points = projected.representative_point()
+        self.points_x = points.x.to_numpy()
+        self.points_y = points.y.to_numpy()
+
+    def kernel_matrices(self):
+        """Return the (columns x zips) and (rows x zips) halves of the Gaussian kernel"""
+        kx = np.exp(-0.5 * ((self.x[:, None] - self.points_x[None, :]) / self.bandwidth) ** 2)
+        ky = np.exp(-0.5 * ((self.y[:, None] - self.points_y[None, :]) / self.bandwidth) ** 2)
+        return kx.astype(np.float32), ky.astype(np.float32)
+
+def compute_density_surfaces(grid, counts):
+    """
+    Return a (entities x rows x columns) array of density surfaces for a
+    (zips x entities) count matrix, each scaled to a peak of 1.
+    """
+    kx, ky = grid.kernel_matrices()
+    counts = counts.astype(np.float32)
+    surfaces = np.empty((counts.shape[1], grid.height, grid.width), dtype=np.float32)
+
+    for start in range(0, counts.shape[1], BATCH_SIZE):
+        batch = counts[:, start:start + BATCH_SIZE]
+        # sum_z ky[row, z] * kx[col, z] * counts[z, e]
+        weighted = kx[:, :, None] * batch[None, :, :]
+        density = np.tensordot(ky, weighted, axes=([1], [1]))
+        surfaces[start:start + batch.shape[1]] = np.moveaxis(density, 2, 0)
+
+    peaks = surfaces.reshape(len(surfaces), -1).max(axis=1)
+    surfaces /= np.where(peaks > 0, peaks, 1)[:, None, None]
+    return surfaces
+
+def surface_to_rgba(surface, colormap=colormaps['YlOrRd']):
+    """Colour a 0-1 surface, fading low densities to transparent"""
+    rgba = colormap(surface, bytes=True)
+    alpha = np.clip(surface / 0.3, 0, 1) * 220
+    rgba[..., 3] = np.where(surface >= MIN_VISIBLE, alpha, 0).astype(np.uint8)
+    return rgba
+
+def write_overlay_images(surface, path_stem):
+    """Write the overlay as PNG and, where Pillow supports it, WebP; returns the file to display"""
+    image = Image.fromarray(surface_to_rgba(surface), 'RGBA')
+    with atomic_open(f'{path_stem}.png', 'wb') as f:
+        image.save(f, 'PNG', optimize=True)
+    if features.check('webp'):
+        with atomic_open(f'{path_stem}.webp', 'wb') as f:
+            image.save(f, 'WEBP', lossless=True, method=6)
+        return f'{path_stem}.webp'
+    return f'{path_stem}.png'
+
+class ImageOverlayLayer(MacroElement):
+    """A plain L.imageOverlay with a URL, which folium.ImageOverlay would inline as base64"""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            L.imageOverlay({{ this.url|tojson }}, {{ this.bounds|tojson }},
+                           {opacity: 0.85, interactive: false}).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, bounds):
+        super().__init__()
+        self._name = 'ImageOverlayLayer'
+        self.url = url
+        self.bounds = bounds
+
+def create_overlay_page(entity_type, entity, image_path, bounds):
+    """Write heatmaps/<type>/<entity>_heatmap.html showing the entity's overlay"""
+    safe_name = entity.replace('/', '_').replace(' ', '_')
+    page_dir = f'{OVERLAY_DIR}/{entity_type}'
+
+    nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=11, **map_tiles())
+    heading = MAP_LABELS[entity_type][0].format(entity)
+    title_html = f'<h3 align="center" style="font-size:16px"><b>{heading}</b></h3>'
+    nyc_map.get_root().html.add_child(folium.Element(title_html))
+    nyc_map.add_child(ImageOverlayLayer(os.path.relpath(image_path, page_dir).replace(os.sep, '/'), bounds))
+
+    assign_fixed_ids(nyc_map.get_root())
+    with atomic_open(f'{page_dir}/{safe_name}_heatmap.html', 'wb') as f:
+        nyc_map.save(f, close_file=False)
+
+def prune_overlays(entity_type, current):
+    """
+    Remove the pages and rasters (and their .gz/.br copies) of entities that
+    are no longer mapped, e.g. old heat layer pages or entities now below
+    min_count. current holds the kept paths relative to the type's directory.
+    """
+    type_dir = f'{OVERLAY_DIR}/{entity_type}'
+    for subdir in ('', 'rasters/'):
+        for name in os.listdir(f'{type_dir}/{subdir}'):
+            path = f'{subdir}{name}'
+            if os.path.isfile(f'{type_dir}/{path}') and path.removesuffix('.gz').removesuffix('.br') not in current:
+                os.remove(f'{type_dir}/{path}')
+
+def build_density_overlays(min_count=500, limit=None):
+    """
+    Compute the density surfaces of every breed and name with at least
+    min_count dogs (only the `limit` most common of each, if given) and write
+    their pages
+    """
+    print(f"Building density overlays for breeds and names with at least {min_count} dogs...")
+    grid = OverlayGrid(load_zip_layer())
+    zipcodes = load_zip_index()['zipcodes']
+    print(f"Overlay grid: {grid.width} x {grid.height} cells, {BANDWIDTH_M} m bandwidth")
+
+    for entity_type in ENTITY_TYPES:
+        entity_data = {entity: info for entity, info in load_entity_data(entity_type).items()
+                       if info.get('total_count', 0) >= min_count}
+        if limit is not None:
+            entity_data = dict(sorted(entity_data.items(), key=lambda x: x[1]['total_count'], reverse=True)[:limit])
+        entities, counts = build_count_matrix(entity_data, zipcodes)
+        surfaces = compute_density_surfaces(grid, counts)
+
+        os.makedirs(f'{OVERLAY_DIR}/{entity_type}/rasters', exist_ok=True)
+        current = set()
+        for entity, surface in zip(entities, surfaces):
+            safe_name = entity.replace('/', '_').replace(' ', '_')
+            image_path = write_overlay_images(surface, f'{OVERLAY_DIR}/{entity_type}/rasters/{safe_name}_kde')
+            create_overlay_page(entity_type, entity, image_path, grid.bounds)
+            current.add(f'{safe_name}_heatmap.html')
+            current.update(f'rasters/{safe_name}_kde.{extension}' for extension in ('png', 'webp'))
+        prune_overlays(entity_type, current)
+        print(f"Wrote {len(entities)} {entity_type} overlays")
+
+    with atomic_open(f'{OVERLAY_DIR}/overlays.json') as f:
+        json.dump({
+            'bounds': grid.bounds,
+            'crs': OVERLAY_CRS,
+            'width': grid.width,
+            'height': grid.height,
+            'bandwidth_m': BANDWIDTH_M,
+            'cell_size_m': CELL_SIZE_M
+        }, f, sort_keys=True)
+
+if __name__ == "__main__":
+    build_density_overlays()
@@ -0,0 +1,114 @@
+"""
+Per-entity zipcode count vectors aligned to the canonical zip index.
+
+Breeds and names are stored in data/popular_*.json as {entity: {total_count,
+zipcode_counts}}. Batch jobs work on the same data as a dense count matrix with
+one row per zip (in zip_layer order) and one column per entity. Any other
+column of the dog records (gender, birth year, ...) can be counted into the
+same kind of matrix with build_dimension_matrix().
+"""
+
+import json
+import numpy as np
+import pandas as pd
+
+from zip_layer import normalize_zipcode
+
+ENTITY_TYPES = ['breeds', 'names']
+
+# Column of data/nycdogs_unique.csv counted by each map dimension
+DIMENSION_COLUMNS = {
+    'breeds': 'BreedName',
+    'names': 'AnimalName',
+    'genders': 'AnimalGender',
+    'birth_years': 'AnimalBirthYear'
+}
+
+# Per-zip metrics the maps and API can show for an entity
+METRICS = ['count', 'percentage', 'density']
+
+def load_entity_data(entity_type, data_dir='data'):
+    """Load the popular breed or name data written by preprocess_data.py"""
+    with open(f'{data_dir}/popular_{entity_type}.json', 'r') as f:
+        return json.load(f)
+
+def load_zipcode_totals():
+    """Load the total number of dogs per zipcode, if preprocessing produced it"""
+    try:
+        with open('data/zipcode_totals.json', 'r') as f:
+            return {normalize_zipcode(zipcode): count for zipcode, count in json.load(f).items()}
+    except FileNotFoundError:
+        return None
+
+def compute_zip_metrics(info, zip_areas):
+    """
+    Return {zipcode: {count, percentage, density}} for one entity, where
+    percentage is the share of the entity's dogs and density is dogs per km^2.
+    """
+    counts = {}
+    for zipcode, count in info['zipcode_counts'].items():
+        zipcode = normalize_zipcode(zipcode)
+        counts[zipcode] = counts.get(zipcode, 0) + count
+    total = sum(counts.values())
+
+    metrics = {}
+    for zipcode, count in counts.items():
+        area = zip_areas.get(zipcode)
+        metrics[zipcode] = {
+            'count': count,
+            'percentage': count / total * 100 if total else 0.0,
+            'density': count / area if area else None
+        }
+    return metrics
+
+def build_count_matrix(entity_data, zipcodes):
+    """
+    Build a (zips x entities) count matrix for entity_data.
+    Counts for zipcodes outside the zip index are dropped.
+    """
+    zip_position = {zipcode: i for i, zipcode in enumerate(zipcodes)}
+    entities = list(entity_data.keys())
+    matrix = np.zeros((len(zipcodes), len(entities)))
+
+    for column, entity in enumerate(entities):
+        for zipcode, count in entity_data[entity]['zipcode_counts'].items():
+            row = zip_position.get(normalize_zipcode(zipcode))
+            if row is not None:
+                matrix[row, column] += count
+
+    return entities, matrix
+
+def build_metric_matrices(counts, areas):
+    """
+    Return {metric: (zips x entities) matrix} for a count matrix and each
+    zip's area in km^2 (NaN where unknown), like compute_zip_metrics for
+    every entity at once.
+    """
+    totals = counts.sum(axis=0)
+    percentage = np.divide(counts * 100, totals, out=np.zeros_like(counts), where=totals > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        density = counts / areas[:, None]
+    return {'count': counts, 'percentage': percentage, 'density': density}
+
+def load_records():
+    """Load the deduplicated dog records written by preprocess_data.py"""
+    return pd.read_csv('data/nycdogs_unique.csv', low_memory=False)
+
+def build_dimension_matrix(records, dimension, zipcodes, min_count=1):
+    """
+    Count the dog records by zip and by the dimension's column in one crosstab.
+    Returns (entities, totals, matrix) for the values with at least min_count
+    dogs, sorted by total; totals include dogs outside the zip index, like the
+    total_count of data/popular_*.json.
+    """
+    values = records[DIMENSION_COLUMNS[dimension]]
+    valid = values.notna()
+    # Birth years are read as floats when the column has gaps
+    values = values[valid].astype(str).str.replace(r'\.0$', '', regex=True)
+    zip_values = records.loc[valid, 'ZipCode'].map(normalize_zipcode)
+
+    table = pd.crosstab(zip_values, values)
+    totals = table.sum(axis=0).sort_values(ascending=False)
+    totals = totals[totals >= min_count]
+    table = table.reindex(index=zipcodes, columns=totals.index, fill_value=0)
+    return totals.index.tolist(), totals.to_numpy(), table.to_numpy(dtype=float)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Template-compiled map renderer.
+
+Every breed and name map is the same folium page: the same base map, the same
+zip geometry, tooltip, highlight, legend and layer control. Only the title and
+the per-zip values differ. MapTemplate renders that page through folium once,
+with placeholders where the title and the data payload go, and each map is then
+written by joining the pre-split template with the entity's payload. No folium
+objects are built and no Jinja rendering happens per map.
+
+Payloads are built per count matrix: the percentage, density and colour
+classes of every entity in a dimension (breeds, names, genders, birth years)
+are computed in one pass, then each map only serializes its column. Breeds
+and names take their classes from the shared tables of classification.py.
+
+Each payload also carries the bounds of the zips where the entity has dogs, and
+the page zooms to them. Borough-scoped maps (render_dimension_maps with a
+borough) use a template built from only that borough's zips and payloads
+classified over that borough, so their size and render time follow the area
+shown rather than the whole city.
+
+The output files have the same names as the folium-rendered maps, so the
+website links don't change. Run with --benchmark to compare the two renderers,
+or with --dimension birth_years to map another dimension of the dog records.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import folium
+import numpy as np
+from branca.element import MacroElement, Template
+
+from zip_layer import BOROUGHS, normalize_zipcode, get_borough, get_zip_areas, load_zip_layer, load_zip_index
+from entity_counts import (DIMENSION_COLUMNS, METRICS, load_entity_data, load_records,
+                           build_count_matrix, build_dimension_matrix, build_metric_matrices)
+from classification import (CLASS_COLORS, SCHEMES, DEFAULT_SCHEME, class_palette, classify_matrix,
+                            load_class_table)
+from map_manifest import hash_text
+from basemap_tiles import map_tiles
+from create_heatmaps import format_map_title, get_legend_name, get_map_path, load_map_geometry, assign_fixed_ids
+from publish import atomic_open
+
+TITLE_PLACEHOLDER = '__DOG_MAP_TITLE__'
+DATA_PLACEHOLDER = '__DOG_MAP_DATA__'
+
+class ZipDataLayer(MacroElement):
+    """
+    The zip layer, tooltip, legend and layer control as one script. Fill
+    colours and tooltip values are read from the data payload at page load.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var dogMapData = """ + DATA_PLACEHOLDER + """;
+            var dogMapLayer = L.geoJson({{ this.geometry }}, {
+                style: function(feature) {
+                    var values = dogMapData.values[feature.properties.zipcode];
+                    var color = values ? values[3] : null;
+                    return {fillColor: color || 'transparent', fillOpacity: color ? 0.7 : 0,
+                            color: 'black', weight: 1, opacity: 0.2};
+                },
+                onEachFeature: function(feature, layer) {
+                    layer.on({
+                        mouseover: function(e) { e.target.setStyle({weight: 3, fillOpacity: 0.9}); },
+                        mouseout: function(e) { dogMapLayer.resetStyle(e.target); }
+                    });
+                }
+            }).bindTooltip(function(layer) {
+                var props = layer.feature.properties;
+                var values = dogMapData.values[props.zipcode] || [0, 0, null];
+                var fields = dogMapData.fields || ['Dogs:', 'Percentage (%):', 'Dogs per km²:'];
+                var rows = [['Zip Code:', props.zipcode], ['Borough:', props.borough || 'N/A']].concat(
+                    fields.map(function(field, i) {
+                        return [field, values[i] === null ? 'N/A' : values[i].toLocaleString()];
+                    }));
+                return '<table>' + rows.map(function(row) {
+                    return '<tr><th>' + row[0] + '</th><td>' + row[1] + '</td></tr>';
+                }).join('') + '</table>';
+            }, {sticky: false, className: 'dog-map-tooltip'}).addTo({{ this._parent.get_name() }});
+            if (dogMapData.bounds) {
+                {{ this._parent.get_name() }}.fitBounds(dogMapData.bounds);
+            }
+
+            var dogMapLegend = L.control({position: 'topright'});
+            dogMapLegend.onAdd = function() {
+                var div = L.DomUtil.create('div', 'dog-map-legend');
+                div.innerHTML = '<strong>' + dogMapData.caption + '</strong><br>' + dogMapData.colors.map(function(color, i) {
+                    return '<i style="background:' + color + '"></i>' +
+                        dogMapData.index[i].toLocaleString() + ' &ndash; ' + dogMapData.index[i + 1].toLocaleString();
+                }).join('<br>');
+                return div;
+            };
+            dogMapLegend.addTo({{ this._parent.get_name() }});
+
+            var dogMapOverlays = {};
+            dogMapOverlays[dogMapData.layer] = dogMapLayer;
+            L.control.layers(null, dogMapOverlays).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        {% macro header(this, kwargs) %}
+            <style>
+                .dog-map-tooltip { background-color: #F0EFEF; border: 2px solid black; border-radius: 3px; }
+                .dog-map-tooltip th { text-align: left; padding-right: 6px; }
+                .dog-map-legend { background-color: white; padding: 6px 8px; border-radius: 5px; line-height: 18px; }
+                .dog-map-legend i { width: 18px; height: 18px; float: left; margin-right: 8px; opacity: 0.7; }
+            </style>
+        {% endmacro %}
+    """)
+
+    def __init__(self, geometry):
+        super().__init__()
+        self._name = 'ZipDataLayer'
+        self.geometry = geometry
+
+class MapTemplate:
+    """A breed/name map page rendered once by folium and split on its placeholders"""
+
+    def __init__(self, nyc_zipcodes, zipcode_field):
+        # Keep only the properties the tooltip reads, with normalized zipcodes
+        columns = [zipcode_field] + (['borough'] if 'borough' in nyc_zipcodes.columns else [])
+        layer_gdf = nyc_zipcodes[columns + ['geometry']].rename(columns={zipcode_field: 'zipcode'})
+        layer_gdf['zipcode'] = layer_gdf['zipcode'].map(normalize_zipcode)
+
+        nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=10, **map_tiles())
+        nyc_map.add_child(ZipDataLayer(layer_gdf.to_json()))
+        nyc_map.get_root().html.add_child(folium.Element(TITLE_PLACEHOLDER))
+        assign_fixed_ids(nyc_map.get_root())
+        html = nyc_map.get_root().render()
+
+        # Odd positions hold the placeholders, even positions the fixed page text
+        self.parts = re.split(f'({TITLE_PLACEHOLDER}|{DATA_PLACEHOLDER})', html)
+        self.version = hash_text(*self.parts)
+
+    def use_vendored_assets(self, manifest, vendor_url):
+        """Point the page's CDN scripts and stylesheets at their vendored copies under vendor_url (see vendor_assets.py)"""
+        from vendor_assets import rewrite_references
+        self.parts = [rewrite_references(part, manifest, vendor_url) for part in self.parts]
+
+    def render(self, entity_type, entity, info, payload):
+        """Return the full HTML page for one entity map from its JSON payload"""
+        return self.render_page(format_map_title(entity_type, entity, info), payload)
+
+    def render_page(self, title_html, payload):
+        """
+        Return a page with any title box and payload. Payloads may carry a
+        'fields' list to relabel the three tooltip values.
+        """
+        substitutions = {TITLE_PLACEHOLDER: title_html, DATA_PLACEHOLDER: payload}
+        return ''.join(substitutions.get(part, part) for part in self.parts)
+
+def get_zip_bounds():
+    """(zips x 4) array of each zip's west, south, east and north edges, in zip index order"""
+    return load_zip_layer().geometry.bounds.to_numpy()
+
+class MatrixPayloads:
+    """
+    Map payloads for every column of a (zips x entities) count matrix. The
+    percentage and density matrices are computed once for the whole matrix,
+    and each metric's classes come precomputed ({metric: (bounds, classes)},
+    see classification.py) or are classified here in one pass. A payload is
+    then just the column's non-zero rows, plus their bounds if zip_bounds
+    (rows like counts, see get_zip_bounds) is given. With a borough, counts
+    holds only its rows and the captions and tooltips say so.
+    """
+
+    def __init__(self, counts, zipcodes, zip_areas, metrics=('percentage',), classes=None, scheme=DEFAULT_SCHEME,
+                 zip_bounds=None, borough=None):
+        areas = np.array([zip_areas.get(zipcode) or np.nan for zipcode in zipcodes])
+        matrices = build_metric_matrices(counts, areas)
+
+        self.zipcodes = zipcodes
+        self.counts = counts
+        self.percentage = np.round(matrices['percentage'], 2)
+        self.density = np.round(matrices['density'], 1)
+        if classes is None:
+            classes = {metric: classify_matrix(matrices[metric], (counts > 0) & np.isfinite(matrices[metric]), scheme)
+                       for metric in metrics}
+        self.classes = classes
+        self.palette = class_palette()
+        self.zip_bounds = zip_bounds
+        self.borough = borough
+
+    def payload(self, column, entity_type, entity, metric):
+        """Return the JSON data block for one map: legend bins and per-zip values"""
+        bounds, classes = self.classes[metric]
+        rows = np.flatnonzero(self.counts[:, column] > 0)
+        values = {}
+        for row, count, percentage, density, cls in zip(rows.tolist(), self.counts[rows, column].tolist(),
+                                                         self.percentage[rows, column].tolist(),
+                                                         self.density[rows, column].tolist(),
+                                                         classes[rows, column].tolist()):
+            values[self.zipcodes[row]] = [int(count), percentage, density if np.isfinite(density) else None,
+                                          self.palette[cls]]
+
+        payload = {
+            'layer': f'{entity} Distribution',
+            'caption': get_legend_name(entity_type, entity, metric, self.borough),
+            'index': [round(float(bound), 2) for bound in bounds[:, column]],
+            'colors': CLASS_COLORS,
+            'values': values
+        }
+        if self.borough:
+            payload['fields'] = ['Dogs:', f'Share in {self.borough} (%):', 'Dogs per km²:']
+        if self.zip_bounds is not None and len(rows):
+            # [[south, west], [north, east]] of the zips with dogs, for fitBounds
+            west, south = self.zip_bounds[rows, :2].min(axis=0)
+            east, north = self.zip_bounds[rows, 2:].max(axis=0)
+            payload['bounds'] = [[round(float(south), 5), round(float(west), 5)],
+                                 [round(float(north), 5), round(float(east), 5)]]
+        # Keep a '</script>' inside an entity name from closing the script block
+        return json.dumps(payload, separators=(',', ':')).replace('</', '<\\/')
+
+def render_dimension_maps(entity_type, entities, infos, counts, template, metrics=('percentage',), only=None,
+                          classes=None, scheme=DEFAULT_SCHEME, borough=None):
+    """
+    Write the maps of every column of a (zips x entities) count matrix in one
+    pass. entity_type is any dimension in create_heatmaps.MAP_LABELS; infos
+    holds each entity's title data (total_count and, optionally, morans_i and
+    clustered). classes and scheme are passed to MatrixPayloads. With a
+    borough, only that borough's rows are mapped, into the borough's map
+    paths, with a template of that borough's zips. Same filenames, `only`
+    filter and progress output as create_heatmaps.render_entity_maps.
+    Returns the list of (entity, metric) maps that failed.
+    """
+    zip_index = load_zip_index()
+    if borough is None:
+        rows = np.arange(len(zip_index['zipcodes']))
+    else:
+        rows = np.flatnonzero(np.array(zip_index['borough'], dtype=object) == borough)
+    os.makedirs(os.path.dirname(get_map_path(entity_type, '', 'percentage', borough)), exist_ok=True)
+    payloads = MatrixPayloads(counts[rows], [zip_index['zipcodes'][row] for row in rows], get_zip_areas(), metrics,
+                              classes, scheme, zip_bounds=get_zip_bounds()[rows], borough=borough)
+    if borough is not None:
+        # Percentages are shares of the borough's dogs, so the title gives that total too
+        infos = [{'borough': borough, 'total_count': int(total), 'city_total': info['total_count']}
+                 for info, total in zip(infos, counts[rows].sum(axis=0).tolist())]
+
+    tasks = [(column, metric) for column in range(len(entities)) for metric in metrics
+             if only is None or get_map_path(entity_type, entities[column], metric, borough) in only]
+    failures = []
+    start = time.time()
+    for i, (column, metric) in enumerate(tasks):
+        entity = entities[column]
+        try:
+            html = template.render(entity_type, entity, infos[column],
+                                   payloads.payload(column, entity_type, entity, metric))
+            with atomic_open(get_map_path(entity_type, entity, metric, borough)) as f:
+                f.write(html)
+            status = 'ok'
+        except Exception as e:
+            print(f"Error rendering {entity_type} map for {entity} ({metric}): {e}", file=sys.stderr)
+            failures.append((entity, metric))
+            status = 'FAILED'
+        print(f"[{i+1}/{len(tasks)}] {entity_type}: {entity} ({metric}) {status} - {time.time() - start:.1f}s elapsed")
+
+    if failures:
+        print(f"{len(failures)} of {len(tasks)} {entity_type} maps failed")
+    return failures
+
+def render_entity_maps_fast(entity_type, entities, template, metrics=('percentage',), only=None, scheme=DEFAULT_SCHEME,
+                            borough=None):
+    """
+    Write maps for (entity, info) pairs, e.g. from data/popular_breeds.json,
+    from a compiled MapTemplate, coloured by the shared class table. Borough
+    maps are classified over the borough's zips instead.
+    """
+    entity_data = dict(entities)
+    names, counts = build_count_matrix(entity_data, load_zip_index()['zipcodes'])
+    classes = None
+    if borough is None:
+        table = load_class_table(entity_type)
+        classes = {metric: table.select(metric, scheme, names) for metric in metrics}
+    return render_dimension_maps(entity_type, names, [entity_data[name] for name in names], counts,
+                                 template, metrics=metrics, only=only, classes=classes, scheme=scheme, borough=borough)
+
+# Fewest dogs an entity needs in a borough to get a map of that borough
+BOROUGH_MAP_MIN_COUNT = 50
+
+def get_borough_entities(entities, min_count=BOROUGH_MAP_MIN_COUNT):
+    """Return {borough: [(entity, info)]} of the (entity, info) pairs with at least min_count dogs in each borough"""
+    by_borough = {borough: [] for borough in BOROUGHS}
+    for entity, info in entities:
+        totals = {}
+        for zipcode, count in info['zipcode_counts'].items():
+            borough = get_borough(zipcode)
+            totals[borough] = totals.get(borough, 0) + count
+        for borough in BOROUGHS:
+            if totals.get(borough, 0) >= min_count:
+                by_borough[borough].append((entity, info))
+    return by_borough
+
+def build_borough_templates(nyc_zipcodes, zipcode_field):
+    """Return {borough: MapTemplate} compiled from only each borough's zips"""
+    return {borough: MapTemplate(nyc_zipcodes[nyc_zipcodes['borough'] == borough], zipcode_field)
+            for borough in BOROUGHS}
+
+def generate_dimension_maps(dimension, min_count=500, metrics=('percentage',), scheme=DEFAULT_SCHEME):
+    """
+    Map every value of a dimension (see entity_counts.DIMENSION_COLUMNS) with
+    at least min_count dogs, counted from the dog records in one crosstab
+    """
+    records = load_records()
+    entities, totals, counts = build_dimension_matrix(records, dimension, load_zip_index()['zipcodes'], min_count)
+    print(f"Found {len(entities)} {dimension} with at least {min_count} dogs")
+
+    nyc_zipcodes, zipcode_field = load_map_geometry()
+    template = MapTemplate(nyc_zipcodes, zipcode_field)
+    infos = [{'total_count': int(total)} for total in totals]
+    return render_dimension_maps(dimension, entities, infos, counts, template, metrics=metrics, scheme=scheme)
+
+def benchmark(count=10):
+    """Time the folium renderer against the template renderer on the top `count` breeds"""
+    import io
+    import tempfile
+    import contextlib
+    from create_heatmaps import create_entity_map
+
+    nyc_zipcodes, zipcode_field = load_map_geometry()
+    breeds = sorted(load_entity_data('breeds').items(), key=lambda x: x[1].get('total_count', 0), reverse=True)[:count]
+
+    # Render into a scratch directory that sees the real inputs, so the built maps,
+    # their manifest and compressed copies are left alone
+    source_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for name in ('data', 'ZCTA.gpkg'):
+            os.symlink(os.path.join(source_dir, name), os.path.join(scratch_dir, name))
+        os.chdir(scratch_dir)
+        try:
+            start = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for breed, info in breeds:
+                    create_entity_map('breeds', breed, info, nyc_zipcodes)
+            folium_time = (time.time() - start) / len(breeds)
+
+            start = time.time()
+            template = MapTemplate(nyc_zipcodes, zipcode_field)
+            compile_time = time.time() - start
+
+            start = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                render_entity_maps_fast('breeds', breeds, template)
+            template_time = (time.time() - start) / len(breeds)
+        finally:
+            os.chdir(source_dir)
+
+    print(f"folium renderer:   {folium_time * 1000:.1f} ms per map")
+    print(f"template renderer: {template_time * 1000:.1f} ms per map (plus {compile_time:.2f}s to compile once)")
+    print(f"Speed-up: {folium_time / template_time:.0f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Template-compiled map renderer")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare per-map time of the folium and template renderers")
+    parser.add_argument("--maps", type=int, default=10,
+                        help="number of breed maps to render in the benchmark (default: 10)")
+    parser.add_argument("--dimension", choices=sorted(DIMENSION_COLUMNS),
+                        help="render maps for every value of this dimension, e.g. birth_years")
+    parser.add_argument("--min-count", type=int, default=500,
+                        help="minimum number of dogs for a value to get a map (default: 500)")
+    parser.add_argument("--metrics", nargs="+", choices=METRICS, default=["percentage"],
+                        help="metrics to map (default: percentage)")
+    parser.add_argument("--classification", choices=SCHEMES, default=DEFAULT_SCHEME,
+                        help=f"how map values are binned into colour classes (default: {DEFAULT_SCHEME})")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.maps)
+    elif args.dimension:
+        generate_dimension_maps(args.dimension, args.min_count, tuple(args.metrics), args.classification)
+    else:
+        parser.print_help()
@@ -4,16 +4,45 @@ Generate maps for dog breeds and names in NYC with at least 500 dogs.
 
 This script will:
 1. Ensure data exists by running preprocessing if necessary
-2. Generate maps for all dog breeds and names with at least 500 dogs
-3. Create a simple website to display the maps
+2. Compute spatial statistics (Moran's I, Gi* hot spots) for every breed and name
+3. Roll zip counts up to boroughs and the whole city for every breed and name,
+   and classify every breed and name into the shared map colour classes
+4. Generate maps for all dog breeds and names with at least 500 dogs, and the
+   searchable viewer data covering every breed and name, their licence-year
+   timelines, and overlay pages of the top 5 breeds and names in each borough
+5. Build the zipcode vector tile pyramid and the density overlays for heatmaps/
+6. Render PNG thumbnails of the maps and create a simple website to display them
+7. Vendor the CDN scripts and stylesheets the pages use into static/vendor/
+8. Write gzip and brotli copies of the pages and data files for the servers
+9. Report the output sizes and fail if any exceeds size_budgets.json
+
+With --viewer, step 4 only writes the shared geometry and sparse per-entity
+vectors for viewer.html instead of one page per entity, and index.html becomes
+the single-page viewer.
+
+With --boroughs, step 4 also maps each breed and name in the boroughs where it
+has at least 50 dogs, from only that borough's zips, into
+maps/<type>/boroughs/<Borough>/.
+
+With --preview, the same steps run in preview/ on a small fixed sample of the
+dog records and zip codes and map only a few breeds and names (see preview.py).
+
+With --local-basemap, the maps load their basemap tiles from the /basemap/
+tile cache of serve.py or app.py (see basemap_tiles.py) instead of CARTO.
+
+With --no-precompress, step 8 is skipped, for static hosts such as GitHub
+Pages that can't send the .gz/.br copies.
 """
 
 import os
 import json
 import shutil
+import argparse
 import subprocess
 from pathlib import Path
 import pandas as pd
+from basemap_tiles import LOCAL_BASEMAP_ENV, use_local_basemap
+from publish import atomic_open
 
 def ensure_data_exists():
     """Make sure the data directory exists with required JSON files"""
@@ -37,8 +66,21 @@ def ensure_data_exists():
     
     print("Data files verified.")
 
-def generate_maps_by_count(min_count=500):
-    """Generate maps for all breeds and names with at least min_count dogs"""
+def generate_maps_by_count(min_count=500, metrics=('percentage',), jobs=1, renderer='folium', force=False,
+                           scheme='equal_interval', limit=None, boroughs=False):
+    """
+    Generate maps for all breeds and names with at least min_count dogs (only
+    the `limit` most common of each, if given), one map per metric
+    ('percentage', 'count' or 'density'). renderer is 'folium' (one folium map
+    per page, using up to `jobs` worker processes) or 'template' (one compiled
+    template filled per page, see fast_renderer.py).
+    Both renderers colour the maps with the shared classes of the given
+    classification scheme (see classification.py). With boroughs, the template renderer also maps each
+    entity in every borough where it has enough dogs, from that borough's
+    zips only; each such entity's info lists them in 'borough_maps'.
+    Only maps whose inputs changed since the last build are rendered (see
+    map_manifest.py) unless force is set; maps no longer wanted are deleted.
+    """
     print(f"Generating maps for breeds and names with at least {min_count} dogs...")
     
     # Load the breed data
@@ -54,10 +96,14 @@ def generate_maps_by_count(min_count=500):
     os.makedirs("maps/names", exist_ok=True)
     
     # Import the necessary functions and modules for map creation
-    from create_heatmaps import get_nyc_zipcode_geojson, create_breed_map, create_name_map
+    from create_heatmaps import load_map_geometry, render_entity_maps
+    from zip_layer import build_zip_index
     
-    # Get the NYC zipcode GeoJSON
-    nyc_zipcodes = get_nyc_zipcode_geojson()
+    # Compute zip areas and boroughs once so maps never reproject or reclassify the geometry
+    build_zip_index()
+    
+    # Get the NYC zipcode GeoJSON, with boroughs from the zip hierarchy for the tooltips
+    nyc_zipcodes, zipcode_field = load_map_geometry()
     
     # Filter breeds by minimum count
     filtered_breeds = {breed: info for breed, info in breed_data.items() 
@@ -70,37 +116,114 @@ def generate_maps_by_count(min_count=500):
     # Sort breeds and names by total count
     sorted_breeds = sorted(filtered_breeds.items(), key=lambda x: x[1].get('total_count', 0), reverse=True)
     sorted_names = sorted(filtered_names.items(), key=lambda x: x[1].get('total_count', 0), reverse=True)
+    if limit is not None:
+        sorted_breeds, sorted_names = sorted_breeds[:limit], sorted_names[:limit]
     
     print(f"Found {len(sorted_breeds)} breeds and {len(sorted_names)} names with at least {min_count} dogs")
     
-    # Generate maps for breeds
-    print(f"Generating breed maps...")
-    for i, (breed, info) in enumerate(sorted_breeds):
-        print(f"Processing {i+1}/{len(sorted_breeds)}: {breed}")
-        create_breed_map(breed, info, nyc_zipcodes)
+    # Attach the precomputed clustering summary so the map titles can show it
+    from spatial_stats import load_spatial_stats
+    spatial_stats = load_spatial_stats()
+    if spatial_stats is not None:
+        for entity_type, entities in (('breeds', sorted_breeds), ('names', sorted_names)):
+            for entity, info in entities:
+                if entity in spatial_stats[entity_type]:
+                    info['morans_i'] = spatial_stats[entity_type][entity]['morans_i']
+                    info['clustered'] = spatial_stats[entity_type][entity]['clustered']
+    
+    # The build version covers the geometry and the renderer, so changing either rebuilds every map
+    import folium
+    from create_heatmaps import get_map_path
+    from map_manifest import (hash_text, hash_files, get_geometry_version, hash_map_inputs,
+                              load_manifest, save_manifest, plan_map_build, remove_maps)
+    from classification import load_class_table
+    if renderer == 'template':
+        from fast_renderer import MapTemplate, render_entity_maps_fast
+        template = MapTemplate(nyc_zipcodes, zipcode_field)
+        renderer_version = hash_text(template.version, scheme, hash_files('fast_renderer.py', 'create_heatmaps.py',
+                                                                          'entity_counts.py', 'classification.py'))
+    else:
+        renderer_version = hash_text(folium.__version__, scheme, hash_files('create_heatmaps.py', 'classification.py'),
+                                     str(use_local_basemap()))
+    if scheme == 'fixed':
+        # Fixed bounds are pooled over every entity, so any entity's counts can recolour every map
+        renderer_version = hash_text(renderer_version, *(
+            load_class_table(entity_type).arrays[f'{metric}_fixed_bounds'][:, 0].tobytes().hex()
+            for entity_type in ('breeds', 'names') for metric in metrics))
+    build_version = hash_text(get_geometry_version(), renderer, renderer_version)
+    
+    wanted = {}
+    for entity_type, entities in (('breeds', sorted_breeds), ('names', sorted_names)):
+        for entity, info in entities:
+            for metric in metrics:
+                wanted[get_map_path(entity_type, entity, metric)] = hash_map_inputs(entity_type, entity, info, metric, build_version)
+    
+    # Borough maps of the entities with enough dogs there; each borough gets its own template
+    borough_entities = {}
+    if boroughs and renderer != 'template':
+        print("Borough maps need the template renderer; skipping them")
+    elif boroughs:
+        from fast_renderer import get_borough_entities, build_borough_templates
+        borough_templates = build_borough_templates(nyc_zipcodes, zipcode_field)
+        for entity_type, entities in (('breeds', sorted_breeds), ('names', sorted_names)):
+            borough_entities[entity_type] = get_borough_entities(entities)
+            for borough, in_borough in borough_entities[entity_type].items():
+                borough_version = hash_text(build_version, borough, borough_templates[borough].version)
+                for entity, info in in_borough:
+                    info.setdefault('borough_maps', []).append(borough)
+                    for metric in metrics:
+                        wanted[get_map_path(entity_type, entity, metric, borough)] = hash_map_inputs(
+                            entity_type, entity, info, metric, borough_version)
+    stale, removed = plan_map_build(wanted, load_manifest(), force=force)
+    print(f"{len(stale)} of {len(wanted)} maps changed since the last build, {len(removed)} to remove")
+    remove_maps(removed)
+    
+    failures = []
+    if renderer == 'template':
+        print("Generating breed and name maps from the compiled map template...")
+        failures += [('breeds',) + failure for failure in
+                     render_entity_maps_fast('breeds', sorted_breeds, template, metrics=metrics, only=stale, scheme=scheme)]
+        failures += [('names',) + failure for failure in
+                     render_entity_maps_fast('names', sorted_names, template, metrics=metrics, only=stale, scheme=scheme)]
+        for entity_type, by_borough in borough_entities.items():
+            for borough, in_borough in by_borough.items():
+                failures += [(entity_type,) + failure + (borough,) for failure in
+                             render_entity_maps_fast(entity_type, in_borough, borough_templates[borough], metrics=metrics,
+                                                     only=stale, scheme=scheme, borough=borough)]
+    else:
+        # Generate maps for breeds
+        print(f"Generating breed maps with {jobs} job(s)...")
+        failures += [('breeds',) + failure for failure in
+                     render_entity_maps('breeds', sorted_breeds, nyc_zipcodes, metrics=metrics, jobs=jobs, only=stale,
+                                        scheme=scheme)]
+        
+        # Generate maps for names
+        print(f"Generating name maps with {jobs} job(s)...")
+        failures += [('names',) + failure for failure in
+                     render_entity_maps('names', sorted_names, nyc_zipcodes, metrics=metrics, jobs=jobs, only=stale,
+                                        scheme=scheme)]
     
-    # Generate maps for names
-    print(f"Generating name maps...")
-    for i, (name, info) in enumerate(sorted_names):
-        print(f"Processing {i+1}/{len(sorted_names)}: {name}")
-        create_name_map(name, info, nyc_zipcodes)
+    # Leave failed maps out of the manifest so the next build retries them
+    for failure in failures:
+        wanted.pop(get_map_path(*failure), None)
+    save_manifest(wanted)
     
-    print(f"Generated {len(sorted_breeds)} breed maps and {len(sorted_names)} name maps")
+    print(f"Rendered {len(stale) - len(failures)} maps for {len(sorted_breeds)} breeds and {len(sorted_names)} names")
     
     # Save the filtered breeds and names data for the website
     filtered_breeds_dict = {breed: info for breed, info in sorted_breeds}
     filtered_names_dict = {name: info for name, info in sorted_names}
     
-    with open("maps/filtered_breeds.json", "w") as f:
+    with atomic_open("maps/filtered_breeds.json") as f:
         json.dump(filtered_breeds_dict, f)
     
-    with open("maps/filtered_names.json", "w") as f:
+    with atomic_open("maps/filtered_names.json") as f:
         json.dump(filtered_names_dict, f)
     
     return filtered_breeds_dict, filtered_names_dict
 
-def create_website(filtered_breeds, filtered_names):
-    """Generate HTML file to display the maps"""
+def create_website(filtered_breeds, filtered_names, thumbnails=None):
+    """Generate HTML file to display the maps, with a strip of map thumbnails if they were built"""
     print("Creating website...")
     
     # Create HTML content
@@ -146,6 +269,29 @@ def create_website(filtered_breeds, filtered_names):
         .selector-row {
             margin-bottom: 15px;
         }
+        .thumbnail-strip {
+            display: flex;
+            overflow-x: auto;
+            gap: 8px;
+            margin-bottom: 15px;
+        }
+        .thumbnail-strip figure {
+            flex: 0 0 auto;
+            width: 96px;
+            margin: 0;
+            cursor: pointer;
+            text-align: center;
+            font-size: 11px;
+        }
+        .thumbnail-strip figure.active img {
+            outline: 2px solid #0d6efd;
+        }
+        .thumbnail-strip img {
+            width: 96px;
+            height: 96px;
+            background-color: #fff;
+            border-radius: 5px;
+        }
     </style>
 </head>
 <body>
@@ -183,8 +329,28 @@ def create_website(filtered_breeds, filtered_names):
                                 <select class="form-select" id="breedSelector">
                                     <!-- Breed options will be inserted here by JavaScript -->
                                 </select>
+                                <div class="form-text">Only breeds with at least 500 dogs are listed. <a href="viewer.html">Search all breeds</a>, <a href="timeline.html">play them by licence year</a> or <a href="maps/overlays/breeds_top5_NYC.html">compare the top 5</a></div>
+                            </div>
+                            <div class="col-md-3">
+                                <label for="breedMetric" class="form-label">Show:</label>
+                                <select class="form-select" id="breedMetric">
+                                    <option value="_map">Share of dogs (%)</option>
+                                    <option value="_density_map">Dogs per km&sup2;</option>
+                                </select>
+                            </div>
+                            <div class="col-md-3" id="breedAreaColumn" hidden>
+                                <label for="breedArea" class="form-label">Area:</label>
+                                <select class="form-select" id="breedArea">
+                                    <option value="">All of NYC</option>
+                                    <option value="Manhattan">Manhattan</option>
+                                    <option value="Bronx">Bronx</option>
+                                    <option value="Brooklyn">Brooklyn</option>
+                                    <option value="Queens">Queens</option>
+                                    <option value="Staten Island">Staten Island</option>
+                                </select>
                             </div>
                         </div>
+                        <div class="thumbnail-strip" id="breedThumbnails"></div>
                         <div class="map-container">
                             <iframe id="breedMap" src="maps/breeds/FIRST_BREED_MAP.html"></iframe>
                         </div>
@@ -196,8 +362,28 @@ def create_website(filtered_breeds, filtered_names):
                                 <select class="form-select" id="nameSelector">
                                     <!-- Name options will be inserted here by JavaScript -->
                                 </select>
+                                <div class="form-text">Only names with at least 500 dogs are listed. <a href="viewer.html">Search all names</a>, <a href="timeline.html">play them by licence year</a> or <a href="maps/overlays/names_top5_NYC.html">compare the top 5</a></div>
+                            </div>
+                            <div class="col-md-3">
+                                <label for="nameMetric" class="form-label">Show:</label>
+                                <select class="form-select" id="nameMetric">
+                                    <option value="_map">Share of dogs (%)</option>
+                                    <option value="_density_map">Dogs per km&sup2;</option>
+                                </select>
+                            </div>
+                            <div class="col-md-3" id="nameAreaColumn" hidden>
+                                <label for="nameArea" class="form-label">Area:</label>
+                                <select class="form-select" id="nameArea">
+                                    <option value="">All of NYC</option>
+                                    <option value="Manhattan">Manhattan</option>
+                                    <option value="Bronx">Bronx</option>
+                                    <option value="Brooklyn">Brooklyn</option>
+                                    <option value="Queens">Queens</option>
+                                    <option value="Staten Island">Staten Island</option>
+                                </select>
                             </div>
                         </div>
+                        <div class="thumbnail-strip" id="nameThumbnails"></div>
                         <div class="map-container">
                             <iframe id="nameMap" src="maps/names/FIRST_NAME_MAP.html"></iframe>
                         </div>
@@ -230,6 +416,52 @@ def create_website(filtered_breeds, filtered_names):
     <script>
         // Load breed and name data and populate selectors
         document.addEventListener('DOMContentLoaded', function() {
+            // Thumbnail images by type and entity; picking one selects its map
+            const thumbnails = THUMBNAIL_DATA_PLACEHOLDER;
+            function addThumbnails(entityType, selector, showMap) {
+                const strip = document.getElementById(selector.id.replace('Selector', 'Thumbnails'));
+                const images = thumbnails[entityType] || {};
+                for (const entity in images) {
+                    const figure = document.createElement('figure');
+                    const image = document.createElement('img');
+                    image.src = images[entity];
+                    image.alt = entity;
+                    image.loading = 'lazy';
+                    const caption = document.createElement('figcaption');
+                    caption.textContent = entity;
+                    figure.append(image, caption);
+                    figure.dataset.entity = entity;
+                    figure.addEventListener('click', function() {
+                        selector.value = entity;
+                        showMap();
+                    });
+                    strip.appendChild(figure);
+                }
+                function markActive() {
+                    for (const figure of strip.children) {
+                        figure.classList.toggle('active', figure.dataset.entity === selector.value);
+                    }
+                }
+                selector.addEventListener('change', markActive);
+                strip.addEventListener('click', markActive);
+                markActive();
+            }
+            
+            // Borough maps exist only where an entity has enough dogs; the area selector shows when any were built
+            function setupAreas(areaSelector, data, selector) {
+                document.getElementById(areaSelector.id + 'Column').hidden = !Object.values(data).some(info => info.borough_maps);
+                return function updateAreas() {
+                    const boroughs = data[selector.value].borough_maps || [];
+                    for (const option of areaSelector.options) {
+                        option.disabled = option.value !== '' && !boroughs.includes(option.value);
+                    }
+                    if (areaSelector.selectedOptions[0].disabled) areaSelector.value = '';
+                };
+            }
+            function mapDirectory(entityType, areaSelector) {
+                return areaSelector.value ? `maps/${entityType}/boroughs/${areaSelector.value.replace(' ', '_')}/` : `maps/${entityType}/`;
+            }
+            
             // Breed data
             const breedData = BREED_DATA_PLACEHOLDER;
             const breedSelector = document.getElementById('breedSelector');
@@ -246,12 +478,20 @@ def create_website(filtered_breeds, filtered_names):
             // Set first breed map
             document.getElementById('breedMap').src = `maps/breeds/${firstBreed.replace('/', '_').replace(' ', '_')}_map.html`;
             
-            // Add event listener for breed selection
-            breedSelector.addEventListener('change', function() {
-                const selectedBreed = this.value;
-                const safeBreed = selectedBreed.replace('/', '_').replace(' ', '_');
-                document.getElementById('breedMap').src = `maps/breeds/${safeBreed}_map.html`;
-            });
+            // Add event listeners for breed and metric selection
+            const breedMetric = document.getElementById('breedMetric');
+            const breedArea = document.getElementById('breedArea');
+            const updateBreedAreas = setupAreas(breedArea, breedData, breedSelector);
+            function showBreedMap() {
+                updateBreedAreas();
+                const safeBreed = breedSelector.value.replace('/', '_').replace(' ', '_');
+                document.getElementById('breedMap').src = `${mapDirectory('breeds', breedArea)}${safeBreed}${breedMetric.value}.html`;
+            }
+            breedSelector.addEventListener('change', showBreedMap);
+            breedMetric.addEventListener('change', showBreedMap);
+            breedArea.addEventListener('change', showBreedMap);
+            updateBreedAreas();
+            addThumbnails('breeds', breedSelector, showBreedMap);
             
             // Name data
             const nameData = NAME_DATA_PLACEHOLDER;
@@ -269,12 +509,20 @@ def create_website(filtered_breeds, filtered_names):
             // Set first name map
             document.getElementById('nameMap').src = `maps/names/${firstName.replace('/', '_').replace(' ', '_')}_map.html`;
             
-            // Add event listener for name selection
-            nameSelector.addEventListener('change', function() {
-                const selectedName = this.value;
-                const safeName = selectedName.replace('/', '_').replace(' ', '_');
-                document.getElementById('nameMap').src = `maps/names/${safeName}_map.html`;
-            });
+            // Add event listeners for name and metric selection
+            const nameMetric = document.getElementById('nameMetric');
+            const nameArea = document.getElementById('nameArea');
+            const updateNameAreas = setupAreas(nameArea, nameData, nameSelector);
+            function showNameMap() {
+                updateNameAreas();
+                const safeName = nameSelector.value.replace('/', '_').replace(' ', '_');
+                document.getElementById('nameMap').src = `${mapDirectory('names', nameArea)}${safeName}${nameMetric.value}.html`;
+            }
+            nameSelector.addEventListener('change', showNameMap);
+            nameMetric.addEventListener('change', showNameMap);
+            nameArea.addEventListener('change', showNameMap);
+            updateNameAreas();
+            addThumbnails('names', nameSelector, showNameMap);
         });
     </script>
 </body>
@@ -284,6 +532,7 @@ def create_website(filtered_breeds, filtered_names):
     # Replace placeholders with actual data
     html_content = html_content.replace('BREED_DATA_PLACEHOLDER', json.dumps(filtered_breeds))
     html_content = html_content.replace('NAME_DATA_PLACEHOLDER', json.dumps(filtered_names))
+    html_content = html_content.replace('THUMBNAIL_DATA_PLACEHOLDER', json.dumps(thumbnails or {}))
     
     # Get the first breed and name to set default maps
     first_breed = list(filtered_breeds.keys())[0].replace('/', '_').replace(' ', '_')
@@ -293,23 +542,122 @@ def create_website(filtered_breeds, filtered_names):
     html_content = html_content.replace('FIRST_NAME_MAP.html', f"{first_name}_map.html")
     
     # Write the HTML file
-    with open("index.html", "w") as f:
+    with atomic_open("index.html") as f:
         f.write(html_content)
     
     print("Created website in index.html")
 
-def main():
-    """Main function to run all steps"""
+def main(viewer=False, jobs=1, renderer='template', force=False, scheme='equal_interval', local_basemap=False,
+         preview=None, boroughs=False, precompress=True):
+    """
+    Main function to run all steps. preview is the number of breeds and names
+    to map in a preview build (see preview.py), or None for a full build.
+    boroughs adds borough-scoped maps (see generate_maps_by_count).
+    precompress=False skips the .gz/.br copies.
+    """
+    # A preview's sample has too few dogs for the 500-dog threshold, so it maps its most common ones
+    min_count = 1 if preview is not None else 500
+    if local_basemap:
+        # Read by every map generator, including forked workers
+        os.environ[LOCAL_BASEMAP_ENV] = '1'
+    
     # Step 1: Ensure data exists
     ensure_data_exists()
     
-    # Step 2: Generate maps for breeds and names with at least 500 dogs
-    filtered_breeds, filtered_names = generate_maps_by_count(min_count=500)
+    # Step 2: Compute spatial statistics once for all breeds and names
+    from spatial_stats import build_spatial_stats
+    build_spatial_stats()
+    
+    # Step 3: Precompute borough and citywide roll-ups and the shared map colour classes
+    from rollups import build_rollups
+    build_rollups()
+    from classification import build_class_tables
+    build_class_tables()
+    
+    # Step 4: Generate maps for breeds and names with at least 500 dogs; the viewer covers all of them
+    from viewer import build_viewer_data
+    build_viewer_data(scheme=scheme)
+    from timeline import build_timeline_data
+    build_timeline_data(min_count=min_count, scheme=scheme)
+    if not viewer:
+        filtered_breeds, filtered_names = generate_maps_by_count(min_count=min_count, metrics=('percentage', 'density'), jobs=jobs,
+                                                                  renderer=renderer, force=force, scheme=scheme, limit=preview,
+                                                                  boroughs=boroughs)
+        from overlay_maps import build_overlay_maps
+        build_overlay_maps(scheme=scheme)
+    
+    # Step 5: Build the zipcode vector tiles and the heatmaps/ density overlays
+    from build_vector_tiles import build_vector_tiles
+    build_vector_tiles()
+    from density_overlays import build_density_overlays
+    build_density_overlays(min_count=min_count, limit=preview)
+    
+    # Step 6: Create website
+    if viewer:
+        with open("viewer.html", "rb") as source, atomic_open("index.html", "wb") as f:
+            shutil.copyfileobj(source, f)
+        print("Created single-page viewer in index.html")
+    else:
+        from thumbnails import build_thumbnails
+        thumbnails = build_thumbnails({'breeds': list(filtered_breeds.items()),
+                                       'names': list(filtered_names.items())}, jobs=jobs, scheme=scheme)
+        create_website(filtered_breeds, filtered_names, thumbnails)
+    
+    # Step 7: Serve Leaflet, Bootstrap and the folium plugins from local, content-hashed copies;
+    # previews keep the CDN links rather than download them
+    if preview is None:
+        from vendor_assets import vendor_pages
+        vendor_pages()
+    
+    # Step 8: Precompress the pages and data files; the servers send previews uncompressed
+    if preview is None and precompress:
+        from precompress import precompress_outputs
+        precompress_outputs(jobs=jobs)
     
-    # Step 3: Create website
-    create_website(filtered_breeds, filtered_names)
+    # Step 9: Fail the build when a page or output directory grows past its size budget;
+    # a preview's sample is too small for the budgets to mean anything
+    if preview is None:
+        from size_report import run_size_check
+        _, violations = run_size_check()
+        if violations:
+            raise SystemExit(f"{len(violations)} output(s) over their size budgets (see size_budgets.json)")
     
     print("Done! The maps and website are ready.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate NYC dog breed and name maps")
+    parser.add_argument("--viewer", action="store_true",
+                        help="build data for the single-page viewer instead of one HTML page per map")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes used by the folium renderer, thumbnails and precompression (default: 1)")
+    parser.add_argument("--renderer", choices=["template", "folium"], default="template",
+                        help="fill one compiled map template per page, or build each map with folium (default: template)")
+    parser.add_argument("--force", action="store_true",
+                        help="render every map, even those whose inputs haven't changed since the last build")
+    parser.add_argument("--classification", choices=["equal_interval", "quantile", "jenks", "fixed"], default="equal_interval",
+                        help="how map values are binned into colour classes (default: equal_interval)")
+    parser.add_argument("--local-basemap", action="store_true",
+                        help="load basemap tiles from the /basemap/ tile cache of serve.py or app.py instead of CARTO's CDN")
+    parser.add_argument("--boroughs", action="store_true",
+                        help="also map each breed and name in every borough where it has at least 50 dogs")
+    parser.add_argument("--no-precompress", action="store_true",
+                        help="skip the .gz/.br copies, for static hosts that can't serve them (e.g. GitHub Pages)")
+    parser.add_argument("--preview", action="store_true",
+                        help="quick build in preview/ from a fixed sample of one borough's dogs (see preview.py)")
+    parser.add_argument("--preview-borough", default="Manhattan",
+                        help="borough whose zip codes and dogs a preview samples (default: Manhattan)")
+    parser.add_argument("--preview-fraction", type=float, default=0.2,
+                        help="share of the borough's dog records a preview keeps (default: 0.2)")
+    parser.add_argument("--preview-entities", type=int, default=3,
+                        help="number of breeds and of names a preview maps (default: 3)")
+    args = parser.parse_args()
+    if args.preview_entities < 1:
+        parser.error("--preview-entities must be at least 1")
+    if not 0 < args.preview_fraction <= 1:
+        parser.error("--preview-fraction must be above 0 and at most 1")
+    if args.preview:
+        from preview import prepare_preview
+        prepare_preview(borough=args.preview_borough, fraction=args.preview_fraction)
+    main(viewer=args.viewer, jobs=args.jobs, renderer=args.renderer, force=args.force, scheme=args.classification,
+         local_basemap=args.local_basemap, preview=args.preview_entities if args.preview else None,
+         boroughs=args.boroughs, precompress=not args.no_precompress)
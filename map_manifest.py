@@ -0,0 +1,82 @@
+"""
+Content-hash manifest for incremental map builds.
+
+maps/manifest.json stores, for every generated map page, a hash of everything
+the page is built from: the entity's counts and title statistics, the metric,
+the zip index (geometry version) and the renderer's own version. A build only
+re-renders maps whose hash changed and deletes maps it no longer produces, so a
+refresh that touches a few entities rebuilds a few pages.
+"""
+
+import os
+import json
+import hashlib
+
+from zip_layer import load_zip_index
+from publish import atomic_open
+
+MANIFEST_FILE = 'maps/manifest.json'
+
+# Source files are hashed from here, so builds that run in another directory (--preview) find them
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Entity fields that end up on a map page
+MAP_INFO_FIELDS = ['total_count', 'zipcode_counts', 'morans_i', 'clustered']
+
+def hash_text(*parts):
+    """Return the sha256 hex digest of the given strings"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def hash_files(*paths):
+    """Return one hash over the contents of several source files"""
+    contents = []
+    for path in paths:
+        with open(os.path.join(SOURCE_DIR, path), 'r') as f:
+            contents.append(f.read())
+    return hash_text(*contents)
+
+def get_geometry_version():
+    """Hash of the canonical zip index (zipcodes, areas and boroughs)"""
+    return hash_text(json.dumps(load_zip_index(), sort_keys=True))
+
+def hash_map_inputs(entity_type, entity, info, metric, build_version):
+    """Hash of one map's inputs; build_version covers geometry and renderer"""
+    map_info = {field: info.get(field) for field in MAP_INFO_FIELDS}
+    return hash_text(build_version, entity_type, entity, metric, json.dumps(map_info, sort_keys=True))
+
+def load_manifest(path=MANIFEST_FILE):
+    """Return {map path: input hash} from the last build, or {} if there isn't one"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)['maps']
+    except (FileNotFoundError, KeyError, ValueError):
+        return {}
+
+def save_manifest(maps, path=MANIFEST_FILE):
+    """Write the manifest of the maps produced by this build"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_open(path) as f:
+        json.dump({'maps': maps}, f, indent=1, sort_keys=True)
+
+def plan_map_build(wanted, manifest, force=False):
+    """
+    Compare the maps this build wants ({path: hash}) with the last manifest.
+    Returns (stale, removed): paths that need rendering because their hash
+    changed or the file is missing, and paths from the last build that are no
+    longer wanted.
+    """
+    stale = {path for path, digest in wanted.items()
+             if force or manifest.get(path) != digest or not os.path.exists(path)}
+    removed = sorted(set(manifest) - set(wanted))
+    return stale, removed
+
+def remove_maps(paths):
+    """Delete map pages that are no longer generated"""
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"Removed {path}")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Multi-entity overlay maps, e.g. the top 5 names in Brooklyn on one page.
+
+The page carries the zip geometry once and, per entity, a small style vector:
+its count and precomputed colour class (see classification.py) for every zip
+in zip index order. The layer control lists one entry per entity; picking an
+entry restyles the single zip layer instead of loading or drawing another
+GeoJSON layer.
+
+Output:
+    maps/overlays/<type>_top<n>_<area>.html - one page per borough and citywide
+"""
+
+import os
+import html
+import json
+import folium
+from branca.element import MacroElement, Template
+
+from zip_layer import BOROUGHS, ZIPCODE_FIELD, load_zip_layer, load_zip_index
+from classification import CLASS_COLORS, DEFAULT_SCHEME, load_class_table
+from create_heatmaps import MAP_LABELS, assign_fixed_ids
+from viewer import SIMPLIFY_TOLERANCE, COORDINATE_DECIMALS, encode_classes
+from basemap_tiles import map_tiles
+from publish import atomic_open
+
+OVERLAY_MAP_DIR = 'maps/overlays'
+
+# Largest number of entities on one page
+MAX_OVERLAY_ENTITIES = 10
+
+class MultiEntityLayer(MacroElement):
+    """One zip layer restyled from the active entity's style vector, switched by the layer control"""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var overlayData = {{ this.data }};
+            var overlayMap = {{ this._parent.get_name() }};
+            var active = overlayData.entities[0];
+
+            var zipLayer = L.geoJson({{ this.geometry }}, {
+                style: function(feature) {
+                    var cls = active.classes[feature.properties.index];
+                    return {fillColor: cls === '-' ? 'transparent' : overlayData.colors[cls],
+                            fillOpacity: cls === '-' ? 0 : 0.7, color: 'black', weight: 1, opacity: 0.2};
+                }
+            }).bindTooltip(function(layer) {
+                var props = layer.feature.properties;
+                var count = active.counts[props.index];
+                return '<b>' + props.zipcode + '</b> (' + (props.borough || 'N/A') + ')<br>' +
+                    active.label + ': ' + count.toLocaleString() + ' dogs, ' +
+                    (count / active.zip_total * 100).toFixed(2) + '% of them';
+            }, {sticky: false}).addTo(overlayMap);
+
+            var legend = L.control({position: 'bottomright'});
+            legend.onAdd = function() { return L.DomUtil.create('div', 'overlay-legend'); };
+            legend.addTo(overlayMap);
+            function showLegend() {
+                legend.getContainer().innerHTML = '<strong>' + active.caption + '</strong><br>' +
+                    overlayData.colors.map(function(color, i) {
+                        return '<i style="background:' + color + '"></i>' +
+                            active.bounds[i].toLocaleString() + ' &ndash; ' + active.bounds[i + 1].toLocaleString();
+                    }).join('<br>');
+            }
+            showLegend();
+
+            // The control's entries are empty groups; choosing one restyles the shared zip layer
+            var entries = {};
+            overlayData.entities.forEach(function(entity, i) {
+                var entry = L.layerGroup();
+                entry.entity = entity;
+                entries[entity.label + ' (' + entity.total_count.toLocaleString() + ')'] = entry;
+                if (i === 0) entry.addTo(overlayMap);
+            });
+            L.control.layers(entries, null, {collapsed: false}).addTo(overlayMap);
+            overlayMap.on('baselayerchange', function(e) {
+                active = e.layer.entity;
+                zipLayer.setStyle(zipLayer.options.style);
+                showLegend();
+            });
+        {% endmacro %}
+        {% macro header(this, kwargs) %}
+            <style>
+                .overlay-legend { background-color: white; padding: 6px 8px; border-radius: 5px; line-height: 18px; }
+                .overlay-legend i { width: 18px; height: 18px; float: left; margin-right: 8px; opacity: 0.7; }
+            </style>
+        {% endmacro %}
+    """)
+
+    def __init__(self, geometry, data):
+        super().__init__()
+        self._name = 'MultiEntityLayer'
+        self.geometry = geometry
+        self.data = data
+
+def get_overlay_geometry():
+    """Simplified zip geometry in zip index order, with each feature's index, zipcode and borough"""
+    zip_layer = load_zip_layer()
+    geometry = zip_layer[[ZIPCODE_FIELD, 'geometry']].rename(columns={ZIPCODE_FIELD: 'zipcode'})
+    geometry['geometry'] = geometry.geometry.simplify(SIMPLIFY_TOLERANCE, preserve_topology=True)
+    geometry['borough'] = load_zip_index()['borough']
+    geometry['index'] = range(len(geometry))
+
+    geojson = json.loads(geometry.to_json(), parse_float=lambda x: round(float(x), COORDINATE_DECIMALS))
+    for feature in geojson['features']:
+        feature.pop('id', None)
+    return json.dumps(geojson, separators=(',', ':'))
+
+def build_style_vectors(entity_type, entities, scheme=DEFAULT_SCHEME):
+    """Per-entity counts, colour classes and legend bounds of the percentage metric, in zip index order"""
+    from entity_counts import load_entity_data, build_count_matrix
+
+    entity_data = load_entity_data(entity_type)
+    names, counts = build_count_matrix({entity: entity_data[entity] for entity in entities},
+                                       load_zip_index()['zipcodes'])
+    bounds, classes = load_class_table(entity_type).select('percentage', scheme, names)
+    subject = MAP_LABELS[entity_type][1]
+    # The tooltip, legend and layer control insert these as HTML, and names are free text
+    return [{
+        'name': name,
+        'label': html.escape(name),
+        'caption': f'Percentage of {subject.format(html.escape(name))} (%)',
+        'total_count': entity_data[name]['total_count'],
+        # Dogs in the mapped zips, which the classes' percentages are shares of
+        'zip_total': int(counts[:, column].sum()),
+        'counts': counts[:, column].astype(int).tolist(),
+        'classes': encode_classes(classes[:, column]),
+        'bounds': [round(float(bound), 2) for bound in bounds[:, column]]
+    } for column, name in enumerate(names)]
+
+def create_overlay_map(entity_type, entities, path, heading, scheme=DEFAULT_SCHEME, geometry=None):
+    """Write a page overlaying the given breeds or names, switchable in its layer control"""
+    if not entities or len(entities) > MAX_OVERLAY_ENTITIES:
+        raise ValueError(f"Expected 1 to {MAX_OVERLAY_ENTITIES} entities, got {len(entities)}")
+    data = {'colors': CLASS_COLORS, 'entities': build_style_vectors(entity_type, entities, scheme)}
+
+    nyc_map = folium.Map(location=[40.7128, -74.0060], zoom_start=10, **map_tiles())
+    nyc_map.add_child(MultiEntityLayer(geometry or get_overlay_geometry(),
+                                       json.dumps(data, separators=(',', ':')).replace('</', '<\\/')))
+    title_html = f'<h3 align="center" style="font-size:16px"><b>{html.escape(heading)}</b></h3>'
+    nyc_map.get_root().html.add_child(folium.Element(title_html))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    assign_fixed_ids(nyc_map.get_root())
+    with atomic_open(path, 'wb') as f:
+        nyc_map.save(f, close_file=False)
+
+def top_entities(entity_type, borough=None, top=5):
+    """The most common breeds or names in a borough (or citywide), from the precomputed roll-ups"""
+    from rollups import load_rollups, build_rollups
+
+    rollups = load_rollups() or build_rollups()
+    if borough is None:
+        key = lambda item: item[1]['city']['count']
+    else:
+        key = lambda item: item[1]['boroughs'][borough]['count']
+    return [entity for entity, _ in sorted(rollups[entity_type].items(), key=key, reverse=True)[:top]]
+
+def build_overlay_maps(top=5, scheme=DEFAULT_SCHEME):
+    """Write a top-`top` breeds page and names page for every borough and for the whole city"""
+    print(f"Building overlay maps of the top {top} breeds and names per borough...")
+    geometry = get_overlay_geometry()
+    count = 0
+    for entity_type in ('breeds', 'names'):
+        plural = 'Breeds' if entity_type == 'breeds' else 'Dog Names'
+        for borough in [None] + BOROUGHS:
+            area = borough or 'NYC'
+            path = f"{OVERLAY_MAP_DIR}/{entity_type}_top{top}_{area.replace(' ', '_')}.html"
+            create_overlay_map(entity_type, top_entities(entity_type, borough, top), path,
+                               f'Top {top} {plural} in {area}', scheme, geometry)
+            count += 1
+    print(f"Wrote {count} overlay maps to {OVERLAY_MAP_DIR}/")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Overlay several breeds or names on one map")
+    parser.add_argument("entities", nargs="*",
+                        help="breeds or names to overlay; without them, --borough and --output, "
+                             "writes the top breeds and names pages for every borough")
+    parser.add_argument("--type", choices=["breeds", "names"], default="names")
+    parser.add_argument("--borough", choices=BOROUGHS,
+                        help="pick the most common breeds or names in this borough (default: citywide)")
+    parser.add_argument("--top", type=int, default=5,
+                        help=f"number of breeds or names to pick (default: 5, at most {MAX_OVERLAY_ENTITIES})")
+    parser.add_argument("--output", help="page to write (default: under maps/overlays/)")
+    args = parser.parse_args()
+
+    if not args.entities and args.borough is None and args.output is None:
+        build_overlay_maps(args.top)
+    else:
+        entities = args.entities or top_entities(args.type, args.borough, args.top)
+        output = args.output or f"{OVERLAY_MAP_DIR}/{args.type}_custom.html"
+        create_overlay_map(args.type, entities, output, f"{', '.join(entities)} in {args.borough or 'NYC'}")
+        print(f"Saved overlay map to {output}")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Precompressed build artifacts.
+
+Writes a maximum-level gzip (.gz) and, when the brotli package is installed,
+brotli (.br) sibling next to every compressible file the build produces, so
+serve.py and app.py can send the compressed bytes as-is instead of compressing
+per request. The gzip header carries no timestamp or filename, so unchanged
+inputs give byte-identical files on every build.
+
+A sibling older than its source is only rewritten when the source's content
+changed: builds rewrite many files with identical bytes, so the old sibling is
+decompressed and compared, and just touched if it still matches. Files are
+compressed in a pool of worker processes (`--jobs`).
+"""
+
+import os
+import gzip
+import mimetypes
+import multiprocessing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Outputs of generate_netlify_maps.py that are sent precompressed
+BUILD_OUTPUTS = ['index.html', 'maps', 'data', 'heatmaps', 'static', 'tiles']
+COMPRESSIBLE_EXTENSIONS = ('.html', '.json', '.geojson', '.js', '.css', '.svg')
+
+# Preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+def read_compressed(path, encoding):
+    """Return (compressed bytes, original bytes) of a compressed sibling, or None if it can't be read"""
+    try:
+        with open(path, 'rb') as f:
+            compressed = f.read()
+        return compressed, brotli.decompress(compressed) if encoding == 'br' else gzip.decompress(compressed)
+    except (OSError, EOFError, brotli.error if brotli else OSError):
+        return None
+
+def compress_file(path):
+    """
+    Bring path.gz and path.br up to date with path; returns the number written.
+    Siblings newer than path are kept without reading anything, and older ones
+    whose content still matches are touched instead of recompressed. A
+    matching sibling hard-linked from the published snapshot (see publish.py)
+    is copied rather than touched, so the published one is left alone.
+    """
+    from publish import atomic_open
+
+    data = None
+    written = 0
+    for encoding, extension in ENCODINGS:
+        target = path + extension
+        if encoding == 'br' and brotli is None:
+            continue
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        existing = read_compressed(target, encoding) if os.path.exists(target) else None
+        if existing is not None and existing[1] == data:
+            if os.stat(target).st_nlink == 1:
+                os.utime(target)
+                continue
+            compressed = existing[0]
+        elif encoding == 'br':
+            compressed = brotli.compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        with atomic_open(target, 'wb') as f:
+            f.write(compressed)
+        written += 1
+    return written
+
+def iter_build_files(paths):
+    """Yield every file under paths (files or directories)"""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+
+def precompress_outputs(paths=BUILD_OUTPUTS, jobs=1):
+    """Compress every compressible file under paths in `jobs` processes and drop siblings whose source is gone"""
+    if brotli is None:
+        print("brotli is not installed; writing gzip files only")
+
+    sources = []
+    removed = 0
+    for path in iter_build_files(paths):
+        for _, extension in ENCODINGS:
+            if path.endswith(extension):
+                if not os.path.exists(path[:-len(extension)]):
+                    os.remove(path)
+                    removed += 1
+                break
+        else:
+            if path.endswith(COMPRESSIBLE_EXTENSIONS):
+                sources.append(path)
+
+    # Brotli at quality 11 takes seconds per map page, so spread the files over the workers
+    if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            compressed = sum(pool.map(compress_file, sources, chunksize=max(1, len(sources) // (jobs * 4))))
+    else:
+        compressed = sum(compress_file(path) for path in sources)
+
+    print(f"Wrote {compressed} precompressed files, removed {removed} stale ones")
+
+def find_precompressed(path, accept_encoding):
+    """
+    Return (file to send, content encoding) for path: the best precompressed
+    sibling the client accepts, or (path, None) if there is none. A sibling
+    older than path (the file was rewritten without recompressing) is ignored.
+    """
+    accepted = {token.split(';')[0].strip().lower() for token in (accept_encoding or '').split(',')}
+    try:
+        source_mtime = os.path.getmtime(path)
+    except OSError:
+        return path, None
+    for encoding, extension in ENCODINGS:
+        if encoding in accepted:
+            try:
+                if os.path.getmtime(path + extension) >= source_mtime:
+                    return path + extension, encoding
+            except OSError:
+                continue
+    return path, None
+
+def guess_type(path):
+    """Content type of the original file, for responses sent from a compressed sibling"""
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write .gz and .br copies of the build outputs")
+    parser.add_argument("paths", nargs="*", default=BUILD_OUTPUTS,
+                        help=f"files and directories to compress (default: {' '.join(BUILD_OUTPUTS)})")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes (default: 1)")
+    args = parser.parse_args()
+    precompress_outputs(args.paths, jobs=args.jobs)
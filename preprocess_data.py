@@ -1,10 +1,45 @@
 import pandas as pd
 import json
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-def preprocess_data():
+from publish import atomic_open
+
+# Coordinate column names to look for when geocoding records with bad zipcodes
+LATITUDE_COLUMNS = ['Latitude', 'latitude', 'lat']
+LONGITUDE_COLUMNS = ['Longitude', 'longitude', 'lng', 'lon']
+
+def repair_zipcodes_from_coordinates(df):
+    """
+    Replace invalid ZipCode values with the zip code containing the record's
+    coordinates, for datasets that include latitude/longitude columns.
+    """
+    lat_col = next((col for col in LATITUDE_COLUMNS if col in df.columns), None)
+    lng_col = next((col for col in LONGITUDE_COLUMNS if col in df.columns), None)
+    if lat_col is None or lng_col is None:
+        return df
+    
+    from zip_layer import get_zip_locator, normalize_zipcode
+    locator = get_zip_locator()
+    
+    # Only geocode records whose ZipCode doesn't match a known zip code
+    known_zips = set(locator.zipcodes)
+    bad_zips = ~df['ZipCode'].apply(normalize_zipcode).isin(known_zips)
+    if not bad_zips.any():
+        return df
+    
+    located = pd.Series(locator.locate(df.loc[bad_zips, lat_col], df.loc[bad_zips, lng_col]),
+                        index=df.index[bad_zips]).dropna()
+    print(f"Geocoded {len(located)} of {int(bad_zips.sum())} records with invalid zipcodes")
+    
+    # Keep the column's dtype so value_counts() doesn't split a zip into int and str keys
+    df = df.copy()
+    if pd.api.types.is_numeric_dtype(df['ZipCode']):
+        df.loc[located.index, 'ZipCode'] = located.astype(int)
+    else:
+        df.loc[located.index, 'ZipCode'] = located
+    return df
+
+def preprocess_data(examples=True):
     print("Loading NYC dogs dataset...")
     # Load the dataset
     df_dogs = pd.read_csv('nycdogs.csv')
@@ -17,9 +52,18 @@ def preprocess_data():
     df_dogs_unique = df_dogs.drop_duplicates()
     print("Total rows after deduplication:", len(df_dogs_unique))
     
+    # Fix zipcodes from coordinates where the dataset provides them
+    df_dogs_unique = repair_zipcodes_from_coordinates(df_dogs_unique)
+    
     # Save deduplicated dataset
     os.makedirs('data', exist_ok=True)
-    df_dogs_unique.to_csv('data/nycdogs_unique.csv', index=False)
+    with atomic_open('data/nycdogs_unique.csv', newline='') as f:
+        df_dogs_unique.to_csv(f, index=False)
+    
+    # Total dogs per zipcode, used to turn entity counts into local shares
+    zipcode_totals = df_dogs_unique['ZipCode'].value_counts().to_dict()
+    with atomic_open('data/zipcode_totals.json') as f:
+        json.dump(zipcode_totals, f, sort_keys=True)
     
     # Count breeds and filter for those with at least 100 dogs
     breed_counts = df_dogs_unique['BreedName'].value_counts()
@@ -55,20 +99,25 @@ def preprocess_data():
         }
     
     # Save to JSON files
-    with open('data/popular_breeds.json', 'w') as f:
+    with atomic_open('data/popular_breeds.json') as f:
         json.dump(popular_breeds_dict, f)
     
-    with open('data/popular_names.json', 'w') as f:
+    with atomic_open('data/popular_names.json') as f:
         json.dump(popular_names_dict, f)
     
     print("\nData preprocessing complete. Files saved to data/ directory")
     
     # Create example visualizations
-    create_example_visualizations(df_dogs_unique, list(popular_breeds.index)[:5], list(popular_names.index)[:5])
+    if examples:
+        create_example_visualizations(df_dogs_unique, list(popular_breeds.index)[:5], list(popular_names.index)[:5])
     
     return popular_breeds_dict, popular_names_dict
 
 def create_example_visualizations(df, top_breeds, top_names):
+    # Imported here so preprocessing without the example plots doesn't load them
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    
     print("\nCreating example visualizations...")
     os.makedirs('examples', exist_ok=True)
     
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Sampled inputs for quick preview builds (generate_netlify_maps.py --preview).
+
+A full build takes minutes, too long to check a change to the map styling or
+page layout. A preview build runs the same pipeline in preview/ on a small,
+deterministic sample: the zip codes of one borough, a fixed random sample of
+the dog records in them, and only a handful of breeds and names. Example
+plots are skipped. The real outputs (data/, maps/, ...) are left untouched.
+
+Output (under preview/):
+    ZCTA.gpkg   - the borough's zip code boundaries
+    nycdogs.csv - the sampled records
+    and every build output, as in the repository root
+"""
+
+import os
+import sys
+import shutil
+import pandas as pd
+import geopandas as gpd
+
+from zip_layer import BOROUGHS, get_borough, get_zipcode_field, normalize_zipcode
+
+PREVIEW_DIR = 'preview'
+PREVIEW_BOROUGH = 'Manhattan'
+PREVIEW_FRACTION = 0.2
+PREVIEW_ENTITIES = 3
+
+# Same seed every time, so repeated previews sample the same records
+PREVIEW_SEED = 0
+
+# Pages the build copies from the repository root
+PREVIEW_PAGES = ['viewer.html', 'timeline.html', 'static/zip_viewer.js', 'static/zip_viewer.css']
+
+def prepare_preview(borough=PREVIEW_BOROUGH, fraction=PREVIEW_FRACTION, output_dir=PREVIEW_DIR):
+    """Write the sampled geometry and records to output_dir, preprocess them there and switch into it"""
+    if borough not in BOROUGHS:
+        raise ValueError(f"Unknown borough: {borough}")
+    print(f"Preparing a preview build of {fraction:.0%} of the dogs in {borough} in {output_dir}/...")
+
+    # Modules are imported lazily by the build, so keep them importable after the chdir
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    if source_dir not in sys.path:
+        sys.path.insert(0, source_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    zipcode_gdf = gpd.read_file('ZCTA.gpkg')
+    zipcodes = zipcode_gdf[get_zipcode_field(zipcode_gdf)].map(normalize_zipcode)
+    zipcode_gdf = zipcode_gdf[zipcodes.map(get_borough) == borough]
+    zipcode_gdf.to_file(f'{output_dir}/ZCTA.gpkg', driver='GPKG')
+
+    records = pd.read_csv('nycdogs.csv', low_memory=False)
+    records = records[records['ZipCode'].map(normalize_zipcode).isin(set(zipcodes[zipcode_gdf.index]))]
+    records = records.sample(frac=fraction, random_state=PREVIEW_SEED).sort_index()
+    records.to_csv(f'{output_dir}/nycdogs.csv', index=False)
+    print(f"Sampled {len(records)} records in {len(zipcode_gdf)} zip codes")
+
+    for page in PREVIEW_PAGES:
+        os.makedirs(os.path.dirname(f'{output_dir}/{page}'), exist_ok=True)
+        shutil.copyfile(page, f'{output_dir}/{page}')
+
+    os.chdir(output_dir)
+    from preprocess_data import preprocess_data
+    preprocess_data(examples=False)
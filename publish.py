@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Versioned snapshots of the build outputs, published by an atomic pointer swap.
+
+Builds triggered by the servers (app.py's /process, serve.py's first start)
+used to rewrite maps/ and data/ while the same files were being served, so a
+client could get a half-written page or JSON that didn't match its maps.
+Instead, a build now runs in a new snapshot directory: hard links to the
+published outputs (so incremental builds still only redo what changed, and
+creating a snapshot copies nothing) with links to the input data. Because a
+linked file is shared with the published snapshot, builds never write into an
+existing file: they write a temporary file and rename it over the old one
+(atomic_open), which gives the snapshot its own copy. Once the build
+succeeds, releases/current is pointed at the new snapshot with a single
+rename. serve.py and app.py resolve releases/current at the start of every
+request, so they pick up a new version without a restart, and a request in
+flight keeps reading the snapshot it started with.
+
+The newest KEEP_RELEASES snapshots besides the published one are kept, so
+`python publish.py rollback` can switch back instantly. Until anything is
+published, the servers serve the working directory as before. The pointer is
+a symlink, so publishing needs a filesystem that supports them.
+
+Layout:
+    releases/<version>/ - one complete site; the version is its build time
+    releases/current    - symlink to the published version
+"""
+
+import os
+import sys
+import time
+import shutil
+import contextlib
+import subprocess
+
+from precompress import BUILD_OUTPUTS
+
+RELEASES_DIR = 'releases'
+CURRENT_LINK = f'{RELEASES_DIR}/current'
+BUILD_LOCK = f'{RELEASES_DIR}/.build.lock'
+
+# Old snapshots kept for rollback besides the published one
+KEEP_RELEASES = 3
+
+# Source pages served next to the outputs; copied, since builds rewrite and compress them
+SNAPSHOT_PAGES = ['viewer.html', 'timeline.html', 'static/zip_viewer.js', 'static/zip_viewer.css']
+# Read-only inputs, linked rather than copied
+SNAPSHOT_INPUTS = ['nycdogs.csv', 'ZCTA.gpkg']
+
+# A snapshot missing any of these is never published
+REQUIRED_OUTPUTS = ['data/popular_breeds.json', 'data/popular_names.json']
+
+# Build scripts live next to this module, whatever directory they run in
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Snapshots the servers keep loaded data of: the published one and the one before,
+# which requests in flight during a publish are still reading
+CACHED_ROOTS = 2
+
+def cache_for_root(cache, root, load):
+    """
+    Return cache[root], loading it with load() on first use. The cache maps
+    site roots to what was loaded from them, so concurrent requests on different
+    snapshots never see each other's data; the oldest roots are dropped.
+    Nothing is cached when load() returns None.
+    """
+    value = cache.get(root)
+    if value is None:
+        value = load()
+        if value is not None:
+            cache[root] = value
+            while len(cache) > CACHED_ROOTS:
+                # list() copies the keys in one step, so another thread's insert can't break the iteration
+                cache.pop(list(cache)[0], None)
+    return value
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    """
+    open() for writing a build output: writes a temporary file next to path
+    and renames it over path once the block succeeds. The old file is replaced
+    rather than overwritten, so a hard-linked published copy keeps its content.
+    """
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, mode, **kwargs) as f:
+            yield f
+        os.replace(temporary, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary)
+        raise
+
+def link_or_copy(source, target):
+    """Hard-link target to source, copying where the filesystem can't link"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def get_current_version():
+    """Return the published version, or None if nothing has been published"""
+    if not os.path.islink(CURRENT_LINK):
+        return None
+    return os.path.basename(os.readlink(CURRENT_LINK))
+
+def get_site_root():
+    """Absolute path of the published snapshot, or of the working directory before the first publish"""
+    if os.path.islink(CURRENT_LINK):
+        return os.path.realpath(CURRENT_LINK)
+    return os.getcwd()
+
+def list_snapshots():
+    """Return the snapshot versions, oldest first"""
+    if not os.path.isdir(RELEASES_DIR):
+        return []
+    return sorted(name for name in os.listdir(RELEASES_DIR)
+                  if not name.startswith('.') and not os.path.islink(f'{RELEASES_DIR}/{name}')
+                  and os.path.isdir(f'{RELEASES_DIR}/{name}'))
+
+def create_snapshot():
+    """Create a new snapshot holding hard links to the published outputs; return its version"""
+    os.makedirs(RELEASES_DIR, exist_ok=True)
+    version = time.strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(f'{RELEASES_DIR}/{version}'):
+        suffix += 1
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+    snapshot = f'{RELEASES_DIR}/{version}'
+    os.makedirs(snapshot)
+
+    previous = get_site_root()
+    print(f"Creating snapshot {version} from {previous}...")
+    for name in BUILD_OUTPUTS:
+        source = os.path.join(previous, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, f'{snapshot}/{name}', symlinks=True, copy_function=link_or_copy)
+        elif os.path.isfile(source):
+            link_or_copy(source, f'{snapshot}/{name}')
+    for name in SNAPSHOT_PAGES:
+        os.makedirs(os.path.dirname(f'{snapshot}/{name}'), exist_ok=True)
+        # Drop the link to the published copy first, so copying can't write into it
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f'{snapshot}/{name}')
+        shutil.copy2(os.path.join(SOURCE_DIR, name), f'{snapshot}/{name}')
+    # Point the fresh pages at the vendored assets already in the snapshot, for builds that don't vendor
+    from vendor_assets import VENDOR_DIR, VENDOR_MANIFEST, load_vendor_manifest, rewrite_page
+    manifest = load_vendor_manifest(f'{snapshot}/{VENDOR_MANIFEST}')
+    for name in SNAPSHOT_PAGES:
+        if name.endswith('.html'):
+            rewrite_page(f'{snapshot}/{name}', manifest, f'{snapshot}/{VENDOR_DIR}')
+    for name in SNAPSHOT_INPUTS:
+        if os.path.exists(os.path.join(SOURCE_DIR, name)):
+            os.symlink(os.path.join(SOURCE_DIR, name), f'{snapshot}/{name}')
+    return version
+
+def publish(version):
+    """Point releases/current at a snapshot. The rename is atomic, so readers see one version or the other"""
+    if version not in list_snapshots():
+        raise ValueError(f"No such snapshot: {version}")
+    temporary = f'{CURRENT_LINK}.{os.getpid()}.tmp'
+    os.symlink(version, temporary)
+    os.replace(temporary, CURRENT_LINK)
+    print(f"Published snapshot {version}")
+
+def rollback(version=None):
+    """Publish an older snapshot: the given version, or the one before the published one"""
+    if version is None:
+        current = get_current_version()
+        older = [snapshot for snapshot in list_snapshots() if current is None or snapshot < current]
+        if not older:
+            raise ValueError("No older snapshot to roll back to")
+        version = older[-1]
+    publish(version)
+    return version
+
+def prune_snapshots(keep=KEEP_RELEASES):
+    """Remove all but the newest `keep` snapshots besides the published one"""
+    current = get_current_version()
+    old = [snapshot for snapshot in list_snapshots() if snapshot != current]
+    for version in old[:max(len(old) - keep, 0)]:
+        shutil.rmtree(f'{RELEASES_DIR}/{version}')
+        print(f"Removed snapshot {version}")
+
+def build_snapshot(commands, keep=KEEP_RELEASES):
+    """
+    Run build scripts in a new snapshot and publish it if they all succeed.
+    commands are [script, *args] lists of scripts next to this module. A failed
+    build's snapshot is removed and the published version stays as it was.
+    Raises RuntimeError if another build is already running.
+    """
+    os.makedirs(RELEASES_DIR, exist_ok=True)
+    try:
+        lock = os.open(BUILD_LOCK, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise RuntimeError(f"Another build is running (remove {BUILD_LOCK} if it was interrupted)")
+    try:
+        os.write(lock, str(os.getpid()).encode())
+        version = create_snapshot()
+        snapshot = f'{RELEASES_DIR}/{version}'
+        try:
+            for script, *args in commands:
+                print(f"Running {' '.join([script, *args])} in {snapshot}/...")
+                subprocess.run([sys.executable, os.path.join(SOURCE_DIR, script), *args], cwd=snapshot, check=True)
+            missing = [name for name in REQUIRED_OUTPUTS if not os.path.exists(f'{snapshot}/{name}')]
+            if missing:
+                raise RuntimeError(f"Build did not produce {', '.join(missing)}")
+        except BaseException:
+            shutil.rmtree(snapshot, ignore_errors=True)
+            raise
+        publish(version)
+        prune_snapshots(keep)
+        return version
+    finally:
+        os.close(lock)
+        os.remove(BUILD_LOCK)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build, publish and roll back versioned snapshots of the site")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="run a build script in a new snapshot and publish it")
+    build_parser.add_argument("--keep", type=int, default=KEEP_RELEASES,
+                              help=f"old snapshots to keep for rollback (default: {KEEP_RELEASES})")
+    build_parser.add_argument("script", nargs="?", default="generate_netlify_maps.py",
+                              help="build script to run (default: generate_netlify_maps.py)")
+    build_parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments for the build script")
+    subparsers.add_parser("list", help="list the snapshots")
+    rollback_parser = subparsers.add_parser("rollback", help="publish an older snapshot")
+    rollback_parser.add_argument("version", nargs="?", help="snapshot to publish (default: the previous one)")
+    prune_parser = subparsers.add_parser("prune", help="remove old snapshots")
+    prune_parser.add_argument("--keep", type=int, default=KEEP_RELEASES)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            build_snapshot([[args.script, *args.args]], keep=args.keep)
+        elif args.command == "list":
+            current = get_current_version()
+            for version in list_snapshots():
+                print(f"{'*' if version == current else ' '} {version}")
+        elif args.command == "rollback":
+            rollback(args.version)
+        else:
+            prune_snapshots(args.keep)
+    except (ValueError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
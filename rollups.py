@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Zip -> borough -> citywide roll-ups for every breed and name.
+
+Each zip's borough comes from the stored zip index (see zip_layer.py). The
+roll-ups are one indicator-matrix product over the (zips x entities) count
+matrix and are saved to data/rollups.json, so borough views and APIs never
+aggregate raw zip counts per request.
+"""
+
+import json
+import numpy as np
+
+from zip_layer import BOROUGHS, load_zip_index
+from entity_counts import ENTITY_TYPES, load_entity_data, load_zipcode_totals, build_count_matrix
+from publish import atomic_open
+
+ROLLUPS_FILE = 'data/rollups.json'
+
+def build_borough_membership(boroughs):
+    """Return a (zips x boroughs) 0/1 matrix from each zip's borough"""
+    membership = np.zeros((len(boroughs), len(BOROUGHS)))
+    for row, borough in enumerate(boroughs):
+        if borough in BOROUGHS:
+            membership[row, BOROUGHS.index(borough)] = 1
+    return membership
+
+def rollup_entities(entity_data, zipcodes, membership, borough_totals, city_total):
+    """Aggregate every entity's zip counts to borough and city level"""
+    entities, counts = build_count_matrix(entity_data, zipcodes)
+    borough_counts = membership.T @ counts
+
+    rollups = {}
+    for column, entity in enumerate(entities):
+        entity_total = entity_data[entity]['total_count']
+        boroughs = {}
+        for b, borough in enumerate(BOROUGHS):
+            count = int(borough_counts[b, column])
+            boroughs[borough] = {
+                'count': count,
+                'percentage': round(count / entity_total * 100, 3) if entity_total else 0.0,
+                'share': round(count / borough_totals[b] * 100, 4) if borough_totals[b] else 0.0
+            }
+        rollups[entity] = {
+            'city': {
+                'count': entity_total,
+                'share': round(entity_total / city_total * 100, 4) if city_total else 0.0
+            },
+            'boroughs': boroughs
+        }
+    return rollups
+
+def build_rollups():
+    """Build borough and citywide roll-ups for all breeds and names"""
+    print("Building borough and citywide roll-ups...")
+    zip_index = load_zip_index()
+    zipcodes = zip_index['zipcodes']
+    membership = build_borough_membership(zip_index['borough'])
+
+    # Total dogs per borough and citywide, for each entity's local share
+    zipcode_totals = load_zipcode_totals() or {}
+    zip_totals = np.array([zipcode_totals.get(zipcode, 0) for zipcode in zipcodes], dtype=float)
+    borough_totals = membership.T @ zip_totals
+    city_total = float(sum(zipcode_totals.values()))
+
+    rollups = {
+        'hierarchy': {borough: [zipcode for zipcode, b in zip(zipcodes, zip_index['borough']) if b == borough]
+                      for borough in BOROUGHS},
+        'totals': {
+            'city': int(city_total),
+            'boroughs': {borough: int(borough_totals[b]) for b, borough in enumerate(BOROUGHS)}
+        }
+    }
+    for entity_type in ENTITY_TYPES:
+        rollups[entity_type] = rollup_entities(load_entity_data(entity_type), zipcodes, membership,
+                                               borough_totals, city_total)
+
+    with atomic_open(ROLLUPS_FILE) as f:
+        json.dump(rollups, f, sort_keys=True)
+
+    print(f"Roll-ups saved to {ROLLUPS_FILE}")
+    return rollups
+
+def load_rollups(path=ROLLUPS_FILE):
+    """Load the stored roll-ups, or None if they haven't been built"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+if __name__ == "__main__":
+    build_rollups()
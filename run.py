@@ -54,8 +54,28 @@ def main():
         print(f"Error during preprocessing: {e}")
         return
     
+    # Compute spatial statistics
+    print("\nStep 2: Computing spatial statistics...")
+    print("-"*60)
+    try:
+        from spatial_stats import build_spatial_stats
+        build_spatial_stats()
+    except Exception as e:
+        print(f"Error computing spatial statistics: {e}")
+        return
+    
+    # Precompute borough and citywide roll-ups
+    print("\nStep 3: Building borough roll-ups...")
+    print("-"*60)
+    try:
+        from rollups import build_rollups
+        build_rollups()
+    except Exception as e:
+        print(f"Error building roll-ups: {e}")
+        return
+    
     # Create heatmaps
-    print("\nStep 2: Creating choropleth maps...")
+    print("\nStep 4: Creating choropleth maps...")
     print("-"*60)
     try:
         from create_heatmaps import create_breed_choropleth_maps, create_name_choropleth_maps, create_web_interface
@@ -68,6 +88,16 @@ def main():
         print(f"Error creating maps: {e}")
         return
     
+    # Refresh the gzip and brotli copies of the rewritten pages and data files
+    print("\nStep 5: Precompressing the outputs...")
+    print("-"*60)
+    try:
+        from precompress import precompress_outputs
+        precompress_outputs()
+    except Exception as e:
+        print(f"Error precompressing the outputs: {e}")
+        return
+    
     # Success message
     print("\n" + "="*60)
     print("Process completed successfully!")
@@ -76,6 +106,8 @@ def main():
     print("1. View example visualizations in the 'examples/' directory")
     print("2. Open 'website/index.html' in a web browser to explore the interactive maps")
     print("3. Find the deduplicated dataset at 'data/nycdogs_unique.csv'")
+    return True
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # A failed step exits non-zero, so publish.py never publishes a half-built snapshot
+    sys.exit(0 if main() else 1) 
\ No newline at end of file
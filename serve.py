@@ -7,38 +7,118 @@ import os
 import http.server
 import socketserver
 from urllib.parse import urlparse
-import subprocess
-import time
+from precompress import find_precompressed
+from vendor_assets import VENDOR_DIR, IMMUTABLE_CACHE_CONTROL
+from basemap_tiles import TILE_CACHE_CONTROL, get_tile_cache
+from publish import get_site_root, build_snapshot
 
 # Get port from environment variable (Heroku sets this)
 PORT = int(os.environ.get("PORT", 8000))
 
-# Check if we need to generate maps
-if not os.path.exists('maps') or not os.path.isdir('maps/breeds') or not os.path.isdir('maps/names'):
+# Build whatever the published site is missing in a new snapshot, so nothing is rewritten while it is served
+site_root = get_site_root()
+commands = []
+if not os.path.isdir(f'{site_root}/maps/breeds') or not os.path.isdir(f'{site_root}/maps/names'):
     print("Maps directory not found. Generating maps...")
-    # Run the map generation script
+    commands.append(["generate_netlify_maps.py"])
+
+# Check if we need to build the zipcode vector tiles
+if not os.path.exists(f'{site_root}/tiles/zips/metadata.json'):
+    print("Vector tiles not found. Building tiles...")
+    commands.append(["build_vector_tiles.py"])
+
+if commands:
     try:
-        subprocess.run(["python", "generate_netlify_maps.py"], check=True)
-        print("Maps generated successfully.")
+        build_snapshot(commands)
+        print("Site built and published successfully.")
     except Exception as e:
-        print(f"Error generating maps: {e}")
+        print(f"Error building the site: {e}")
         # Create directory structure anyway
-        os.makedirs('maps/breeds', exist_ok=True)
-        os.makedirs('maps/names', exist_ok=True)
+        os.makedirs(f'{site_root}/maps/breeds', exist_ok=True)
+        os.makedirs(f'{site_root}/maps/names', exist_ok=True)
 
 # Create a custom request handler
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    extensions_map = {
+        **http.server.SimpleHTTPRequestHandler.extensions_map,
+        '.pbf': 'application/x-protobuf'
+    }
+    # Status of the response being sent, set by send_response
+    response_code = None
+    
+    def __init__(self, *args, **kwargs):
+        # Serve the snapshot published when the request arrived, even if a new one is published mid-response
+        super().__init__(*args, directory=get_site_root(), **kwargs)
+    
     def do_GET(self):
         # Parse the URL path
         parsed_path = urlparse(self.path)
         path = parsed_path.path
         
+        # Vector tiles with no features are never written, so answer them with an empty response
+        if path.startswith("/tiles/") and not os.path.exists(self.translate_path(path)):
+            self.send_response(204)
+            self.end_headers()
+            return
+        
+        # Basemap tiles come from the local tile cache, fetched from CARTO on a miss
+        if path.startswith("/basemap/"):
+            return self.send_basemap_tile(path)
+        
         # If the root path or an invalid path is requested, serve index.html
-        if path == "/" or not os.path.exists(path[1:]):
+        if path == "/" or not os.path.exists(self.translate_path(path)):
             self.path = "/index.html"
+            path = "/index.html"
+        
+        # Send the build-time .br/.gz sibling as-is when the client accepts it
+        file_path = self.translate_path(path)
+        compressed, encoding = find_precompressed(file_path, self.headers.get('Accept-Encoding'))
+        if encoding is not None and os.path.isfile(file_path):
+            return self.send_precompressed(file_path, compressed, encoding)
         
         return http.server.SimpleHTTPRequestHandler.do_GET(self)
+    
+    def send_basemap_tile(self, path):
+        """Answer /basemap/<z>/<x>/<y>.png from the tile cache"""
+        try:
+            z, x, y = (int(part) for part in path[len("/basemap/"):].removesuffix(".png").split("/"))
+            tile = get_tile_cache().get(z, x, y)
+        except ValueError:
+            return self.send_error(404, "No such tile")
+        except OSError as e:
+            return self.send_error(502, f"Tile not cached and unavailable upstream: {e}")
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(tile)))
+        self.send_header("Cache-Control", TILE_CACHE_CONTROL)
+        self.end_headers()
+        self.wfile.write(tile)
+    
+    def send_precompressed(self, file_path, compressed, encoding):
+        """Send a precompressed sibling with the original file's content type"""
+        with open(compressed, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(file_path))
+        self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Last-Modified", self.date_time_string(int(os.path.getmtime(compressed))))
+        self.end_headers()
+        self.wfile.write(body)
 
+    def send_response(self, code, message=None):
+        # Remembered so end_headers only marks successful responses as immutable
+        self.response_code = code
+        return http.server.SimpleHTTPRequestHandler.send_response(self, code, message)
+    
+    def end_headers(self):
+        # Vendored assets and thumbnails carry their content hash in the name, so they never change;
+        # errors for those paths must stay uncached, or a fixed file would never be fetched
+        if self.response_code == 200 and urlparse(self.path).path.startswith((f"/{VENDOR_DIR}/", "/maps/thumbnails/")):
+            self.send_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+        return http.server.SimpleHTTPRequestHandler.end_headers(self)
+    
     def log_message(self, format, *args):
         """Override to provide more useful logging info"""
         message = "%s - - [%s] %s" % (
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Size report and budgets for the build outputs.
+
+Walks index.html, maps/, heatmaps/ and data/ and reports the bytes of every
+file and of each directory. Each HTML page is also split into the parts that
+make it up:
+
+    geometry    - GeoJSON feature collections inlined into its scripts
+    data        - other JSON literals of at least 1 KB in its scripts (map payloads,
+                  style vectors, the index page's breed and name data)
+    scripts     - the rest of its inline scripts
+    boilerplate - everything outside inline scripts (markup, styles, script tags)
+
+The sizes are checked against size_budgets.json (next to this module), which
+holds per-file limits by path pattern and per-target totals, both in KB. The
+first file pattern that matches a path applies. Precompressed .gz/.br siblings
+are not counted, and build intermediates that no page loads (the deduplicated
+records, the class tables) are listed on their own, outside the budgets.
+"""
+
+import os
+import re
+import sys
+import json
+from fnmatch import fnmatch
+
+REPORT_TARGETS = ['index.html', 'maps', 'heatmaps', 'data']
+# Found wherever the build runs, e.g. inside a snapshot
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'size_budgets.json')
+
+# Written to data/ for later build steps and the servers, never sent to a browser: the
+# deduplicated records, and the class tables and spatial weights (fnmatch's * spans /)
+INTERMEDIATE_PATTERNS = ['data/nycdogs_unique.csv', 'data/*.npz']
+
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+PAGE_PARTS = ['geometry', 'data', 'scripts', 'boilerplate']
+
+# Smaller JSON literals are counted as plain script
+MIN_LITERAL_BYTES = 1024
+
+INLINE_SCRIPT_PATTERN = re.compile(r'<script(?![^>]*\bsrc=)[^>]*>(.*?)</script>', re.S | re.I)
+# An object or array literal passed or assigned somewhere, where JSON usually starts
+LITERAL_START_PATTERN = re.compile(r'[=(,:]\s*(?=[\[{])')
+
+def is_geometry(value):
+    return isinstance(value, dict) and (value.get('type') == 'FeatureCollection' or 'features' in value)
+
+def split_script(script, parts, decoder=json.JSONDecoder()):
+    """Add a script's geometry, data and remaining bytes to parts"""
+    literal_bytes = 0
+    position = 0
+    while True:
+        match = LITERAL_START_PATTERN.search(script, position)
+        if match is None:
+            break
+        start = match.end()
+        try:
+            value, end = decoder.raw_decode(script, start)
+        except ValueError:
+            # A JavaScript object literal rather than JSON
+            position = start + 1
+            continue
+        size = len(script[start:end].encode('utf-8'))
+        if size >= MIN_LITERAL_BYTES:
+            parts['geometry' if is_geometry(value) else 'data'] += size
+            literal_bytes += size
+        position = end
+    parts['scripts'] += len(script.encode('utf-8')) - literal_bytes
+
+def split_page(html):
+    """Return {part: bytes} of an HTML page, for the parts in PAGE_PARTS"""
+    parts = dict.fromkeys(PAGE_PARTS, 0)
+    for match in INLINE_SCRIPT_PATTERN.finditer(html):
+        split_script(match.group(1), parts)
+    parts['boilerplate'] = len(html.encode('utf-8')) - sum(parts.values())
+    return parts
+
+def iter_output_files(targets=REPORT_TARGETS):
+    """Yield the path of every output file under the targets, in a stable order"""
+    for target in targets:
+        if os.path.isfile(target):
+            yield target
+            continue
+        for root, dirs, files in os.walk(target):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.endswith(COMPRESSED_SUFFIXES):
+                    yield os.path.join(root, name).replace(os.sep, '/')
+
+def is_intermediate(path):
+    return any(fnmatch(path, pattern) for pattern in INTERMEDIATE_PATTERNS)
+
+def build_size_report(targets=REPORT_TARGETS, pages=True):
+    """
+    Return {'files': [{path, bytes, parts}], 'directories': {dir: bytes},
+    'targets': {target: bytes}, 'pages': {target: {part: bytes}},
+    'intermediates': [{path, bytes}]}. parts is only set for HTML pages, and
+    only when pages is true. Intermediates count towards no directory or target.
+    """
+    report = {'files': [], 'directories': {}, 'targets': {}, 'pages': {}, 'intermediates': []}
+    for path in iter_output_files(targets):
+        entry = {'path': path, 'bytes': os.path.getsize(path)}
+        if is_intermediate(path):
+            report['intermediates'].append(entry)
+            continue
+        target = path.split('/')[0]
+        directory = os.path.dirname(path) or '.'
+        report['targets'][target] = report['targets'].get(target, 0) + entry['bytes']
+        report['directories'][directory] = report['directories'].get(directory, 0) + entry['bytes']
+
+        if pages and path.endswith('.html'):
+            with open(path, 'r', encoding='utf-8') as f:
+                entry['parts'] = split_page(f.read())
+            totals = report['pages'].setdefault(target, dict.fromkeys(PAGE_PARTS, 0))
+            for part, size in entry['parts'].items():
+                totals[part] += size
+        report['files'].append(entry)
+    return report
+
+def load_budgets(path=BUDGETS_FILE):
+    """Return the budgets {'files_kb': {pattern: KB}, 'totals_kb': {target: KB}}, or None if there is no file"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def check_budgets(report, budgets):
+    """Return a message for every file and target over its budget"""
+    violations = []
+    file_budgets = budgets.get('files_kb', {})
+    for entry in report['files']:
+        pattern = next((pattern for pattern in file_budgets if fnmatch(entry['path'], pattern)), None)
+        if pattern is not None and entry['bytes'] > file_budgets[pattern] * 1024:
+            violations.append(f"{entry['path']}: {format_size(entry['bytes'])} over the "
+                              f"{file_budgets[pattern]} KB budget of {pattern}")
+    for target, limit in budgets.get('totals_kb', {}).items():
+        size = report['targets'].get(target, 0)
+        if size > limit * 1024:
+            violations.append(f"{target}: {format_size(size)} in total, over its {limit} KB budget")
+    return violations
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def print_size_report(report, top=20):
+    print("Output sizes:")
+    for target, size in sorted(report['targets'].items()):
+        print(f"  {target:<40} {format_size(size):>10}")
+
+    print("\nLargest directories:")
+    for directory, size in sorted(report['directories'].items(), key=lambda x: -x[1])[:top]:
+        print(f"  {directory:<40} {format_size(size):>10}")
+
+    if report['pages']:
+        print("\nHTML page composition:")
+        print(f"  {'':<20}" + ''.join(f"{part:>14}" for part in PAGE_PARTS))
+        for target, parts in sorted(report['pages'].items()):
+            print(f"  {target:<20}" + ''.join(f"{format_size(parts[part]):>14}" for part in PAGE_PARTS))
+
+    print(f"\nLargest {top} files:")
+    for entry in sorted(report['files'], key=lambda x: -x['bytes'])[:top]:
+        parts = entry.get('parts')
+        detail = ', '.join(f"{part} {format_size(parts[part])}" for part in PAGE_PARTS if parts[part]) if parts else ''
+        print(f"  {format_size(entry['bytes']):>10}  {entry['path']}" + (f"  ({detail})" if detail else ''))
+
+    if report['intermediates']:
+        print("\nBuild intermediates (not budgeted):")
+        for entry in sorted(report['intermediates'], key=lambda x: -x['bytes']):
+            print(f"  {format_size(entry['bytes']):>10}  {entry['path']}")
+
+def run_size_check(targets=REPORT_TARGETS, budgets_path=BUDGETS_FILE, top=20, pages=True):
+    """Print the size report and return the budget violations (none without a budgets file)"""
+    report = build_size_report(targets, pages=pages)
+    print_size_report(report, top)
+    budgets = load_budgets(budgets_path)
+    if budgets is None:
+        print(f"\nNo {budgets_path}; sizes not checked")
+        return report, []
+    violations = check_budgets(report, budgets)
+    for violation in violations:
+        print(f"Over budget: {violation}", file=sys.stderr)
+    print(f"\n{len(violations)} size budget violation(s)" if violations else "\nAll outputs within their size budgets")
+    return report, violations
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report the sizes of the build outputs and check them against budgets")
+    parser.add_argument("targets", nargs="*", default=REPORT_TARGETS,
+                        help=f"files and directories to measure (default: {' '.join(REPORT_TARGETS)})")
+    parser.add_argument("--budgets", default=BUDGETS_FILE, help=f"budgets file (default: {BUDGETS_FILE})")
+    parser.add_argument("--top", type=int, default=20, help="number of largest files and directories to list")
+    parser.add_argument("--no-pages", action="store_true", help="skip splitting HTML pages into their parts")
+    parser.add_argument("--json", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    report, violations = run_size_check(args.targets, args.budgets, args.top, pages=not args.no_pages)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({**report, 'violations': violations}, f, indent=1)
+    sys.exit(1 if violations else 0)
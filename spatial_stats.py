@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Zip adjacency graph and batch spatial statistics.
+
+Builds a sparse contiguity weights matrix between ZCTA polygons once (using the
+STRtree instead of pairwise touches checks), then computes global Moran's I and
+local Getis-Ord Gi* hot spots for every popular breed and name as sparse x
+dense matrix products. Results are stored in data/spatial_stats.json so the
+maps and API can read them without any work at request time.
+"""
+
+import json
+import math
+import numpy as np
+import scipy.sparse as sp
+from shapely import STRtree
+
+from zip_layer import ZIPCODE_FIELD, load_zip_layer
+from entity_counts import ENTITY_TYPES, load_entity_data, load_zipcode_totals, build_count_matrix
+from publish import atomic_open
+
+WEIGHTS_FILE = 'data/zip_weights.npz'
+STATS_FILE = 'data/spatial_stats.json'
+
+# |z| above this marks a significant hot/cold spot or clustering (p < 0.05)
+Z_CRITICAL = 1.96
+
+def build_contiguity_weights(zipcode_gdf):
+    """
+    Return a binary (zips x zips) CSR matrix where w_ij = 1 if zips i and j
+    share a boundary point (queen contiguity). Candidate pairs come from a
+    single bulk STRtree query rather than n^2 touches checks.
+    """
+    geometries = zipcode_gdf.geometry.values
+    tree = STRtree(geometries)
+    left, right = tree.query(geometries, predicate='intersects')
+
+    # Drop self-pairs; intersects is symmetric so the matrix already is too
+    off_diagonal = left != right
+    left, right = left[off_diagonal], right[off_diagonal]
+
+    n = len(geometries)
+    return sp.csr_matrix((np.ones(len(left)), (left, right)), shape=(n, n))
+
+def save_weights(weights, zipcodes, path=WEIGHTS_FILE):
+    """Save the weights matrix together with the zip index it is ordered by"""
+    weights = weights.tocsr()
+    with atomic_open(path, 'wb') as f:
+        np.savez_compressed(f, data=weights.data, indices=weights.indices, indptr=weights.indptr,
+                            shape=weights.shape, zipcodes=np.array(zipcodes))
+
+def load_weights(path=WEIGHTS_FILE):
+    """Load a weights matrix saved by save_weights(); returns (weights, zipcodes)"""
+    with np.load(path) as saved:
+        weights = sp.csr_matrix((saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape']))
+        return weights, saved['zipcodes'].tolist()
+
+def morans_i(weights, values):
+    """
+    Global Moran's I for every column of values (zips x entities), with
+    z-scores and two-sided p-values under the normality assumption.
+    Uses row-standardized weights.
+    """
+    n = values.shape[0]
+    row_sums = np.asarray(weights.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+    w = sp.diags(inverse) @ weights
+
+    deviations = values - values.mean(axis=0)
+    spatial_lag = w @ deviations
+    s0 = w.sum()
+    denominator = (deviations ** 2).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        i = (n / s0) * (deviations * spatial_lag).sum(axis=0) / denominator
+
+    # Moments of I under normality depend only on the weights
+    expected = -1.0 / (n - 1)
+    s1 = 0.5 * (w + w.T).power(2).sum()
+    s2 = ((np.asarray(w.sum(axis=1)).ravel() + np.asarray(w.sum(axis=0)).ravel()) ** 2).sum()
+    variance = (n * n * s1 - n * s2 + 3 * s0 * s0) / ((n * n - 1) * s0 * s0) - expected ** 2
+
+    z = (i - expected) / math.sqrt(variance)
+    p = np.array([math.erfc(abs(score) / math.sqrt(2)) if np.isfinite(score) else 1.0 for score in z])
+    return i, z, p
+
+def getis_ord_g_star(weights, values):
+    """
+    Local Getis-Ord Gi* z-scores for every zip and every column of values,
+    using binary weights with each zip included in its own neighbourhood.
+    """
+    n = values.shape[0]
+    w = (weights + sp.identity(n, format='csr')).tocsr()
+    w.data[:] = 1.0
+
+    neighbour_counts = np.asarray(w.sum(axis=1)).ravel()[:, None]
+    mean = values.mean(axis=0)
+    std = np.sqrt((values ** 2).mean(axis=0) - mean ** 2)
+
+    numerator = w @ values - neighbour_counts * mean
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denominator = std * np.sqrt((n * neighbour_counts - neighbour_counts ** 2) / (n - 1))
+        g_star = numerator / denominator
+    return np.nan_to_num(g_star)
+
+def compute_entity_stats(weights, zipcodes, entity_data, zipcode_totals):
+    """Compute Moran's I and Gi* hot spots for every entity in entity_data"""
+    entities, counts = build_count_matrix(entity_data, zipcodes)
+
+    # Analyse each entity's share of the dogs in a zip, so clustering isn't just dog density
+    if zipcode_totals is not None:
+        totals = np.array([zipcode_totals.get(zipcode, 0) for zipcode in zipcodes], dtype=float)
+    else:
+        totals = counts.sum(axis=1)
+    shares = np.divide(counts, totals[:, None], out=np.zeros_like(counts), where=totals[:, None] > 0)
+
+    i, z, p = morans_i(weights, shares)
+    g_star = getis_ord_g_star(weights, shares)
+
+    results = {}
+    for column, entity in enumerate(entities):
+        results[entity] = {
+            'morans_i': round(float(i[column]), 4) if np.isfinite(i[column]) else None,
+            'morans_z': round(float(z[column]), 3) if np.isfinite(z[column]) else None,
+            'morans_p': round(float(p[column]), 4),
+            'clustered': bool(p[column] < 0.05 and i[column] > 0),
+            'hot_spots': [zipcodes[row] for row in np.flatnonzero(g_star[:, column] > Z_CRITICAL)],
+            'cold_spots': [zipcodes[row] for row in np.flatnonzero(g_star[:, column] < -Z_CRITICAL)],
+            'g_star': [round(float(score), 2) for score in g_star[:, column]]
+        }
+    return results
+
+def load_spatial_stats(path=STATS_FILE):
+    """Load the stored spatial statistics, or None if they haven't been built"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def build_spatial_stats():
+    """Build the zip weights matrix and spatial statistics for all breeds and names"""
+    print("Building zip contiguity weights...")
+    zipcode_gdf = load_zip_layer()
+    zipcodes = zipcode_gdf[ZIPCODE_FIELD].tolist()
+
+    weights = build_contiguity_weights(zipcode_gdf)
+    save_weights(weights, zipcodes)
+    islands = int((np.asarray(weights.sum(axis=1)).ravel() == 0).sum())
+    print(f"{weights.nnz // 2} adjacent zip pairs, {islands} zips without neighbours")
+
+    zipcode_totals = load_zipcode_totals()
+    stats = {'zipcodes': zipcodes}
+    for entity_type in ENTITY_TYPES:
+        stats[entity_type] = compute_entity_stats(weights, zipcodes, load_entity_data(entity_type), zipcode_totals)
+        clustered = sum(1 for entity_stats in stats[entity_type].values() if entity_stats['clustered'])
+        print(f"{entity_type}: {clustered} of {len(stats[entity_type])} significantly clustered")
+
+    with atomic_open(STATS_FILE) as f:
+        json.dump(stats, f, sort_keys=True)
+
+    print(f"Spatial statistics saved to {STATS_FILE}")
+    return stats
+
+if __name__ == "__main__":
+    build_spatial_stats()
@@ -0,0 +1,159 @@
+// Shared by viewer.html and timeline.html: the map with its title and legend, one zip layer
+// restyled in place, the sharded per-entity data under dataDir, and the breed and name search.
+// The page supplies tooltip(layer) and show(entityType, entry, entity, index), called once the
+// shard holding the picked entity has loaded, plus optionally onIndex(index) for each type index.
+
+// YlOrRd, matching the generated folium maps
+const COLORS = ['#ffffb2', '#fed976', '#feb24c', '#fd8d3c', '#f03b20', '#bd0026'];
+const MAX_RESULTS = 20;
+
+function createZipViewer({dataDir, tooltip, show, onIndex}) {
+    const typeSelector = document.getElementById('typeSelector');
+    const entitySearch = document.getElementById('entitySearch');
+    const entityResults = document.getElementById('entityResults');
+
+    const map = L.map('map').setView([40.7128, -74.0060], 10);
+    // CARTO's CDN or the local /basemap/ cache, whichever the build was made for
+    fetch('data/basemap.json').then(response => response.json()).then(basemap => {
+        L.tileLayer(basemap.url, basemap.options).addTo(map);
+    });
+
+    // The index is fetched once per type, each shard once when first needed, and the geometry once in total
+    const indexByType = {};
+    const shards = {};
+    const viewer = {map, zipFeatures: [], zipLayer: null};
+
+    const title = L.control({position: 'topright'});
+    title.onAdd = () => L.DomUtil.create('div', 'map-title');
+    title.addTo(map);
+
+    const legend = L.control({position: 'bottomright'});
+    legend.onAdd = () => L.DomUtil.create('div', 'legend');
+    legend.addTo(map);
+
+    viewer.setTitle = (heading, subtitle) => {
+        // Breed and name values are free text from the dataset, so they go in as text, never as HTML
+        const box = title.getContainer();
+        box.replaceChildren(document.createElement('h3'), document.createElement('p'));
+        box.children[0].textContent = heading;
+        box.children[1].textContent = subtitle;
+    };
+
+    viewer.setLegend = (caption, labels) => {
+        // One row per colour class, labelled with its range
+        const box = legend.getContainer();
+        const heading = document.createElement('strong');
+        heading.textContent = caption;
+        box.replaceChildren(heading);
+        COLORS.forEach((color, i) => {
+            const swatch = document.createElement('i');
+            swatch.style.background = color;
+            box.append(document.createElement('br'), swatch, labels[i]);
+        });
+    };
+
+    viewer.spread = (entity, valueOf, empty) => {
+        // Expand a sparse vector to one entry per zip index
+        const dense = viewer.zipFeatures.map(() => empty);
+        entity.zips.forEach((zip, j) => { dense[zip] = valueOf(j, zip); });
+        return dense;
+    };
+
+    viewer.paint = classes => {
+        // Restyle the existing layer in place; no geometry is reloaded. '-' marks zips without a value
+        viewer.zipLayer.eachLayer(layer => {
+            const cls = classes[layer.feature.properties.index];
+            layer.setStyle(cls === '-'
+                ? {fillOpacity: 0, fillColor: 'transparent'}
+                : {fillOpacity: 0.7, fillColor: COLORS[cls]});
+        });
+    };
+
+    function loadShard(entityType, shard) {
+        const key = `${entityType}/${shard}`;
+        if (!shards[key]) {
+            shards[key] = fetch(`${dataDir}/${entityType}/shards/${shard}.json`).then(response => response.json());
+        }
+        return shards[key];
+    }
+
+    function showEntity(entityType, entry) {
+        const [name, , shard] = entry;
+        entitySearch.value = name;
+        entityResults.hidden = true;
+        return loadShard(entityType, shard).then(data => show(entityType, entry, data[name], indexByType[entityType]));
+    }
+
+    function search(query) {
+        // Names starting with the query first, then names containing it; each in order of dog count
+        const entities = indexByType[typeSelector.value].entities;
+        const needle = query.trim().toLowerCase();
+        if (!needle) return entities.slice(0, MAX_RESULTS);
+        const starting = [];
+        const containing = [];
+        for (const entry of entities) {
+            const position = entry[0].toLowerCase().indexOf(needle);
+            if (position === 0) starting.push(entry);
+            else if (position > 0 && containing.length < MAX_RESULTS) containing.push(entry);
+            if (starting.length === MAX_RESULTS) break;
+        }
+        return starting.concat(containing).slice(0, MAX_RESULTS);
+    }
+
+    function showResults() {
+        if (!indexByType[typeSelector.value]) return;
+        const results = search(entitySearch.value);
+        entityResults.replaceChildren();
+        for (const entry of results) {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'list-group-item list-group-item-action';
+            item.textContent = `${entry[0]} (${entry[1]} dogs)`;
+            // mousedown runs before the input's blur hides the list
+            item.addEventListener('mousedown', event => {
+                event.preventDefault();
+                showEntity(typeSelector.value, entry);
+            });
+            entityResults.appendChild(item);
+        }
+        entityResults.hidden = results.length === 0;
+    }
+
+    function loadType(entityType) {
+        const ready = indexByType[entityType]
+            ? Promise.resolve(indexByType[entityType])
+            : fetch(`${dataDir}/${entityType}/index.json`).then(response => response.json()).then(data => {
+                indexByType[entityType] = data;
+                return data;
+            });
+        return ready.then(data => {
+            entitySearch.placeholder = `Search ${data.entities.length.toLocaleString()} ${entityType}`;
+            if (onIndex) onIndex(data);
+            if (data.entities.length) return showEntity(entityType, data.entities[0]);
+        });
+    }
+
+    viewer.start = () => fetch('data/viewer/zips.geojson').then(response => response.json()).then(geojson => {
+        geojson.features.forEach((feature, i) => { feature.properties.index = i; });
+        viewer.zipFeatures = geojson.features;
+        viewer.zipLayer = L.geoJSON(geojson, {
+            style: {color: 'black', weight: 1, opacity: 0.2, fillOpacity: 0}
+        }).bindTooltip(tooltip, {sticky: false}).addTo(map);
+
+        typeSelector.addEventListener('change', () => loadType(typeSelector.value));
+        entitySearch.addEventListener('input', showResults);
+        entitySearch.addEventListener('focus', () => { entitySearch.select(); showResults(); });
+        entitySearch.addEventListener('blur', () => { entityResults.hidden = true; });
+        entitySearch.addEventListener('keydown', event => {
+            if (event.key === 'Enter') {
+                const results = search(entitySearch.value);
+                if (results.length) showEntity(typeSelector.value, results[0]);
+            } else if (event.key === 'Escape') {
+                entityResults.hidden = true;
+            }
+        });
+        return loadType(typeSelector.value);
+    });
+
+    return viewer;
+}
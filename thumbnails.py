@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Static PNG thumbnails of every breed and name map.
+
+Each worker draws the zip polygons once as a single matplotlib PatchCollection
+and then, per entity, only sets the collection's face colours and saves the
+figure. Colours come from the shared percentage classes of the map pages
+(see classification.py), so each thumbnail is a palette lookup. File
+names carry a hash of the image, so the index can reference them with long
+cache lifetimes and unchanged thumbnails are never rewritten.
+
+Output:
+    maps/thumbnails/<type>/<entity>.<hash>.png
+    maps/thumbnails/index.json - {type: {entity: path}}
+"""
+
+import io
+import os
+import json
+import hashlib
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import Polygon
+
+from zip_layer import load_zip_layer
+from classification import SCHEMES, DEFAULT_SCHEME, class_palette, load_class_table
+from publish import atomic_open
+
+THUMBNAIL_DIR = 'maps/thumbnails'
+THUMBNAIL_INDEX = f'{THUMBNAIL_DIR}/index.json'
+THUMBNAIL_SIZE = 160
+
+# Fill for zips where the entity has no dogs
+NO_DATA_COLOR = '#eeeeee'
+
+# ~50 m in degrees; invisible at thumbnail size and much faster to draw
+SIMPLIFY_TOLERANCE = 0.0005
+
+class ThumbnailCanvas:
+    """A figure holding every zip polygon in one PatchCollection, recoloured per thumbnail"""
+
+    def __init__(self, zipcode_gdf):
+        patches = []
+        patch_zip = []
+        for row, geometry in enumerate(zipcode_gdf.geometry.simplify(SIMPLIFY_TOLERANCE)):
+            polygons = geometry.geoms if geometry.geom_type == 'MultiPolygon' else [geometry]
+            for polygon in polygons:
+                patches.append(Polygon(np.asarray(polygon.exterior.coords), closed=True))
+                patch_zip.append(row)
+        # Each patch's row in the zip index, to spread per-zip colours over MultiPolygon parts
+        self.patch_zip = np.array(patch_zip)
+
+        self.figure = plt.figure(figsize=(1, 1), dpi=THUMBNAIL_SIZE)
+        ax = self.figure.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        self.collection = PatchCollection(patches, edgecolor='white', linewidth=0.1)
+        ax.add_collection(self.collection)
+
+        west, south, east, north = zipcode_gdf.total_bounds
+        # Square canvas; stretch longitude by 1/cos(latitude) so the city keeps its shape
+        aspect = 1 / np.cos(np.radians((south + north) / 2))
+        half = max((east - west) / aspect, north - south) / 2
+        center_x, center_y = (west + east) / 2, (south + north) / 2
+        ax.set_xlim(center_x - half * aspect, center_x + half * aspect)
+        ax.set_ylim(center_y - half, center_y + half)
+
+    def render(self, zip_colors):
+        """Return PNG bytes with each zip filled with its colour"""
+        self.collection.set_facecolor(zip_colors[self.patch_zip])
+        buffer = io.BytesIO()
+        self.figure.savefig(buffer, format='png', transparent=True)
+        return buffer.getvalue()
+
+# Built once per worker process by init_thumbnail_worker()
+_canvas = None
+
+def init_thumbnail_worker():
+    global _canvas
+    _canvas = ThumbnailCanvas(load_zip_layer())
+
+def render_thumbnail(task):
+    """Render one (entity_type, entity, classes) thumbnail; returns (entity_type, entity, path)"""
+    entity_type, entity, classes = task
+    png = _canvas.render(class_palette(no_data=NO_DATA_COLOR)[classes])
+
+    safe_name = entity.replace('/', '_').replace(' ', '_')
+    path = f'{THUMBNAIL_DIR}/{entity_type}/{safe_name}.{hashlib.sha256(png).hexdigest()[:10]}.png'
+    if not os.path.exists(path):
+        with atomic_open(path, 'wb') as f:
+            f.write(png)
+    return entity_type, entity, path
+
+def build_thumbnails(entities_by_type, jobs=1, scheme=DEFAULT_SCHEME):
+    """
+    Write a thumbnail for every (entity, info) pair in entities_by_type
+    ({'breeds': [...], 'names': [...]}) using up to `jobs` processes.
+    Returns {type: {entity: path}}, which is also saved to THUMBNAIL_INDEX.
+    """
+    # Load the geometry before forking so the workers share it
+    load_zip_layer()
+
+    tasks = []
+    for entity_type, entities in entities_by_type.items():
+        os.makedirs(f'{THUMBNAIL_DIR}/{entity_type}', exist_ok=True)
+        names = [entity for entity, _ in entities]
+        _, classes = load_class_table(entity_type).select('percentage', scheme, names)
+        tasks += [(entity_type, name, classes[:, column]) for column, name in enumerate(names)]
+
+    print(f"Rendering {len(tasks)} thumbnails with {jobs} job(s)...")
+    if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with multiprocessing.get_context('fork').Pool(jobs, initializer=init_thumbnail_worker) as pool:
+            results = pool.map(render_thumbnail, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+    else:
+        init_thumbnail_worker()
+        results = [render_thumbnail(task) for task in tasks]
+
+    thumbnails = {entity_type: {} for entity_type in entities_by_type}
+    for entity_type, entity, path in results:
+        thumbnails[entity_type][entity] = path
+
+    # Drop thumbnails of earlier builds that nothing references any more
+    current = {path for paths in thumbnails.values() for path in paths.values()}
+    for entity_type in entities_by_type:
+        for name in os.listdir(f'{THUMBNAIL_DIR}/{entity_type}'):
+            if f'{THUMBNAIL_DIR}/{entity_type}/{name}' not in current:
+                os.remove(f'{THUMBNAIL_DIR}/{entity_type}/{name}')
+
+    with atomic_open(THUMBNAIL_INDEX) as f:
+        json.dump(thumbnails, f, indent=1, sort_keys=True)
+    print(f"Thumbnails saved to {THUMBNAIL_DIR}/")
+    return thumbnails
+
+if __name__ == "__main__":
+    import argparse
+    from entity_counts import ENTITY_TYPES, load_entity_data
+
+    parser = argparse.ArgumentParser(description="Render PNG thumbnails of the breed and name maps")
+    parser.add_argument("--min-count", type=int, default=500,
+                        help="minimum number of dogs for an entity to get a thumbnail (default: 500)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes (default: 1)")
+    parser.add_argument("--classification", choices=SCHEMES, default=DEFAULT_SCHEME,
+                        help=f"how map values are binned into colour classes (default: {DEFAULT_SCHEME})")
+    args = parser.parse_args()
+    build_thumbnails({entity_type: [(entity, info) for entity, info in load_entity_data(entity_type).items()
+                                    if info.get('total_count', 0) >= args.min_count]
+                      for entity_type in ENTITY_TYPES}, jobs=args.jobs, scheme=args.classification)
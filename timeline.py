@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Data files for the animated licence-year maps (timeline.html).
+
+Rather than one page per year, the page loads the viewer's zip geometry once
+and, per breed or name, a (years x zips) matrix of the dogs licensed each
+year. Playing the timeline restyles the same layer year by year. The counts of
+every entity, zip and year come from one groupby of the dog records, and each
+entity's colour classes are precomputed with one set of bounds over all its
+years, so colours compare from one year to the next.
+
+Output (under data/timeline/):
+    <type>/index.json       - {"years", "scheme", "shards", "entities": [[name, total, shard], ...]}
+                              sorted by total count
+    <type>/shards/<n>.json  - {name: {"zips", "counts", "classes", "bounds"}}, where zips
+                              lists the zip indices with dogs in any year, and counts and
+                              classes hold one row per year over those zips
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from zip_layer import normalize_zipcode, load_zip_index
+from entity_counts import ENTITY_TYPES, DIMENSION_COLUMNS, load_records
+from classification import DEFAULT_SCHEME, classify_matrix
+from basemap_tiles import write_basemap_config
+from viewer import VIEWER_DIR, VIEWER_SHARDS, encode_classes, get_shard, write_viewer_geometry
+from publish import atomic_open
+
+TIMELINE_DIR = 'data/timeline'
+
+# The licence year of a dog is the year its licence was issued
+YEAR_COLUMN = 'LicenseIssuedDate'
+
+def get_license_years(records):
+    """Licence issue year of each record, or NaN where the date is missing or invalid"""
+    return pd.to_datetime(records[YEAR_COLUMN], errors='coerce').dt.year
+
+def build_year_counts(records, entity_type, zipcodes, min_count=500):
+    """
+    Count the dog records by entity, zip and licence year in one groupby.
+    Returns (entities, totals, years, counts) for the entities with at least
+    min_count dogs, sorted by total, where counts is an (entities x years x
+    zips) array in zip index order.
+    """
+    frame = pd.DataFrame({
+        'entity': records[DIMENSION_COLUMNS[entity_type]],
+        'zipcode': records['ZipCode'].map(normalize_zipcode),
+        'year': get_license_years(records)
+    }).dropna()
+    frame['entity'] = frame['entity'].astype(str)
+
+    totals = frame['entity'].value_counts()
+    totals = totals[totals >= min_count]
+    zip_position = {zipcode: i for i, zipcode in enumerate(zipcodes)}
+    frame['row'] = frame['zipcode'].map(zip_position)
+    frame = frame[frame['row'].notna()]
+    # Years of every mapped dog, so the slider keeps its range even when no entity reaches min_count
+    years = sorted(frame['year'].astype(int).unique().tolist())
+    frame = frame[frame['entity'].isin(totals.index)]
+
+    grouped = frame.groupby(['entity', 'year', 'row']).size()
+    entity_position = {entity: i for i, entity in enumerate(totals.index)}
+    counts = np.zeros((len(totals), len(years), len(zipcodes)))
+    levels = grouped.index
+    # astype keeps the indices integer when no entity reaches min_count and the levels are empty
+    counts[np.asarray(levels.get_level_values('entity').map(entity_position)).astype(int),
+           np.searchsorted(years, levels.get_level_values('year').astype(int)),
+           levels.get_level_values('row').astype(int)] = grouped.to_numpy()
+    return totals.index.tolist(), totals.to_numpy(), years, counts
+
+def write_timeline_vectors(entity_type, entities, totals, years, counts, output_dir=TIMELINE_DIR,
+                           scheme=DEFAULT_SCHEME):
+    """Write the search index and the sharded year x zip counts and classes of each entity"""
+    # One column per entity over all its years, so each entity gets a single set of bounds
+    values = counts.reshape(len(entities), counts.shape[1] * counts.shape[2]).T
+    bounds, classes = classify_matrix(values, values > 0, scheme)
+    classes = classes.T.reshape(counts.shape)
+
+    shards = [{} for _ in range(VIEWER_SHARDS)]
+    index = []
+    for column, entity in enumerate(entities):
+        rows = np.flatnonzero(counts[column].sum(axis=0) > 0)
+        shard = get_shard(entity)
+        shards[shard][entity] = {
+            'zips': rows.tolist(),
+            'counts': counts[column][:, rows].astype(int).tolist(),
+            'classes': [encode_classes(year_classes[rows]) for year_classes in classes[column]],
+            'bounds': [round(float(bound), 2) for bound in bounds[:, column]]
+        }
+        index.append([entity, int(totals[column]), shard])
+
+    type_dir = f'{output_dir}/{entity_type}'
+    os.makedirs(f'{type_dir}/shards', exist_ok=True)
+    for number, shard in enumerate(shards):
+        with atomic_open(f'{type_dir}/shards/{number}.json') as f:
+            json.dump(shard, f, separators=(',', ':'), sort_keys=True)
+
+    with atomic_open(f'{type_dir}/index.json') as f:
+        json.dump({'years': years, 'scheme': scheme, 'shards': VIEWER_SHARDS, 'entities': index},
+                  f, separators=(',', ':'), sort_keys=True)
+
+def build_timeline_data(min_count=500, output_dir=TIMELINE_DIR, scheme=DEFAULT_SCHEME):
+    """Write the licence-year matrices of every breed and name with at least min_count dogs"""
+    print(f"Building licence-year timelines for breeds and names with at least {min_count} dogs...")
+    # The page shares the viewer's zip geometry
+    if not os.path.exists(f'{VIEWER_DIR}/zips.geojson'):
+        os.makedirs(VIEWER_DIR, exist_ok=True)
+        write_viewer_geometry(VIEWER_DIR)
+    write_basemap_config()
+
+    zipcodes = load_zip_index()['zipcodes']
+    records = load_records()
+    for entity_type in ENTITY_TYPES:
+        entities, totals, years, counts = build_year_counts(records, entity_type, zipcodes, min_count)
+        write_timeline_vectors(entity_type, entities, totals, years, counts, output_dir, scheme)
+        print(f"Wrote {len(entities)} {entity_type} timelines over {len(years)} licence years")
+
+    print(f"Timeline data saved to {output_dir}/")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the data of the animated licence-year maps")
+    parser.add_argument("--min-count", type=int, default=500,
+                        help="only include breeds and names with at least this many dogs (default: 500)")
+    args = parser.parse_args()
+    build_timeline_data(min_count=args.min_count)
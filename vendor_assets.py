@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Local, content-hashed copies of the CDN assets the generated pages use.
+
+Scans the generated pages for the Leaflet, jQuery, Bootstrap and folium
+plugin scripts and stylesheets they load from CDNs, downloads each one once
+into static/vendor/ under a name that includes a hash of its contents, and
+rewrites the pages to load the local copies. Fonts and images referenced from
+the stylesheets are vendored the same way. Because a changed asset gets a new
+name, the servers can send static/vendor/ with immutable cache headers.
+
+static/vendor/manifest.json maps each CDN URL to its local file, so later
+builds only download URLs they haven't seen. Pages that aren't written as
+files look their references up in the manifest instead: app.py's templates
+through vendored(url), and the comparison maps when their template is built.
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import posixpath
+import urllib.request
+from urllib.parse import urljoin, urlparse
+
+from publish import atomic_open
+
+VENDOR_DIR = 'static/vendor'
+VENDOR_MANIFEST = f'{VENDOR_DIR}/manifest.json'
+
+# Generated pages, and the source pages served next to them, whose CDN references are rewritten
+GENERATED_PAGES = ['index.html', 'maps', 'heatmaps', 'viewer.html', 'timeline.html', 'static/tile_map.html']
+
+# app.py's templates, rendered with vendored(url) around their CDN references; only scanned for URLs
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Served with "Cache-Control: immutable"; every file name carries its content hash
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+ASSET_URL_PATTERN = re.compile(r'''(?:src|href)=["'](https?://[^"']+?\.(?:js|css))["']''')
+TEMPLATE_URL_PATTERN = re.compile(r'''vendored\(["'](https?://[^"']+?\.(?:js|css))["']\)''')
+CSS_URL_PATTERN = re.compile(r'''url\(\s*["']?([^"')]+?)["']?\s*\)''')
+
+def load_vendor_manifest(path=VENDOR_MANIFEST):
+    """Return {CDN url: vendored file name} from earlier builds"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_vendor_manifest(manifest, path=VENDOR_MANIFEST):
+    with atomic_open(path) as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def hashed_name(url, content):
+    """leaflet.js -> leaflet.<first 10 hex digits of sha256>.js"""
+    stem, extension = posixpath.splitext(posixpath.basename(urlparse(url).path))
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:10]}{extension}'
+
+def download(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+def vendor_asset(url, manifest):
+    """
+    Download url into VENDOR_DIR under its content-hashed name and return the
+    name. Stylesheets have their url(...) references vendored and rewritten first.
+    """
+    name = manifest.get(url)
+    if name is not None and os.path.exists(f'{VENDOR_DIR}/{name}'):
+        return name
+
+    content = download(url)
+    if url.split('?')[0].endswith('.css'):
+        content = vendor_stylesheet_references(url, content.decode('utf-8'), manifest).encode('utf-8')
+
+    name = hashed_name(url, content)
+    with atomic_open(f'{VENDOR_DIR}/{name}', 'wb') as f:
+        f.write(content)
+    manifest[url] = name
+    print(f"Vendored {url} -> {VENDOR_DIR}/{name}")
+    return name
+
+def vendor_stylesheet_references(css_url, css, manifest):
+    """Vendor the fonts and images a stylesheet references and point it at the local copies"""
+    def replace(match):
+        reference = match.group(1)
+        if reference.startswith(('data:', '#')):
+            return match.group(0)
+        # Drop ?v=... and #iefix suffixes; the content hash does their job now
+        asset_url = urljoin(css_url, reference).split('?')[0].split('#')[0]
+        return f'url({vendor_asset(asset_url, manifest)})'
+    return CSS_URL_PATTERN.sub(replace, css)
+
+def iter_pages(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith('.html'):
+                        yield os.path.join(root, name)
+
+def rewrite_references(html, manifest, vendor_url):
+    """Point html's CDN references at the vendored copies under vendor_url (relative to the page, or absolute)"""
+    def replace(match):
+        url = match.group(1)
+        if url not in manifest:
+            return match.group(0)
+        return match.group(0).replace(url, f'{vendor_url}/{manifest[url]}')
+    return ASSET_URL_PATTERN.sub(replace, html)
+
+def rewrite_page(path, manifest, vendor_dir=VENDOR_DIR):
+    """Point a page's CDN references at the vendored copies in vendor_dir; returns True if it changed"""
+    with open(path, 'r', encoding='utf-8') as f:
+        html = f.read()
+
+    vendor_url = os.path.relpath(vendor_dir, os.path.dirname(path) or '.').replace(os.sep, '/')
+    rewritten = rewrite_references(html, manifest, vendor_url)
+    if rewritten == html:
+        return False
+    # Only touch changed pages so their precompressed copies stay valid
+    with atomic_open(path, encoding='utf-8') as f:
+        f.write(rewritten)
+    return True
+
+def vendor_pages(paths=GENERATED_PAGES):
+    """Vendor every CDN script and stylesheet the pages use and rewrite the pages to load them locally"""
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    manifest = load_vendor_manifest()
+
+    pages = list(iter_pages(paths))
+    urls = set()
+    for page in pages:
+        with open(page, 'r', encoding='utf-8') as f:
+            urls.update(ASSET_URL_PATTERN.findall(f.read()))
+    for template in iter_pages([TEMPLATE_DIR]):
+        with open(template, 'r', encoding='utf-8') as f:
+            urls.update(TEMPLATE_URL_PATTERN.findall(f.read()))
+
+    for url in sorted(urls):
+        try:
+            vendor_asset(url, manifest)
+        except Exception as e:
+            # Pages keep the CDN reference for anything that can't be fetched
+            print(f"Could not vendor {url}: {e}", file=sys.stderr)
+    save_vendor_manifest(manifest)
+
+    rewritten = sum(rewrite_page(page, manifest) for page in pages)
+    print(f"Vendored {len(manifest)} assets; rewrote {rewritten} of {len(pages)} pages to use {VENDOR_DIR}/")
+
+if __name__ == "__main__":
+    vendor_pages(sys.argv[1:] or GENERATED_PAGES)
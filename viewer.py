@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Data files for the single-page map viewer (viewer.html).
+
+Instead of one full Leaflet page per breed and name, the viewer loads the zip
+geometry once and each entity as a sparse count vector keyed by zip index.
+Switching entity only restyles the existing layer, with each zip's colour
+class precomputed by classification.py.
+
+Every breed and name in the dog records is covered, not only the popular
+ones. The vectors are counted in one crosstab and stored sparsely, so the
+data grows with the number of dogs rather than entities x zips, and they are
+spread over a fixed number of shard files by a hash of the name. The viewer
+searches a small index and fetches only the shard holding the entity picked.
+
+Output (under data/viewer/):
+    zips.geojson            - simplified zip geometry with zipcode, borough and area
+    <type>/index.json       - {"zipcodes", "scheme", "shards", "entities": [[name, total, shard], ...]}
+                              sorted by total count
+    <type>/shards/<n>.json  - {name: {"zips", "counts", "classes", "bounds"}}, where zips
+                              lists the zip indices with dogs and classes holds one
+                              class digit per listed zip and metric ('-' for no value)
+"""
+
+import os
+import json
+import zlib
+import numpy as np
+
+from zip_layer import ZIPCODE_FIELD, load_zip_layer, load_zip_index
+from entity_counts import ENTITY_TYPES, METRICS, load_records, build_dimension_matrix
+from classification import DEFAULT_SCHEME, NO_CLASS, classify_metrics, load_class_table
+from basemap_tiles import write_basemap_config
+from publish import atomic_open
+
+VIEWER_DIR = 'data/viewer'
+
+# ~10 m in degrees; well below a screen pixel at the zooms the viewer uses
+SIMPLIFY_TOLERANCE = 0.0001
+COORDINATE_DECIMALS = 5
+
+# Fixed, so the number of files doesn't grow with the number of entities
+VIEWER_SHARDS = 64
+
+def write_viewer_geometry(output_dir=VIEWER_DIR):
+    """Write the simplified zip geometry, in canonical zip index order"""
+    zipcode_gdf = load_zip_layer()
+    zip_index = load_zip_index()
+
+    geometry = zipcode_gdf[[ZIPCODE_FIELD, 'geometry']].rename(columns={ZIPCODE_FIELD: 'zipcode'})
+    geometry['geometry'] = geometry.geometry.simplify(SIMPLIFY_TOLERANCE, preserve_topology=True)
+    geometry['borough'] = zip_index['borough']
+    geometry['area_km2'] = zip_index['area_km2']
+
+    # Round coordinates while parsing so the file doesn't carry 15-digit floats
+    geojson = json.loads(geometry.to_json(), parse_float=lambda x: round(float(x), COORDINATE_DECIMALS))
+    for feature in geojson['features']:
+        feature.pop('id', None)
+
+    with atomic_open(f'{output_dir}/zips.geojson') as f:
+        json.dump(geojson, f, separators=(',', ':'), sort_keys=True)
+
+def encode_classes(classes):
+    """One character per zip: the class digit, or '-' where the metric has no value"""
+    return ''.join('-' if cls == NO_CLASS else str(cls) for cls in classes.tolist())
+
+def get_shard(entity):
+    """Shard number of an entity; stable across builds and platforms"""
+    return zlib.crc32(entity.encode('utf-8')) % VIEWER_SHARDS
+
+def write_viewer_vectors(entity_type, entities, totals, counts, output_dir=VIEWER_DIR, scheme=DEFAULT_SCHEME):
+    """
+    Write the search index and the sharded sparse vectors of a (zips x
+    entities) count matrix, with each entity's colour classes and bounds
+    """
+    zip_index = load_zip_index()
+    areas = np.array(zip_index['area_km2'], dtype=float)
+    classes = classify_metrics(counts, areas, schemes=[scheme])
+
+    # Entities with their own map take its stored classes, so both show the same colours
+    # (with the 'fixed' scheme, the long tail's pooled bounds differ from the maps')
+    table = load_class_table(entity_type)
+    shared = [column for column, entity in enumerate(entities) if entity in table.column]
+    for metric in METRICS:
+        bounds, table_classes = table.select(metric, scheme, [entities[column] for column in shared])
+        classes[(metric, scheme)][0][:, shared] = bounds
+        classes[(metric, scheme)][1][:, shared] = table_classes
+
+    shards = [{} for _ in range(VIEWER_SHARDS)]
+    index = []
+    for column, entity in enumerate(entities):
+        rows = np.flatnonzero(counts[:, column] > 0)
+        shard = get_shard(entity)
+        shards[shard][entity] = {
+            'zips': rows.tolist(),
+            'counts': counts[rows, column].astype(int).tolist(),
+            'classes': {metric: encode_classes(classes[(metric, scheme)][1][rows, column]) for metric in METRICS},
+            'bounds': {metric: [round(float(bound), 2) for bound in classes[(metric, scheme)][0][:, column]]
+                       for metric in METRICS}
+        }
+        index.append([entity, int(totals[column]), shard])
+
+    type_dir = f'{output_dir}/{entity_type}'
+    os.makedirs(f'{type_dir}/shards', exist_ok=True)
+    for number, shard in enumerate(shards):
+        with atomic_open(f'{type_dir}/shards/{number}.json') as f:
+            json.dump(shard, f, separators=(',', ':'), sort_keys=True)
+
+    index.sort(key=lambda x: (-x[1], x[0]))
+    with atomic_open(f'{type_dir}/index.json') as f:
+        json.dump({'zipcodes': zip_index['zipcodes'], 'scheme': scheme, 'shards': VIEWER_SHARDS, 'entities': index},
+                  f, separators=(',', ':'), sort_keys=True)
+
+def build_viewer_data(min_count=1, output_dir=VIEWER_DIR, scheme=DEFAULT_SCHEME):
+    """Write the viewer geometry and the vectors of every breed and name with at least min_count dogs"""
+    print(f"Building viewer data for breeds and names with at least {min_count} dogs...")
+    os.makedirs(output_dir, exist_ok=True)
+
+    write_viewer_geometry(output_dir)
+    write_basemap_config()
+    zipcodes = load_zip_index()['zipcodes']
+    records = load_records()
+
+    for entity_type in ENTITY_TYPES:
+        entities, totals, counts = build_dimension_matrix(records, entity_type, zipcodes, min_count)
+        write_viewer_vectors(entity_type, entities, totals, counts, output_dir, scheme)
+        print(f"Wrote {len(entities)} {entity_type} vectors in {VIEWER_SHARDS} shards")
+
+    print(f"Viewer data saved to {output_dir}/")
+
+if __name__ == "__main__":
+    build_viewer_data()
@@ -0,0 +1,164 @@
+"""
+Shared NYC zip code (ZCTA) layer.
+
+Loads the zip code boundaries once per process and provides a spatial-index
+backed locator that maps (lat, lng) points to zip codes in bulk. The build also
+stores the canonical zip index with per-zip areas and boroughs in
+data/zip_index.json, so nothing has to reproject or reclassify the geometry again.
+Both files are read relative to a root directory: the working directory for
+the build scripts, the published snapshot a request is served from for the
+servers. Everything loaded is cached per root.
+"""
+
+import os
+import json
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from publish import atomic_open, cache_for_root
+
+ZIPCODE_FIELD = 'ZCTA'
+ZIP_LAYER_FILE = 'ZCTA.gpkg'
+ZIP_INDEX_FILE = 'data/zip_index.json'
+
+# UTM zone 18N, an equal-enough-area projected CRS in metres for NYC
+AREA_CRS = 'EPSG:32618'
+
+BOROUGHS = ['Manhattan', 'Bronx', 'Brooklyn', 'Queens', 'Staten Island']
+
+# USPS 3-digit zip prefixes for each borough
+BOROUGH_PREFIXES = {
+    '100': 'Manhattan', '101': 'Manhattan', '102': 'Manhattan',
+    '103': 'Staten Island',
+    '104': 'Bronx',
+    '112': 'Brooklyn',
+    '110': 'Queens', '111': 'Queens', '113': 'Queens', '114': 'Queens', '116': 'Queens'
+}
+
+# Westchester zip codes whose ZCTAs extend into the Bronx
+BOROUGH_OVERRIDES = {'10550': 'Bronx', '10803': 'Bronx'}
+
+# {root: zip layer, locator or index loaded from it}
+_zip_layers = {}
+_zip_locators = {}
+_zip_indexes = {}
+
+def zip_path(name, root='.'):
+    """Path of ZIP_LAYER_FILE or ZIP_INDEX_FILE under a root"""
+    return os.path.join(root, name)
+
+def normalize_zipcode(value):
+    """Return a zipcode as a string without any decimal part ('10001.0' -> '10001')"""
+    zip_str = str(value).strip()
+    return zip_str.split('.')[0] if '.' in zip_str else zip_str
+
+def get_zipcode_field(zipcode_gdf):
+    """Identify the zipcode column in a zipcode GeoDataFrame"""
+    if 'postalCode' in zipcode_gdf.columns:
+        return 'postalCode'
+    if 'ZCTA' in zipcode_gdf.columns:
+        return 'ZCTA'
+    # Try to find a suitable zipcode column
+    zipcode_candidates = [col for col in zipcode_gdf.columns if any(x in col.lower() for x in ['zip', 'postal', 'zcta'])]
+    return zipcode_candidates[0] if zipcode_candidates else 'ZCTA'
+
+def load_zip_layer(root='.'):
+    """
+    Load the NYC zipcode boundaries once and return them with a normalized
+    ZCTA column, sorted by zipcode. The row order is the canonical zip index
+    shared by every other consumer of the layer.
+    """
+    def load():
+        from create_heatmaps import get_nyc_zipcode_geojson
+
+        zipcode_gdf = get_nyc_zipcode_geojson(zip_path(ZIP_LAYER_FILE, root))
+        zipcode_field = get_zipcode_field(zipcode_gdf)
+        zipcode_gdf[ZIPCODE_FIELD] = zipcode_gdf[zipcode_field].apply(normalize_zipcode)
+        return zipcode_gdf.sort_values(ZIPCODE_FIELD).reset_index(drop=True)
+    return cache_for_root(_zip_layers, root, load)
+
+def get_borough(zipcode):
+    """Return the borough a zipcode belongs to, or None outside NYC"""
+    zipcode = normalize_zipcode(zipcode)
+    return BOROUGH_OVERRIDES.get(zipcode) or BOROUGH_PREFIXES.get(zipcode[:3])
+
+def build_zip_index(path=None, root='.'):
+    """
+    Write the canonical zip index with each zip's area in km^2 and borough,
+    to ZIP_INDEX_FILE under the root unless a path is given. The reprojection
+    happens here once rather than for every map.
+    """
+    path = path or zip_path(ZIP_INDEX_FILE, root)
+    zipcode_gdf = load_zip_layer(root)
+    areas = zipcode_gdf.geometry.to_crs(AREA_CRS).area / 1e6
+
+    zip_index = {
+        'zipcodes': zipcode_gdf[ZIPCODE_FIELD].tolist(),
+        'area_km2': [round(float(area), 4) for area in areas],
+        'borough': [get_borough(zipcode) for zipcode in zipcode_gdf[ZIPCODE_FIELD]]
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_open(path) as f:
+        json.dump(zip_index, f, sort_keys=True)
+
+    print(f"Saved zip index with areas for {len(areas)} zip codes to {path}")
+    _zip_indexes[root] = zip_index
+    return zip_index
+
+def load_zip_index(root='.'):
+    """Return the stored zip index, building it on first use if needed"""
+    def load():
+        zip_index = None
+        if os.path.exists(zip_path(ZIP_INDEX_FILE, root)):
+            with open(zip_path(ZIP_INDEX_FILE, root), 'r') as f:
+                zip_index = json.load(f)
+        if zip_index is None or 'borough' not in zip_index:
+            zip_index = build_zip_index(root=root)
+        return zip_index
+    return cache_for_root(_zip_indexes, root, load)
+
+def get_zip_areas(root='.'):
+    """Return {zipcode: area in km^2}"""
+    zip_index = load_zip_index(root)
+    return dict(zip(zip_index['zipcodes'], zip_index['area_km2']))
+
+def get_zip_boroughs(root='.'):
+    """Return {zipcode: borough} from the zip -> borough -> city hierarchy"""
+    zip_index = load_zip_index(root)
+    return dict(zip(zip_index['zipcodes'], zip_index['borough']))
+
+class ZipLocator:
+    """Point-in-polygon lookup of zip codes backed by an STRtree"""
+
+    def __init__(self, zipcode_gdf):
+        self.zipcodes = zipcode_gdf[ZIPCODE_FIELD].to_numpy(dtype=object)
+        self.tree = STRtree(zipcode_gdf.geometry.values)
+
+    def locate(self, lats, lngs):
+        """
+        Map arrays of latitudes and longitudes to zip codes.
+        Returns an object array with None for points outside every zip.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        result = np.full(len(lats), None, dtype=object)
+
+        valid = np.isfinite(lats) & np.isfinite(lngs)
+        if not valid.any():
+            return result
+
+        point_idx, zip_idx = self.tree.query(shapely.points(lngs[valid], lats[valid]), predicate='intersects')
+
+        # Points on a shared border match several zips; keep the first match
+        first_idx, first_pos = np.unique(point_idx, return_index=True)
+        result[np.flatnonzero(valid)[first_idx]] = self.zipcodes[zip_idx[first_pos]]
+        return result
+
+    def locate_one(self, lat, lng):
+        """Return the zip code containing a single point, or None"""
+        return self.locate([lat], [lng])[0]
+
+def get_zip_locator(root='.'):
+    """Return the ZipLocator of a root's zip layer, building it on first use"""
+    return cache_for_root(_zip_locators, root, lambda: ZipLocator(load_zip_layer(root)))